@@ -0,0 +1,167 @@
+"""
+asyncio front end for translators
+
+AsyncTranslator lets asyncio applications convert words without
+blocking the event loop.  Conversions requested concurrently are
+coalesced into batches, which are run on a pool of worker threads
+sharing the loaded model; the translator releases the interpreter lock
+while searching, so the workers do run in parallel.
+"""
+
+from __future__ import print_function
+
+__copyright__ = "Copyright (c) 2026  Sequitur G2P contributors"
+__license__ = """
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License Version 2 (June
+1991) as published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, you will find it at
+http://www.gnu.org/licenses/gpl.html, or write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110,
+USA.
+
+Should a provision of no. 9 and 10 of the GNU General Public License
+be invalid or become invalid, a valid provision is deemed to have been
+agreed upon which comes closest to what the parties intended
+commercially. In any case guarantee/warranty shall be limited to gross
+negligent actions or intended actions or fraudulent concealment.
+"""
+
+
+
+import asyncio, concurrent.futures, copy, functools
+from sequitur import Translator
+
+
+class AsyncTranslator:
+    """
+    Awaitable wrapper of translator.  translate() converts one word,
+    nbest() iterates over its pronunciation variants.
+
+    Words requested while all workers are busy are collected and
+    converted in a single translateBatch() call (at most maxBatchSize
+    at a time) as soon as a worker becomes idle.  N-best requests wait
+    in the same queue and are run one at a time, each taking a worker
+    like a batch, so that they never keep batches from being started.
+    At most maxPending requests are admitted at any time; further ones
+    wait before being queued, which bounds both memory and the latency
+    of each request.
+
+    An AsyncTranslator belongs to the event loop it is first used in.
+    """
+
+    TranslationFailure = Translator.TranslationFailure
+    maxBatchSize = 256
+
+    def __init__(self, translator, workers=1, maxPending=1024):
+        self.translator = translator
+        self.workers = workers
+        self.maxPending = maxPending
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.queued = []
+        self.busy = 0
+        self.slots = None
+        self.batches = 0
+
+    def __getattr__(self, name):
+        return getattr(self.translator, name)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def admission(self):
+        # created on first use, so that it belongs to the running loop
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.maxPending)
+        return self.slots
+
+    async def firstBest(self, left):
+        """
+        The most probable translation of left as a pair (logLik, right).
+        """
+        slots = self.admission()
+        async with slots:
+            future = asyncio.get_running_loop().create_future()
+            self.queued.append((tuple(left), future, None))
+            self.dispatch()
+            return await future
+
+    async def translate(self, left):
+        logLik, right = await self.firstBest(left)
+        return right
+
+    def nBestJob(self, left, k, mass):
+        return [self.translator.nBest(left, k, mass)]
+
+    def dispatch(self):
+        while self.queued and self.busy < self.workers:
+            left, future, nBest = self.queued[0]
+            if nBest is not None:
+                del self.queued[0]
+                batch = [(left, future)]
+                job = functools.partial(self.nBestJob, left, *nBest)
+            else:
+                batch, rest = [], []
+                for left, future, nBest in self.queued:
+                    if nBest is None and len(batch) < self.maxBatchSize:
+                        batch.append((left, future))
+                    else:
+                        rest.append((left, future, nBest))
+                self.queued = rest
+                self.batches += 1
+                job = functools.partial(
+                    self.translator.translateBatch, [left for left, future in batch]
+                )
+            self.busy += 1
+            done = asyncio.get_running_loop().run_in_executor(self.executor, job)
+            done.add_done_callback(lambda done, batch=batch: self.finish(done, batch))
+
+    def finish(self, done, batch):
+        self.busy -= 1
+        if done.cancelled():
+            results = [asyncio.CancelledError() for request in batch]
+        elif done.exception() is not None:
+            # each caller gets an exception of its own to raise
+            exc = done.exception()
+            results = [copy.copy(exc) for request in batch]
+            for result in results:
+                result.__cause__ = exc
+        else:
+            results = done.result()
+        for (left, future), result in zip(batch, results):
+            if future.done():  # the caller gave up waiting
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        self.dispatch()
+
+    async def nbest(self, left, k=None, mass=None):
+        """
+        Iterate over the k most probable translations of left, or as
+        many as needed for their total posterior to reach mass, as
+        (posterior, right) pairs in order of decreasing probability
+        (see Translator.nBest).
+        """
+        slots = self.admission()
+        async with slots:
+            future = asyncio.get_running_loop().create_future()
+            self.queued.append((tuple(left), future, (k, mass)))
+            self.dispatch()
+            variants = await future
+        for variant in variants:
+            yield variant
@@ -38,6 +38,8 @@ using std::tr1::unordered_map;
 #include <vector>
 #include <stdexcept>
 #include <memory>
+#include <thread>
+#include <exception>
 
 #include "Multigram.hh"
 #include "MultigramGraph.hh"
@@ -46,9 +48,12 @@ using std::tr1::unordered_map;
 #include "Utility.hh"
 
 class SequenceModelEstimator;
+class EstimationGraph;
+typedef std::vector<EstimationGraph*> EstimationGraphList;
 
 class EstimationGraph : public MultigramGraph {
   friend class EstimationGraphBuilder;
+  friend class EstimationGraphStore;
   friend class Accumulator;
   friend class ViterbiAccumulator;
   friend class OneForAllAccumulator;
@@ -136,6 +141,167 @@ void EstimationGraph::updateProbabilities(const SequenceModel *sm) {
   }
 }
 
+// ===========================================================================
+/**
+ * Many estimation graphs packed into a few flat arrays.
+ *
+ * The nodes of each graph are numbered in topological order, so the
+ * initial node comes first and the final node last.  Edges are sorted
+ * by target, and an index array lists them grouped by source.  Node
+ * and edge numbers are local to their graph and only 16 bits wide.
+ *
+ * Memory complexity: V * 12 bytes  +  E * 18 bytes,
+ * without any per-graph allocations.
+ */
+class EstimationGraphStore {
+  public:
+    typedef u16 LocalId;
+    static const u32 maxLocalId = 0xffff;
+
+    struct Edge {
+      LocalId source, target;
+      SequenceModel::Token token;
+    };
+
+    /** Read-only view of one graph in the store. */
+    struct Entry {
+      u32 nNodes, nEdges;
+      const SequenceModel::History *histories;
+      const LocalId *incomingEnd;   /**< per node: end of its incoming edges */
+      const LocalId *outgoingEnd;   /**< per node: end of its entries in outgoing */
+      const LocalId *outgoing;      /**< edge numbers grouped by source */
+      const Edge *edges;
+      const LogProbability *probabilities;
+
+      u32 initial() const { return 0; }
+      u32 final() const { return nNodes - 1; }
+      u32 incomingBegin(u32 n) const { return (n) ? incomingEnd[n - 1] : 0; }
+      u32 outgoingBegin(u32 n) const { return (n) ? outgoingEnd[n - 1] : 0; }
+    };
+
+  private:
+    std::vector<u32> nodesBegin_, edgesBegin_;
+    std::vector<SequenceModel::History> histories_;
+    std::vector<LocalId> incomingEnd_, outgoingEnd_;
+    std::vector<LocalId> outgoing_;
+    std::vector<Edge> edges_;
+    std::vector<LogProbability> probabilities_;
+
+  public:
+    EstimationGraphStore() {
+      nodesBegin_.push_back(0);
+      edgesBegin_.push_back(0);
+    }
+
+    size_t size() const {
+      return nodesBegin_.size() - 1;
+    }
+
+    Entry operator[](size_t i) const {
+      require_(i < size());
+      Entry result;
+      u32 n = nodesBegin_[i], e = edgesBegin_[i];
+      result.nNodes        = nodesBegin_[i + 1] - n;
+      result.nEdges        = edgesBegin_[i + 1] - e;
+      result.histories     = &histories_[n];
+      result.incomingEnd   = &incomingEnd_[n];
+      result.outgoingEnd   = &outgoingEnd_[n];
+      result.outgoing      = &outgoing_[e];
+      result.edges         = &edges_[e];
+      result.probabilities = &probabilities_[e];
+      return result;
+    }
+
+    /**
+     * Append a copy of an estimation graph.
+     * @return false if the graph is too big to be stored
+     */
+    bool add(const EstimationGraph *eg) {
+      const EstimationGraph::NodeList &order(eg->nodesInTopologicalOrder_);
+      u32 nNodes = order.size(), nEdges = eg->graph_.nEdges() - 1;
+      if (nNodes > maxLocalId || nEdges > maxLocalId)
+        return false;
+      verify(order.front() == eg->initial_);
+      verify(order.back()  == eg->final_);
+
+      std::vector<LocalId> local(eg->graph_.nNodes());
+      for (u32 n = 0; n < nNodes; ++n)
+        local[order[n]] = n;
+
+      u32 edgesBegin = edges_.size();
+      std::vector<LocalId> nOutgoing(nNodes, 0);
+      for (u32 n = 0; n < nNodes; ++n) {
+        histories_.push_back(eg->histories_[order[n]]);
+        for (Graph::IncomingEdgeIterator e = eg->graph_.incomingEdges(order[n]); e; ++e) {
+          Edge edge;
+          edge.source = local[eg->graph_.source(*e)];
+          edge.target = n;
+          edge.token  = eg->token_[*e];
+          edges_.push_back(edge);
+          probabilities_.push_back(eg->probability_[*e]);
+          ++nOutgoing[edge.source];
+        }
+        incomingEnd_.push_back(edges_.size() - edgesBegin);
+      }
+
+      u32 end = 0;
+      for (u32 n = 0; n < nNodes; ++n) {
+        end += nOutgoing[n];
+        outgoingEnd_.push_back(end);
+        nOutgoing[n] = end - nOutgoing[n];
+      }
+      outgoing_.resize(edges_.size());
+      for (u32 e = 0; e < nEdges; ++e)
+        outgoing_[edgesBegin + nOutgoing[edges_[edgesBegin + e].source]++] = e;
+
+      nodesBegin_.push_back(histories_.size());
+      edgesBegin_.push_back(edges_.size());
+      return true;
+    }
+
+    /** Recompute histories and edge probabilities for a new model. */
+    void update(const SequenceModel *sm) {
+      for (size_t i = 0; i < size(); ++i) {
+        SequenceModel::History *histories = &histories_[nodesBegin_[i]];
+        const Edge *edges = &edges_[edgesBegin_[i]];
+        LogProbability *probabilities = &probabilities_[edgesBegin_[i]];
+        u32 final = nodesBegin_[i + 1] - nodesBegin_[i] - 1;
+        u32 nEdges = edgesBegin_[i + 1] - edgesBegin_[i];
+        histories[0] = sm->initial();
+        histories[final] = sm->culDeSac();
+        // Edges are sorted by target, and sources precede their targets.
+        for (u32 e = 0; e < nEdges; ++e) {
+          if (edges[e].target != final)
+            histories[edges[e].target] = sm->advanced(histories[edges[e].source], edges[e].token);
+          probabilities[e] = sm->probability(edges[e].token, histories[edges[e].source]);
+        }
+      }
+    }
+
+    /** Release excess capacity. */
+    void yield() {
+      shrink(nodesBegin_); shrink(edgesBegin_);
+      shrink(histories_); shrink(incomingEnd_); shrink(outgoingEnd_);
+      shrink(outgoing_); shrink(edges_); shrink(probabilities_);
+    }
+
+    size_t memoryUsed() const {
+      return sizeof(EstimationGraphStore)
+        + (nodesBegin_.capacity() + edgesBegin_.capacity()) * sizeof(u32)
+        + histories_.capacity() * sizeof(SequenceModel::History)
+        + (incomingEnd_.capacity() + outgoingEnd_.capacity() + outgoing_.capacity()) * sizeof(LocalId)
+        + edges_.capacity() * sizeof(Edge)
+        + probabilities_.capacity() * sizeof(LogProbability);
+    }
+
+  private:
+    template <typename T>
+    static void shrink(std::vector<T> &v) {
+      std::vector<T> tmp(v);
+      v.swap(tmp);
+    }
+};
+
 // ===========================================================================
 class EvidenceStore {
   public:
@@ -166,10 +332,14 @@ class EvidenceStore {
   public:
     EvidenceStore() : sequenceModel_(0) {}
 
-    void setSequenceModel(SequenceModel *sm) {
+    void setSequenceModel(const SequenceModel *sm) {
       sequenceModel_ = sm;
     }
 
+    const SequenceModel *sequenceModel() const {
+      return sequenceModel_;
+    }
+
     void accumulate(
         SequenceModel::History history,
         SequenceModel::Token token,
@@ -195,6 +365,50 @@ class EvidenceStore {
       return result;
     }
 
+    /** Add evidence given in the format produced by asList().  Used
+     * to merge partial stores accumulated elsewhere (e.g. in another
+     * process) into this one. */
+    void accumulateList(PyObject *list) {
+      require(sequenceModel_);
+      if (!PySequence_Check(list))
+        throw PythonException(PyExc_TypeError, "not a sequence");
+      std::vector<SequenceModel::Token> history;
+      Py_ssize_t len = PySequence_Length(list);
+      for (Py_ssize_t i = 0; i < len; ++i) {
+        PyObject *item = PySequence_GetItem(list, i);
+        PyObject *tuple = NULL;
+        int token;
+        double value;
+        if (!PyArg_ParseTuple(item, "Oid", &tuple, &token, &value)) {
+          Py_DECREF(item);
+          throw ExistingPythonException();
+        }
+        if (!PyTuple_Check(tuple)) {
+          Py_DECREF(item);
+          throw PythonException(PyExc_TypeError, "not a tuple");
+        }
+        Py_ssize_t tupleSize = PyTuple_GET_SIZE(tuple);
+        history.resize(tupleSize);
+        for (Py_ssize_t j = 0; j < tupleSize; ++j)
+          history[j] = PyInt_AsLong(PyTuple_GET_ITEM(tuple, j));
+        Py_DECREF(item);
+        if (PyErr_Occurred())
+          throw ExistingPythonException();
+        Event ev;
+        ev.history = sequenceModel_->history(history);
+        ev.token   = token;
+        evidence_[ev] += Probability(value);
+      }
+    }
+
+    /** Add all evidence of another store referring to the same
+     * sequence model. */
+    void merge(const EvidenceStore &other) {
+      require(other.sequenceModel_ == sequenceModel_);
+      for (Store::const_iterator ev = other.evidence_.begin(); ev != other.evidence_.end(); ++ev)
+        evidence_[ev->first] += ev->second;
+    }
+
     size_t size() const {
       return evidence_.size();
     }
@@ -242,6 +456,31 @@ class Accumulator {
 
   ProbabilityAccumulator accu_;
   NodeMap<LogProbability> forw_, bckw_;
+  std::vector<LogProbability> entryForw_, entryBckw_;
+
+  void forward(const EstimationGraphStore::Entry &eg) {
+    entryForw_.resize(eg.nNodes);
+    entryForw_[eg.initial()] = LogProbability::certain();
+    for (u32 n = eg.initial() + 1; n < eg.nNodes; ++n) {
+      accu_.clear();
+      for (u32 e = eg.incomingBegin(n); e < eg.incomingEnd[n]; ++e)
+        accu_.add(entryForw_[eg.edges[e].source] * eg.probabilities[e]);
+      entryForw_[n] = accu_.sum();
+    }
+  }
+
+  void backward(const EstimationGraphStore::Entry &eg) {
+    entryBckw_.resize(eg.nNodes);
+    entryBckw_[eg.final()] = LogProbability::certain();
+    for (u32 n = eg.final(); n-- > 0;) {
+      accu_.clear();
+      for (u32 i = eg.outgoingBegin(n); i < eg.outgoingEnd[n]; ++i) {
+        u32 e = eg.outgoing[i];
+        accu_.add(entryBckw_[eg.edges[e].target] * eg.probabilities[e]);
+      }
+      entryBckw_[n] = accu_.sum();
+    }
+  }
 
   void forward(EstimationGraph *eg) {
     forw_[eg->initial_] = LogProbability::certain();
@@ -308,6 +547,32 @@ class Accumulator {
     return total;
   }
 
+  LogProbability accumulate(const EstimationGraphStore::Entry &eg, LogProbability weight) {
+    forward(eg);
+    backward(eg);
+    LogProbability total = (entryForw_[eg.final()] * entryBckw_[eg.initial()]).pow(0.5);
+    for (u32 e = 0; e < eg.nEdges; ++e) {
+      const EstimationGraphStore::Edge &edge(eg.edges[e]);
+      LogProbability post
+        = entryForw_[edge.source]
+        * eg.probabilities[e]
+        * entryBckw_[edge.target]
+        / total;
+      target_->accumulate(eg.histories[edge.source], edge.token, weight * post);
+    }
+    return total;
+  }
+
+  double accumulateMany(const EstimationGraphList&, LogProbability weight, u32 nThreads);
+  double accumulateStore(const EstimationGraphStore&, LogProbability weight, u32 nThreads);
+  double logLikMany(const EstimationGraphList&, u32 nThreads);
+  double logLikStore(const EstimationGraphStore&, u32 nThreads);
+
+  LogProbability logLik(const EstimationGraphStore::Entry &eg) {
+    forward(eg);
+    return entryForw_[eg.final()];
+  }
+
   LogProbability logLik(EstimationGraph *eg) {
     forw_.sync(&eg->graph_); forward(eg);
 #if 1
@@ -324,6 +589,27 @@ class ViterbiAccumulator {
 
   NodeMap<LogProbability> forw_;
   NodeMap<Graph::EdgeId> back_;
+  std::vector<LogProbability> entryForw_;
+  std::vector<u32> entryBack_;
+
+  void forward(const EstimationGraphStore::Entry &eg) {
+    entryForw_.resize(eg.nNodes);
+    entryBack_.resize(eg.nNodes);
+    entryForw_[eg.initial()] = LogProbability::certain();
+    for (u32 n = eg.initial() + 1; n < eg.nNodes; ++n) {
+      LogProbability bestProb = LogProbability::impossible();
+      u32 bestBack = eg.incomingBegin(n);
+      for (u32 e = eg.incomingBegin(n); e < eg.incomingEnd[n]; ++e) {
+        LogProbability f = entryForw_[eg.edges[e].source] * eg.probabilities[e];
+        if (bestProb < f) {
+          bestProb = f;
+          bestBack = e;
+        }
+      }
+      entryForw_[n] = bestProb;
+      entryBack_[n] = bestBack;
+    }
+  }
 
   void forward(EstimationGraph *eg) {
     forw_[eg->initial_] = LogProbability::certain();
@@ -362,6 +648,26 @@ class ViterbiAccumulator {
     return forw_[eg->final_];
   }
 
+  LogProbability accumulate(const EstimationGraphStore::Entry &eg, LogProbability weight) {
+    forward(eg);
+    for (u32 n = eg.final(); n != eg.initial();) {
+      const EstimationGraphStore::Edge &edge(eg.edges[entryBack_[n]]);
+      target_->accumulate(eg.histories[edge.source], edge.token, weight);
+      n = edge.source;
+    }
+    return entryForw_[eg.final()];
+  }
+
+  double accumulateMany(const EstimationGraphList&, LogProbability weight, u32 nThreads);
+  double accumulateStore(const EstimationGraphStore&, LogProbability weight, u32 nThreads);
+  double logLikMany(const EstimationGraphList&, u32 nThreads);
+  double logLikStore(const EstimationGraphStore&, u32 nThreads);
+
+  LogProbability logLik(const EstimationGraphStore::Entry &eg) {
+    forward(eg);
+    return entryForw_[eg.final()];
+  }
+
   LogProbability logLik(EstimationGraph *eg) {
     forw_.sync(&eg->graph_); back_.sync(&eg->graph_); forward(eg);
     return forw_[eg->final_];
@@ -395,8 +701,161 @@ class OneForAllAccumulator {
       target_->accumulate(eg->histories_[eg->graph_.source(e)], eg->token_[e], weight);
     }
   }
+
+  void accumulate(const EstimationGraphStore::Entry &eg, LogProbability weight) {
+    for (u32 e = 0; e < eg.nEdges; ++e)
+      target_->accumulate(eg.histories[eg.edges[e].source], eg.edges[e].token, weight);
+  }
+
+  void accumulateMany(const EstimationGraphList&, LogProbability weight, u32 nThreads);
+  void accumulateStore(const EstimationGraphStore&, LogProbability weight, u32 nThreads);
 };
 
+namespace {
+  template <class A, class G>
+  LogProbability accumulateOne(A &accumulator, const G &eg, LogProbability weight) {
+    return accumulator.accumulate(eg, weight);
+  }
+
+  template <class G>
+  LogProbability accumulateOne(OneForAllAccumulator &accumulator, const G &eg, LogProbability weight) {
+    accumulator.accumulate(eg, weight);
+    return LogProbability::certain();
+  }
+
+  /** Number of threads to use for nItems; zero requests one per core. */
+  u32 threadCount(size_t nItems, u32 nThreads) {
+    if (!nThreads)
+      nThreads = std::max(1u, std::thread::hardware_concurrency());
+    return std::max<size_t>(1, std::min<size_t>(nThreads, nItems));
+  }
+
+  /**
+   * Call work(t, begin, end) for nThreads contiguous slices of
+   * [0, nItems), each in its own native thread (the last one in the
+   * calling thread).  Exceptions are passed on to the caller.
+   */
+  template <class Work>
+  void runInThreads(size_t nItems, u32 nThreads, Work work) {
+    std::vector<std::exception_ptr> errors(nThreads);
+    std::vector<std::thread> threads;
+    for (u32 t = 0; t < nThreads; ++t) {
+      auto slice = [&, t]() {
+        try {
+          work(t, nItems * t / nThreads, nItems * (t + 1) / nThreads);
+        } catch (...) {
+          errors[t] = std::current_exception();
+        }
+      };
+      if (t + 1 < nThreads)
+        threads.push_back(std::thread(slice));
+      else
+        slice();
+    }
+    for (u32 t = 0; t < threads.size(); ++t)
+      threads[t].join();
+    for (u32 t = 0; t < nThreads; ++t)
+      if (errors[t])
+        std::rethrow_exception(errors[t]);
+  }
+
+  double totalLogLik(const std::vector<LogProbability> &logLiks) {
+    double result = 0.0;
+    for (size_t i = 0; i < logLiks.size(); ++i)
+      result -= logLiks[i].score();
+    return result;
+  }
+
+  /**
+   * Accumulate evidence from many graphs using several native threads.
+   * Each thread works on a contiguous slice of the graphs with its own
+   * accumulator and EvidenceStore.  The stores are merged into the
+   * target in slice order and the log-likelihoods are summed in graph
+   * order, so the result does not depend on thread scheduling.  Does
+   * not touch any Python objects, so it may run without the GIL.
+   * Graphs is either an EstimationGraphList or an EstimationGraphStore.
+   * @return sum of the log-likelihoods of all graphs
+   */
+  template <class A, class Graphs>
+  double accumulateInThreads(
+      EvidenceStore *target,
+      const Graphs &graphs,
+      LogProbability weight,
+      u32 nThreads)
+  {
+    require(target);
+    nThreads = threadCount(graphs.size(), nThreads);
+    std::vector<LogProbability> logLiks(graphs.size());
+    std::vector<EvidenceStore> stores((nThreads > 1) ? nThreads : 0);
+    runInThreads(graphs.size(), nThreads, [&](u32 t, size_t begin, size_t end) {
+        A accumulator;
+        if (stores.empty()) {
+          accumulator.setTarget(target);
+        } else {
+          stores[t].setSequenceModel(target->sequenceModel());
+          accumulator.setTarget(&stores[t]);
+        }
+        for (size_t i = begin; i < end; ++i)
+          logLiks[i] = accumulateOne(accumulator, graphs[i], weight);
+      });
+    for (u32 t = 0; t < stores.size(); ++t)
+      target->merge(stores[t]);
+    return totalLogLik(logLiks);
+  }
+
+  /** Like accumulateInThreads(), but only computes log-likelihoods. */
+  template <class A, class Graphs>
+  double logLikInThreads(const Graphs &graphs, u32 nThreads) {
+    std::vector<LogProbability> logLiks(graphs.size());
+    runInThreads(graphs.size(), threadCount(graphs.size(), nThreads), [&](u32, size_t begin, size_t end) {
+        A accumulator;
+        for (size_t i = begin; i < end; ++i)
+          logLiks[i] = accumulator.logLik(graphs[i]);
+      });
+    return totalLogLik(logLiks);
+  }
+} // namespace
+
+double Accumulator::accumulateStore(const EstimationGraphStore &graphs, LogProbability weight, u32 nThreads) {
+  return accumulateInThreads<Accumulator>(target_, graphs, weight, nThreads);
+}
+
+double Accumulator::logLikStore(const EstimationGraphStore &graphs, u32 nThreads) {
+  return logLikInThreads<Accumulator>(graphs, nThreads);
+}
+
+double ViterbiAccumulator::accumulateStore(const EstimationGraphStore &graphs, LogProbability weight, u32 nThreads) {
+  return accumulateInThreads<ViterbiAccumulator>(target_, graphs, weight, nThreads);
+}
+
+double ViterbiAccumulator::logLikStore(const EstimationGraphStore &graphs, u32 nThreads) {
+  return logLikInThreads<ViterbiAccumulator>(graphs, nThreads);
+}
+
+void OneForAllAccumulator::accumulateStore(const EstimationGraphStore &graphs, LogProbability weight, u32 nThreads) {
+  accumulateInThreads<OneForAllAccumulator>(target_, graphs, weight, nThreads);
+}
+
+double Accumulator::accumulateMany(const EstimationGraphList &graphs, LogProbability weight, u32 nThreads) {
+  return accumulateInThreads<Accumulator>(target_, graphs, weight, nThreads);
+}
+
+double Accumulator::logLikMany(const EstimationGraphList &graphs, u32 nThreads) {
+  return logLikInThreads<Accumulator>(graphs, nThreads);
+}
+
+double ViterbiAccumulator::logLikMany(const EstimationGraphList &graphs, u32 nThreads) {
+  return logLikInThreads<ViterbiAccumulator>(graphs, nThreads);
+}
+
+double ViterbiAccumulator::accumulateMany(const EstimationGraphList &graphs, LogProbability weight, u32 nThreads) {
+  return accumulateInThreads<ViterbiAccumulator>(target_, graphs, weight, nThreads);
+}
+
+void OneForAllAccumulator::accumulateMany(const EstimationGraphList &graphs, LogProbability weight, u32 nThreads) {
+  accumulateInThreads<OneForAllAccumulator>(target_, graphs, weight, nThreads);
+}
+
 // ===========================================================================
 class EstimationGraphBuilder :
   public GraphSorter
@@ -441,6 +900,7 @@ class EstimationGraphBuilder :
     SequenceModel *sequenceModel_;
   public:
     void setSequenceModel(MultigramInventory *mi, SequenceModel *sm) {
+      if (mi != inventory_) leftTrie_.clear();
       inventory_ = mi;
       sequenceModel_ = sm;
     }
@@ -449,6 +909,18 @@ class EstimationGraphBuilder :
     Sequence left_, right_;
     EstimationGraph *target_;
 
+    /** Only used when new multigrams are suppressed. */
+    LeftMultigramTrie leftTrie_;
+    u32 leftMatchesPos_, leftMatches_;
+
+    u32 leftMatches(u32 pos) {
+      if (pos != leftMatchesPos_) {
+        leftMatchesPos_ = pos;
+        leftMatches_ = leftTrie_.matchingLengths(left_.data() + pos, left_.data() + left_.size());
+      }
+      return leftMatches_;
+    }
+
     struct NodeDesc {
       struct {
         u32 left, right;
@@ -492,6 +964,9 @@ class EstimationGraphBuilder :
       next.position.right = current.position.right + st->right;
       if (next.position.right > right_.size())
         return false;
+      if (multigramEmergence_ == suppressNewMultigrams &&
+          !(leftMatches(current.position.left) & (1u << st->left)))
+        return false;
 
       JointMultigram jmg(
           &left_ [current.position.left ], &left_ [next.position.left ],
@@ -576,13 +1051,18 @@ class EstimationGraphBuilder :
       multigramEmergence_(emergeNewMultigrams),
       inventory_(0),
       sequenceModel_(0),
-      target_(0)
+      target_(0),
+      leftMatchesPos_(u32(-1)), leftMatches_(0)
   {}
 
     void build(EstimationGraph *eg, const Sequence &left, const Sequence &right) {
       left_   = left;
       right_  = right;
       target_ = eg;
+      if (multigramEmergence_ == suppressNewMultigrams &&
+          leftTrie_.inventorySize() != inventory_->size())
+        leftTrie_.build(*inventory_);
+      leftMatchesPos_ = u32(-1);
 
       target_->graph_.clear();
       target_->initial_ = target_->final_ = 0;
@@ -645,7 +1125,8 @@ class EstimationGraphBuilder :
         + right_.capacity() * sizeof(Sequence::value_type)
         + nodeStates_.size() * sizeof(NodeStateMapNode)
         + nodeStates_.bucket_count() * sizeof(NodeStateMapNode*)
-        + stack_.capacity() * sizeof(DfsStack::value_type);
+        + stack_.capacity() * sizeof(DfsStack::value_type)
+        + leftTrie_.memoryUsed() - sizeof(LeftMultigramTrie);
     }
 
 };
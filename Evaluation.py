@@ -206,16 +206,29 @@ class Evaluator(object):
     def setSample(self, sample):
         self.sources, self.references = collateSample(sample)
 
+    def translate(self, translator):
+        if hasattr(translator, "translateBatch"):
+            for result in translator.translateBatch(self.sources):
+                if isinstance(result, translator.TranslationFailure):
+                    yield None
+                else:
+                    logLik, candidate = result
+                    yield candidate
+        else:
+            for source in self.sources:
+                try:
+                    yield translator(source)
+                except translator.TranslationFailure:
+                    yield None
+
     def evaluate(self, translator):
         result = Result(tableFile=self.resultFile)
-        for source in self.sources:
+        for source, candidate in zip(self.sources, self.translate(translator)):
             references = self.references[source]
             if self.compareFilter:
                 references = map(self.compareFilter, references)
 
-            try:
-                candidate = translator(source)
-            except translator.TranslationFailure:
+            if candidate is None:
                 result.accuFailure(references[0])
                 continue
 
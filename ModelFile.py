@@ -0,0 +1,153 @@
+"""
+Memory-mappable binary model files
+
+A binary model file starts with a fixed header, followed by the symbol
+and multigram inventories (encoded as JSON) and the binary image of
+the sequence model as produced by SequenceModel.getBinary().  The
+sequence model is used in place from a read-only memory map, so
+loading is cheap and all processes using the same model file share a
+single copy in the page cache.  The image is in native byte order;
+files are not portable between platforms of different endianness.
+"""
+
+__copyright__ = "Copyright (c) 2026  Sequitur G2P contributors"
+__license__ = """
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License Version 2 (June
+1991) as published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, you will find it at
+http://www.gnu.org/licenses/gpl.html, or write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110,
+USA.
+
+Should a provision of no. 9 and 10 of the GNU General Public License
+be invalid or become invalid, a valid provision is deemed to have been
+agreed upon which comes closest to what the parties intended
+commercially. In any case guarantee/warranty shall be limited to gross
+negligent actions or intended actions or fraudulent concealment.
+"""
+
+
+import hashlib, json, mmap, struct, sys
+import numpy as num
+import SequenceModel
+from sequitur import Model, Sequitur
+from symbols import SymbolInventory
+
+magic = b"SEQUITUR"
+formatVersion = 1
+headerFormat = "<8sIIQQQ"
+headerSize = struct.calcsize(headerFormat)
+
+
+def isBinaryModelFile(fname):
+    f = open(fname, "rb")
+    try:
+        return f.read(len(magic)) == magic
+    finally:
+        f.close()
+
+
+def encodeInventories(model):
+    sequitur = model.sequitur
+    multigrams = [
+        sequitur.inventory.symbol(i) for i in range(1, sequitur.inventory.size() + 1)
+    ]
+    meta = {
+        "left": sequitur.leftInventory.list,
+        "right": sequitur.rightInventory.list,
+        "multigrams": multigrams,
+        "term": sequitur.term,
+    }
+    if model.discount is not None:
+        meta["discount"] = [float(d) for d in model.discount]
+    return json.dumps(meta).encode("utf-8")
+
+
+def fingerprint(model):
+    """
+    Content hash of the model as it would be written by save().  It
+    does not depend on whether the model was pickled or binary.
+    """
+    result = hashlib.sha256()
+    result.update(encodeInventories(model))
+    result.update(model.sequenceModel.getBinary())
+    return result.hexdigest()
+
+
+def save(model, fname):
+    meta = encodeInventories(model)
+    image = model.sequenceModel.getBinary()
+    imageOffset = (headerSize + len(meta) + 7) // 8 * 8
+
+    f = open(fname, "wb")
+    f.write(
+        struct.pack(
+            headerFormat, magic, formatVersion, 0, len(meta), imageOffset, len(image)
+        )
+    )
+    f.write(meta)
+    f.write(b"\0" * (imageOffset - headerSize - len(meta)))
+    f.write(image)
+    f.close()
+
+
+def makeSymbolInventory(symbols):
+    result = SymbolInventory()
+    result.list = symbols
+    result.dir = dict((sym, i) for i, sym in enumerate(symbols) if i > 0)
+    return result
+
+
+def load(fname):
+    f = open(fname, "rb")
+    try:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+    if len(data) < headerSize:
+        raise ValueError("%s: not a binary model file" % fname)
+    fileMagic, version, reserved, metaSize, imageOffset, imageSize = struct.unpack_from(
+        headerFormat, data, 0
+    )
+    if fileMagic != magic:
+        raise ValueError("%s: not a binary model file" % fname)
+    if version != formatVersion:
+        raise ValueError("%s: unsupported binary model version %d" % (fname, version))
+    if headerSize + metaSize > len(data) or imageOffset + imageSize > len(data):
+        raise ValueError("%s: binary model file truncated" % fname)
+
+    try:
+        meta = json.loads(data[headerSize : headerSize + metaSize].decode("utf-8"))
+        sequitur = Sequitur(
+            makeSymbolInventory(meta["left"]), makeSymbolInventory(meta["right"])
+        )
+        for i, (left, right) in enumerate(meta["multigrams"]):
+            j = sequitur.inventory.index((tuple(left), tuple(right)))
+            if j != i + 1:
+                raise ValueError("duplicate multigram")
+        if sequitur.term != meta["term"]:
+            raise ValueError("inconsistent term symbol")
+        model = Model(sequitur)
+        if "discount" in meta:
+            model.discount = num.array(meta["discount"], dtype=num.float64)
+    except (ValueError, KeyError, TypeError):
+        raise ValueError(
+            "%s: corrupt binary model file: %s" % (fname, sys.exc_info()[1])
+        )
+
+    model.sequenceModel = SequenceModel.SequenceModel()
+    try:
+        model.sequenceModel.setBinary(
+            memoryview(data)[imageOffset : imageOffset + imageSize]
+        )
+    except ValueError:
+        raise ValueError("%s: %s" % (fname, sys.exc_info()[1]))
+    return model
@@ -0,0 +1,273 @@
+"""
+Replacing the model of a running translator
+
+A ModelHandle is used like a translator, but its model can be
+replaced while it is in use: reload() loads and warms up the new
+model in a background thread and then switches to it atomically.
+Conversions which are already running finish on the old model, which
+is released as soon as the last of them is done.
+"""
+
+from __future__ import print_function
+
+__copyright__ = "Copyright (c) 2026  Sequitur G2P contributors"
+__license__ = """
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License Version 2 (June
+1991) as published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, you will find it at
+http://www.gnu.org/licenses/gpl.html, or write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110,
+USA.
+
+Should a provision of no. 9 and 10 of the GNU General Public License
+be invalid or become invalid, a valid provision is deemed to have been
+agreed upon which comes closest to what the parties intended
+commercially. In any case guarantee/warranty shall be limited to gross
+negligent actions or intended actions or fraudulent concealment.
+"""
+
+
+
+import os, sys, threading, time
+from sequitur import Translator
+
+
+def residentMemory():
+    """
+    Resident set size of this process in bytes, or None if unknown.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+class Generation:
+    """
+    One loaded model with its translator, and the number of
+    conversions currently using it.
+    """
+
+    def __init__(self, model, translator):
+        self.model = model
+        self.translator = translator
+        self.users = 0
+        self.retired = False
+
+
+class ModelHandle:
+    """
+    Translator whose model can be replaced by reload().  load() is
+    called to obtain a model, unless the first one is given as model,
+    and makeTranslator(model) creates the translator for it,
+    defaulting to Translator(model).  Before a new translator is put
+    to use, it converts the words in warmUp and the slowest words
+    seen by the current one.
+
+    Statistics of the replaced translators are kept, so statistics()
+    covers all models.  Each reload is reported on log and recorded
+    in reloads: the time to load and warm up the new model, the time
+    the switch held the lock, the time until the old model was
+    released, and the resident memory before loading, when both
+    models were loaded, and after the release.
+    """
+
+    TranslationFailure = Translator.TranslationFailure
+
+    def __init__(
+        self, load, makeTranslator=Translator, model=None, warmUp=(), log=sys.stderr
+    ):
+        self.load = load
+        self.makeTranslator = makeTranslator
+        self.warmUp = list(warmUp)
+        self.log = log
+        self.lock = threading.Lock()
+        if model is None:
+            model = load()
+        self.current = self.generation(model, self.warmUp)
+        self.loader = None
+        self.reloads = []
+        self.retiredStatistics = None
+
+    def generation(self, model, warmUp):
+        translator = self.makeTranslator(model)
+        for left in warmUp:
+            try:
+                translator(left)
+            except translator.TranslationFailure:
+                pass
+        return Generation(model, translator)
+
+    # -----------------------------------------------------------------------
+    # switching models
+
+    def reload(self, wait=False):
+        """
+        Load the model again and switch to it.  Returns the loader
+        thread, or None if it has finished (wait=True).  If a reload is
+        in progress already, no other one is started.
+        """
+        with self.lock:
+            if self.loader is None or not self.loader.is_alive():
+                self.loader = threading.Thread(target=self.replace)
+                self.loader.daemon = True
+                self.loader.start()
+            loader = self.loader
+        if wait:
+            loader.join()
+            return None
+        return loader
+
+    def replace(self):
+        report = {"residentBefore": residentMemory()}
+        start = time.time()
+        warmUp = list(self.warmUp)
+        for slow in self.statistics()["slowest"]:
+            if tuple(slow["left"]) not in warmUp:
+                warmUp.append(tuple(slow["left"]))
+        try:
+            new = self.generation(self.load(), warmUp)
+        except Exception:
+            exc = sys.exc_info()[1]
+            print(
+                "reloading model failed, keeping the old one: %s" % exc, file=self.log
+            )
+            return
+        report["loadSeconds"] = time.time() - start
+        report["residentLoaded"] = residentMemory()
+
+        switch = time.time()
+        with self.lock:
+            old = self.current
+            self.current = new
+            old.retired = True
+            old.report = report
+            old.switchTime = switch
+            drained = old.users == 0
+            report["swapSeconds"] = time.time() - switch
+        self.reloads.append(report)
+        if drained:
+            self.release(old)
+
+    def close(self):
+        """
+        Wait for a reload in progress and close the current translator,
+        if it can be closed (see PronunciationCache).  Translators of
+        replaced models are closed when they are released.
+        """
+        with self.lock:
+            loader = self.loader
+        if loader is not None:
+            loader.join()
+        translator = self.current.translator
+        if hasattr(translator, "close"):
+            translator.close()
+
+    def release(self, generation):
+        translator = generation.translator
+        if hasattr(translator, "close"):
+            translator.close()
+        statistics = translator.statistics()
+        generation.model = generation.translator = translator = None
+        report = generation.report
+        report["drainSeconds"] = time.time() - generation.switchTime
+        report["residentAfter"] = residentMemory()
+        with self.lock:
+            if self.retiredStatistics is None:
+                self.retiredStatistics = statistics
+            else:
+                self.retiredStatistics = Translator.mergeStatistics(
+                    self.retiredStatistics, statistics
+                )
+        self.printReport(report)
+
+    def printReport(self, report):
+        def mb(key):
+            if report[key] is None:
+                return "?"
+            return "%.1f" % (report[key] / 1048576.0)
+
+        print(
+            "reloaded model: loaded in %.3f s, switched in %.1f us, old model "
+            "released after %.3f s; resident memory %s MB before, %s MB with "
+            "both models, %s MB after"
+            % (
+                report["loadSeconds"],
+                report["swapSeconds"] * 1e6,
+                report["drainSeconds"],
+                mb("residentBefore"),
+                mb("residentLoaded"),
+                mb("residentAfter"),
+            ),
+            file=self.log,
+        )
+
+    # -----------------------------------------------------------------------
+    # translator interface
+
+    def acquire(self):
+        with self.lock:
+            generation = self.current
+            generation.users += 1
+        return generation
+
+    def done(self, generation):
+        with self.lock:
+            generation.users -= 1
+            drained = generation.retired and generation.users == 0
+        if drained:
+            self.release(generation)
+
+    def use(self, method, *args):
+        generation = self.acquire()
+        try:
+            return getattr(generation.translator, method)(*args)
+        finally:
+            self.done(generation)
+
+    @property
+    def model(self):
+        return self.current.model
+
+    def __call__(self, left):
+        return self.use("__call__", left)
+
+    def firstBest(self, left):
+        return self.use("firstBest", left)
+
+    def translateBatch(self, lefts):
+        return self.use("translateBatch", lefts)
+
+    def nBest(self, left, k=None, mass=None):
+        return self.use("nBest", left, k, mass)
+
+    def variants(self, left, threshold=1.0, nVariantsLimit=None):
+        return self.use("variants", left, threshold, nVariantsLimit)
+
+    def statistics(self, reset=False):
+        statistics = self.use("statistics", reset)
+        with self.lock:
+            retired = self.retiredStatistics
+            if reset:
+                self.retiredStatistics = None
+        if retired is not None:
+            statistics = Translator.mergeStatistics(retired, statistics)
+        return statistics
+
+    def reportStats(self, f):
+        if self.reloads:
+            print(
+                "model reloads: %d (the following is for the current model)"
+                % len(self.reloads),
+                file=f,
+            )
+        self.use("reportStats", f)
@@ -29,6 +29,7 @@
 #define _MULTIGRAM_HH
 #include "Python.hh"
 
+#include <algorithm>
 #include <vector>
 #if defined(__GXX_EXPERIMENTAL_CXX0X__) || (__cplusplus >= 201103L) || (__APPLE__) || (_MSC_VER)
 #include <unordered_map>
@@ -164,7 +165,7 @@ class MultigramInventory {
       return (i != map_.end()) ? i->second : voidIndex();
     }
 
-    JointMultigram symbol(Index i) {
+    JointMultigram symbol(Index i) const {
       require_(i > 0);
       require_(i < list_.size());
       return list_[i];
@@ -189,4 +190,143 @@ class MultigramInventory {
 
 typedef MultigramInventory::Index MultigramIndex;
 
+/**
+ * Prefix tree over the left-hand sides of all multigrams in an
+ * inventory.  Starting at the root and following the input symbols
+ * one by one visits all multigrams whose left side matches the input
+ * at a given position, shortest first, without constructing or
+ * hashing any Multigram.
+ *
+ * Nodes, arcs and multigram lists are kept in flat arrays.  The arcs
+ * leaving a node are contiguous and sorted by symbol.
+ */
+class LeftMultigramTrie {
+  public:
+    typedef u32 Node;
+    static Node root() { return 0; }
+    static Node noNode() { return Node(-1); }
+
+  private:
+    struct NodeData {
+      u32 arcsBegin, arcsEnd;
+      u32 multigramsBegin, multigramsEnd;
+    };
+    struct Arc {
+      Symbol symbol;
+      Node target;
+      bool operator<(Symbol s) const { return symbol < s; }
+    };
+    std::vector<NodeData> nodes_;
+    std::vector<Arc> arcs_;
+    std::vector<MultigramIndex> multigrams_;
+    size_t inventorySize_;
+
+    typedef std::pair<Multigram, MultigramIndex> Entry;
+    struct EntryLess {
+      bool operator()(const Entry &lhs, const Entry &rhs) const {
+        for (u32 i = 0; i < Multigram::maximumLength; ++i)
+          if (lhs.first[i] != rhs.first[i]) return lhs.first[i] < rhs.first[i];
+        return lhs.second < rhs.second;
+      }
+    };
+    typedef std::vector<Entry>::const_iterator EntryIterator;
+
+    /** Entries in [begin, end) share their first @c depth symbols. */
+    Node build(EntryIterator begin, EntryIterator end, u32 depth) {
+      Node node = nodes_.size();
+      nodes_.push_back(NodeData());
+      nodes_[node].multigramsBegin = multigrams_.size();
+      for (; begin != end; ++begin) {
+        if (depth < Multigram::maximumLength && begin->first[depth]) break;
+        multigrams_.push_back(begin->second);
+      }
+      nodes_[node].multigramsEnd = multigrams_.size();
+
+      std::vector<Arc> arcs;
+      while (begin != end) {
+        EntryIterator groupEnd = begin;
+        while (groupEnd != end && groupEnd->first[depth] == begin->first[depth]) ++groupEnd;
+        Arc arc;
+        arc.symbol = begin->first[depth];
+        arc.target = build(begin, groupEnd, depth + 1);
+        arcs.push_back(arc);
+        begin = groupEnd;
+      }
+      nodes_[node].arcsBegin = arcs_.size();
+      arcs_.insert(arcs_.end(), arcs.begin(), arcs.end());
+      nodes_[node].arcsEnd = arcs_.size();
+      return node;
+    }
+
+  public:
+    LeftMultigramTrie() : inventorySize_(0) { clear(); }
+
+    void clear() {
+      nodes_.clear();
+      arcs_.clear();
+      multigrams_.clear();
+      nodes_.push_back(NodeData());
+      nodes_[root()].arcsBegin = nodes_[root()].arcsEnd = 0;
+      nodes_[root()].multigramsBegin = nodes_[root()].multigramsEnd = 0;
+      inventorySize_ = 0;
+    }
+
+    void build(const MultigramInventory &mi) {
+      std::vector<Entry> entries;
+      entries.reserve(mi.size());
+      for (MultigramIndex q = 1; q <= mi.size(); ++q)
+        entries.push_back(Entry(mi.symbol(q).left, q));
+      std::sort(entries.begin(), entries.end(), EntryLess());
+      nodes_.clear();
+      arcs_.clear();
+      multigrams_.clear();
+      build(entries.begin(), entries.end(), 0);
+      inventorySize_ = mi.size();
+    }
+
+    /** Size of the inventory at the time of the last build(). */
+    size_t inventorySize() const { return inventorySize_; }
+
+    /** @return successor of @c n on symbol @c s, or noNode() */
+    Node next(Node n, Symbol s) const {
+      require_(n < nodes_.size());
+      const Arc *begin = arcs_.data() + nodes_[n].arcsBegin;
+      const Arc *end   = arcs_.data() + nodes_[n].arcsEnd;
+      const Arc *a = std::lower_bound(begin, end, s);
+      return (a != end && a->symbol == s) ? a->target : noNode();
+    }
+
+    /** Multigrams whose left side is the path from the root to @c n */
+    const MultigramIndex *multigramsBegin(Node n) const {
+      return multigrams_.data() + nodes_[n].multigramsBegin;
+    }
+    const MultigramIndex *multigramsEnd(Node n) const {
+      return multigrams_.data() + nodes_[n].multigramsEnd;
+    }
+
+    /**
+     * Bit l of the result is set iff the first l symbols of [begin,
+     * end) are the left side of some multigram.
+     */
+    u32 matchingLengths(const Symbol *begin, const Symbol *end) const {
+      u32 result = 0;
+      Node n = root();
+      for (u32 l = 0; ; ++l) {
+        if (nodes_[n].multigramsBegin != nodes_[n].multigramsEnd)
+          result |= 1u << l;
+        if (begin + l == end) break;
+        n = next(n, begin[l]);
+        if (n == noNode()) break;
+      }
+      return result;
+    }
+
+    size_t memoryUsed() const {
+      return sizeof(LeftMultigramTrie)
+        + nodes_.capacity() * sizeof(NodeData)
+        + arcs_.capacity() * sizeof(Arc)
+        + multigrams_.capacity() * sizeof(MultigramIndex);
+    }
+};
+
 #endif // _MULTIGRAM_HH
@@ -87,6 +87,15 @@ private:
 
     Chunk *current_; /**< current chunk */
     Item  *begin_;   /**< first item in current chunk */
+    Chunk *spare_;   /**< empty chunks kept by reset() */
+
+    void deleteChunks(Chunk *c) {
+        Chunk *cs;
+        for ( ; c ; c = cs) {
+            cs = c->succ;
+            deleteChunk(c);
+        }
+    }
 
     void provide_(size_t n);
 
@@ -98,21 +107,33 @@ public:
     Obstack(size_t chunkCapacity = 0);
 
     void clear() {
+        deleteChunks(current_);
+        deleteChunks(spare_);
+        spare_ = 0;
+        current_ = newChunk(0, 0);
+        begin_ = 0;
+    }
+
+    /**
+     * Remove all items like clear(), but keep the chunks for the
+     * items to come, so that an obstack used over and over again
+     * does not allocate any memory once it has grown big enough.
+     */
+    void reset() {
         Chunk *c, *cs;
         for (c = current_ ; c ; c = cs) {
             cs = c->succ;
-            deleteChunk(c);
+            c->clear();
+            c->succ = spare_;
+            spare_ = c;
         }
         current_ = newChunk(0, 0);
         begin_ = 0;
     }
 
     ~Obstack() {
-        Chunk *c, *cs;
-        for (c = current_ ; c ; c = cs) {
-            cs = c->succ;
-            deleteChunk(c);
-        }
+        deleteChunks(current_);
+        deleteChunks(spare_);
     }
 
     void start() {
@@ -193,10 +214,21 @@ public:
 template <class T>
 typename Obstack<T>::Chunk *Obstack<T>::newChunk(Item *begin, Item *end, size_t spareCapacity) {
     adjustChunkCapacity(end - begin + spareCapacity);
-    Chunk *c = (Chunk*) ::malloc(chunkSize_) ;
-    hope(c != NULL /* memory allocation failed */);
+    Chunk *c;
+    while (spare_ && size_t(spare_->end - spare_->data) < chunkCapacity_) {
+        c = spare_;
+        spare_ = c->succ;
+        free(c);
+    }
+    if (spare_) {
+        c = spare_;
+        spare_ = c->succ;
+    } else {
+        c = (Chunk*) ::malloc(chunkSize_) ;
+        hope(c != NULL /* memory allocation failed */);
+        c->end  = c->data + chunkCapacity_ ;
+    }
     c->succ = 0 ;
-    c->end  = c->data + chunkCapacity_ ;
     c->tail = std::uninitialized_copy(begin, end, c->data);
     ensure(c->room() >= spareCapacity);
     return c ;
@@ -232,6 +264,7 @@ Obstack<T>::Obstack(size_t chunkCapacity) {
         adjustChunkCapacity(1);
     }
 
+    spare_ = 0;
     current_ = newChunk(0, 0);
     begin_ = 0;
 }
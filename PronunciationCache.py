@@ -0,0 +1,187 @@
+"""
+Persistent pronunciation cache
+
+Translation results are stored in an SQLite database, so that they can
+be re-used by later runs and shared by concurrent processes.  Each
+cache file belongs to one model, identified by its content fingerprint
+(see ModelFile.fingerprint).  When the cache is opened with a
+different model, all its entries are dropped.  Results of differently
+configured searches (beam, stack limit, approximate posteriors, ...)
+are stored under different keys, so that they are never mixed up.
+"""
+
+from __future__ import print_function
+
+__copyright__ = "Copyright (c) 2026  Sequitur G2P contributors"
+__license__ = """
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License Version 2 (June
+1991) as published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, you will find it at
+http://www.gnu.org/licenses/gpl.html, or write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110,
+USA.
+
+Should a provision of no. 9 and 10 of the GNU General Public License
+be invalid or become invalid, a valid provision is deemed to have been
+agreed upon which comes closest to what the parties intended
+commercially. In any case guarantee/warranty shall be limited to gross
+negligent actions or intended actions or fraudulent concealment.
+"""
+
+
+import json, sqlite3, threading
+from sequitur import Translator
+
+
+class PersistentCachedTranslator:
+    """
+    Translator wrapper which consults a persistent cache before
+    searching.  First-best translations (also via translateBatch) and
+    variant lists are cached; failures are not.  New entries are
+    written in batches of flushSize, and on flush() or close().  search
+    describes the search configuration of translator, as a dict of
+    JSON-serialisable values.
+    """
+
+    TranslationFailure = Translator.TranslationFailure
+    flushSize = 500
+
+    def __init__(self, translator, fname, fingerprint, search=None):
+        self.translator = translator
+        self.fname = fname
+        self.fingerprint = fingerprint
+        self.search = search
+        self.hits = 0
+        self.misses = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            fname, timeout=600, isolation_level=None, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS info (name TEXT PRIMARY KEY, value TEXT)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS pronunciations "
+                "(key TEXT PRIMARY KEY, value TEXT)"
+            )
+            if not self.isCurrent():
+                self.db.execute("DELETE FROM pronunciations")
+                self.db.execute(
+                    "INSERT OR REPLACE INTO info VALUES ('model', ?)", (fingerprint,)
+                )
+            self.db.execute("COMMIT")
+        except:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self.translator, name)
+
+    def isCurrent(self):
+        row = self.db.execute("SELECT value FROM info WHERE name = 'model'").fetchone()
+        return row is not None and row[0] == self.fingerprint
+
+    def key(self, *args):
+        return json.dumps([self.search] + list(args), sort_keys=True)
+
+    def lookup(self, key):
+        with self.lock:
+            value = self.pending.get(key)
+            if value is None:
+                row = self.db.execute(
+                    "SELECT value FROM pronunciations WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def store(self, key, value):
+        with self.lock:
+            self.pending[key] = value
+            shouldFlush = len(self.pending) >= self.flushSize
+        if shouldFlush:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            items = [(key, json.dumps(value)) for key, value in self.pending.items()]
+            self.pending = {}
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                # another process may have taken over the cache for a
+                # different model in the meantime
+                if self.isCurrent():
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO pronunciations VALUES (?, ?)", items
+                    )
+                self.db.execute("COMMIT")
+            except:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def firstBest(self, left):
+        key = self.key(left)
+        value = self.lookup(key)
+        if value is None:
+            logLik, right = self.translator.firstBest(left)
+            self.store(key, [logLik, right])
+        else:
+            logLik, right = value
+        return logLik, tuple(right)
+
+    def __call__(self, left):
+        logLik, right = self.firstBest(left)
+        return right
+
+    def translateBatch(self, lefts):
+        keys = [self.key(left) for left in lefts]
+        results = [self.lookup(key) for key in keys]
+        missing = [i for i, value in enumerate(results) if value is None]
+        if missing:
+            translated = self.translator.translateBatch([lefts[i] for i in missing])
+            for i, result in zip(missing, translated):
+                results[i] = result
+                if not isinstance(result, self.TranslationFailure):
+                    self.store(keys[i], list(result))
+        for i, result in enumerate(results):
+            if isinstance(result, list):
+                logLik, right = result
+                results[i] = (logLik, tuple(right))
+        return results
+
+    def variants(self, left, threshold=1.0, nVariantsLimit=None):
+        key = self.key(left, threshold, nVariantsLimit)
+        value = self.lookup(key)
+        if value is None:
+            value = self.translator.variants(left, threshold, nVariantsLimit)
+            self.store(key, value)
+        return [(posterior, tuple(right)) for posterior, right in value]
+
+    def reportStats(self, f):
+        self.translator.reportStats(f)
+        print(
+            "persistent cache hits: %d, misses: %d" % (self.hits, self.misses), file=f
+        )
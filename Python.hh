@@ -41,4 +41,17 @@ public:
 
 class ExistingPythonException {};
 
+/**
+ * Releases the interpreter lock for the lifetime of the object.  The
+ * lock is re-acquired on destruction, also when an exception
+ * propagates, so it is safe to throw from within the guarded scope.
+ * Code in this scope must not touch any Python object.
+ */
+class AllowThreads {
+    PyThreadState *state_;
+public:
+    AllowThreads() : state_(PyEval_SaveThread()) {}
+    ~AllowThreads() { PyEval_RestoreThread(state_); }
+};
+
 #endif // _PYTHON_HH
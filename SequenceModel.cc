@@ -25,7 +25,10 @@
  * negligent actions or intended actions or fraudulent concealment.
  */
 
+#include <atomic>
+#include <cstdlib>
 #include <memory>
+#include <new>
 #include <stdexcept>
 
 #include "SequenceModel.hh"
@@ -85,78 +88,167 @@ namespace SequenceModelPrivate {
       }
       return 0;
     }
+
+  /**
+   * Partition the values into at most maxCodes intervals of roughly
+   * equal population and represent each by the mean of its members.
+   * If there are no more distinct values than codes, every value gets
+   * a code of its own, so quantizing again is lossless.  On return
+   * upper[c] is the largest value represented by centroid[c].
+   */
+  void buildCodebook(std::vector<double> values, u32 maxCodes,
+                     std::vector<double> &centroid, std::vector<double> &upper) {
+    std::sort(values.begin(), values.end());
+    size_t nDistinct = 0;
+    for (size_t i = 0; i < values.size(); ++i)
+      if (!i || values[i] != values[i - 1]) ++nDistinct;
+    centroid.clear();
+    upper.clear();
+    for (size_t i = 0; i < values.size();) {
+      size_t j;
+      if (nDistinct <= maxCodes) {
+        for (j = i + 1; j < values.size() && values[j] == values[i]; ++j);
+      } else {
+        size_t codesLeft = maxCodes - centroid.size();
+        j = std::min(values.size(), i + (values.size() - i + codesLeft - 1) / codesLeft);
+        while (j < values.size() && values[j] == values[j - 1]) ++j;
+      }
+      double mean = 0.0;
+      for (size_t k = i; k < j; ++k)
+        mean += (values[k] - mean) / (k - i + 1);
+      centroid.push_back(mean);
+      upper.push_back(values[j - 1]);
+      i = j;
+    }
+  }
+
+  /** Follows the node array in a binary image of a quantized model. */
+  struct CodebookHeader {
+    u32 bits, nOrders, nCodes, reserved;
+  };
+
+  inline size_t align8(size_t n) { return (n + 7) / 8 * 8; }
+
+  /**
+   * Offsets of the parts of the quantized word probabilities, relative
+   * to the end of the node array: codebook header, start of each
+   * order's codebook, codebooks, tokens and codes.
+   */
+  struct QuantizedImage {
+    size_t codebookBegin, codebook, tokens, codes, size;
+    QuantizedImage(u32 nOrders, u32 nCodes, u32 nWords, u32 bits) {
+      codebookBegin = sizeof(CodebookHeader);
+      codebook = align8(codebookBegin + (size_t(nOrders) + 1) * sizeof(u32));
+      tokens = codebook + size_t(nCodes) * sizeof(LogProbability);
+      codes = tokens + size_t(nWords) * sizeof(Token);
+      size = align8(codes + size_t(nWords) * (bits / 8));
+    }
+  };
 }
 
 using namespace SequenceModelPrivate;
 
 class SequenceModel::Node {
   public:
-    typedef std::vector<Node>::size_type Index;
-    static const Index invalidIndex = 2000000000;
+    typedef u32 Index;
     typedef u16 Depth;
 
   private: // internal data
     friend class Internal;
     friend class SequenceModel;
 
-    Token token_;  /**< least recent word in history */
+    /* All references are relative or indices, never pointers, so
+     * that the node array can be mapped directly from a file. */
     LogProbability backOffWeight_;
+    Token token_;  /**< least recent word in history */
     Depth depth_;  /**< number of words in history */
+    u16 padding_;  /**< explicit, so that binary images are reproducible */
+    Index parentOffset_; /**< distance to parent node, zero for the root */
+    Index childOffset_;  /**< distance to first child node */
+    Index firstWordProbability_;
+    u32 padding2_;
 
-    union parent_t {
-      Node *finalized;
-      Index init;
-    } parent_;
-
-    union node_struct_t {
-      struct finalized_t {
-        Node *firstChild_;
-        WordProbability *firstWordProbability_;
-      } finalized;
-      struct done_t {
-        Index firstChild_;
-        size_t firstWordProbability_;
-      } done;
-      struct  init_t {
-        InitItem *begin, *end;
-      } init;
-    } node_struct ;
+    Node() { memset(static_cast<void*>(this), 0, sizeof(*this)); }
 
   public:
     Token token() const { return token_; }
     LogProbability backOffWeight() const { return backOffWeight_; }
     Depth depth() const { return depth_; }
 
-    const Node *parent() const { return parent_.finalized; }
+    const Node *parent() const { return (parentOffset_) ? this - parentOffset_ : 0; }
 
-    const Node *childrenBegin() const { return           node_struct.finalized.firstChild_; }
-    const Node *childrenEnd()   const { return (this+1)->node_struct.finalized.firstChild_; }
+    const Node *childrenBegin() const { return  this    +        childOffset_; }
+    const Node *childrenEnd()   const { return (this+1) + (this+1)->childOffset_; }
 
-    const WordProbability *probabilitiesBegin() const { return           node_struct.finalized.firstWordProbability_; }
-    const WordProbability *probabilitiesEnd()   const { return (this+1)->node_struct.finalized.firstWordProbability_; }
+    Index wordsBegin() const { return        firstWordProbability_; }
+    Index wordsEnd()   const { return (this+1)->firstWordProbability_; }
+    const WordProbability *probabilitiesBegin(const WordProbability *wps) const { return wps +           firstWordProbability_; }
+    const WordProbability *probabilitiesEnd(const WordProbability *wps)   const { return wps + (this+1)->firstWordProbability_; }
 
     const Node *findChild(Token) const;
-    const WordProbability *findWordProbability(Token) const;
+    const WordProbability *findWordProbability(const WordProbability *wps, Token) const;
 };
 
 const SequenceModel::Node *SequenceModel::Node::findChild(Token t) const {
   return binarySearch(childrenBegin(), childrenEnd() - 1, t);
 }
 
-const SequenceModel::WordProbability *SequenceModel::Node::findWordProbability(Token t) const {
-  return binarySearch(probabilitiesBegin(), probabilitiesEnd() - 1, t);
+const SequenceModel::WordProbability *SequenceModel::Node::findWordProbability(const WordProbability *wps, Token t) const {
+  return binarySearch(probabilitiesBegin(wps), probabilitiesEnd(wps) - 1, t);
 }
 
+/**
+ * Layout of the binary image produced by SequenceModel::getBinary():
+ * this header, followed by the node array (including the sentinel)
+ * and the word probability array (including the sentinel).  Images of
+ * quantized models have a different magic string, wordProbabilitySize
+ * is the size of a code, and the node array is followed by the parts
+ * described by QuantizedImage instead.
+ */
+struct SequenceModel::BinaryHeader {
+  char magic[8];
+  u32 byteOrder;
+  u32 nodeSize, wordProbabilitySize;
+  u32 nNodes, nWordProbabilities;
+  u32 sentenceBegin, sentenceEnd;
+  u32 reserved;
+
+  static const char *magicString() { return "SQSMv001"; }
+  static const char *quantizedMagicString() { return "SQSMv002"; }
+  static const u32 byteOrderMark = 0x01020304;
+};
 
 class SequenceModel::Internal {
   private:
     friend class SequenceModel;
 
     typedef std::vector<Node> Nodes;
-    Nodes nodes;
+    Nodes nodes_;
 
     typedef std::vector<WordProbability> WordProbabilities;
-    WordProbabilities wordProbabilities;
+    WordProbabilities wordProbabilities_;
+
+    /** Quantized models keep the tokens and the probability codes of
+     * the word probabilities in separate arrays and look the codes up
+     * in a codebook per history length. */
+    u32 quantization_; /**< bits per code, zero if not quantized */
+    std::vector<Token> wordTokens_;
+    std::vector<u8> wordCodes_;
+    std::vector<LogProbability> codebook_;
+    std::vector<u32> codebookBegin_;
+
+    /** Non-empty iff the arrays live in an external buffer. */
+    Py_buffer buffer_;
+    bool isMapped_;
+
+    const Node *nodes, *nodesEnd;
+    const WordProbability *wordProbabilities, *wordProbabilitiesEnd;
+    const Token *wordTokens, *wordTokensEnd;
+    const u8 *wordCodes;
+    const LogProbability *codebook;
+    const u32 *codebookBegin;
+    u32 nOrders, nCodes;
+
 
     struct InitItemOrdering {
       bool operator() (const InitItem &a, const InitItem &b) const {
@@ -167,11 +259,40 @@ class SequenceModel::Internal {
       }
     };
 
-    void buildNode(Node::Index);
+    typedef std::vector<std::pair<InitItem*, InitItem*> > InitRanges;
+    void buildNode(Node::Index, InitRanges&);
+    const char *checkImage() const;
 
   public:
     Internal(Node::Index nNodes, Node::Index nWordProbabilities);
+    Internal(PyObject *buffer, BinaryHeader &header);
+    Internal(const Internal&, u32 quantization);
     ~Internal();
+
+    static const u32 noWord = u32(-1);
+    /** number of word probabilities, including the sentinel */
+    u32 nWordProbabilities() const {
+      return (quantization_) ? wordTokensEnd - wordTokens : wordProbabilitiesEnd - wordProbabilities;
+    }
+    Token wordToken(u32 i) const {
+      return (quantization_) ? wordTokens[i] : wordProbabilities[i].token();
+    }
+    /** p(wordToken(i) | n), where i belongs to node n */
+    LogProbability wordProbability(const Node *n, u32 i) const {
+      if (!quantization_) return wordProbabilities[i].probability();
+      u32 code = (quantization_ == 8) ? wordCodes[i] : reinterpret_cast<const u16*>(wordCodes)[i];
+      return codebook[codebookBegin[n->depth()] + code];
+    }
+    /** index of p(t | n) among the word probabilities, or noWord */
+    u32 findWord(const Node *n, Token t) const {
+      if (!quantization_) {
+        const WordProbability *wp = n->findWordProbability(wordProbabilities, t);
+        return (wp) ? u32(wp - wordProbabilities) : noWord;
+      }
+      const Token *b = wordTokens + n->wordsBegin(), *e = wordTokens + n->wordsEnd();
+      const Token *i = std::lower_bound(b, e, t);
+      return (i != e && *i == t) ? u32(i - wordTokens) : noWord;
+    }
 #ifdef OBSOLETE
     void dump(std::ostream&, const StringInventory*) const;
 #endif
@@ -181,87 +302,385 @@ class SequenceModel::Internal {
     static LogProbability probability(const Node*, Token);
 };
 
-SequenceModel::Internal::Internal(Node::Index nNodes, Node::Index nWordProbabilities) {
-  nodes.reserve(nNodes+1);
-  wordProbabilities.reserve(nWordProbabilities);
+SequenceModel::Internal::Internal(Node::Index nNodes, Node::Index nWordProbabilities) :
+  quantization_(0), isMapped_(false),
+  nodes(0), nodesEnd(0), wordProbabilities(0), wordProbabilitiesEnd(0),
+  wordTokens(0), wordTokensEnd(0), wordCodes(0), codebook(0), codebookBegin(0),
+  nOrders(0), nCodes(0)
+{
+  nodes_.reserve(nNodes+1);
+  wordProbabilities_.reserve(nWordProbabilities);
 }
 
-SequenceModel::Internal::~Internal() {}
+SequenceModel::Internal::Internal(PyObject *obj, BinaryHeader &header) :
+  quantization_(0), isMapped_(false),
+  wordProbabilities(0), wordProbabilitiesEnd(0),
+  wordTokens(0), wordTokensEnd(0), wordCodes(0), codebook(0), codebookBegin(0),
+  nOrders(0), nCodes(0)
+{
+  if (PyObject_GetBuffer(obj, &buffer_, PyBUF_SIMPLE) < 0)
+    throw ExistingPythonException();
+  const char *data = (const char*) buffer_.buf;
+  size_t size = buffer_.len;
+  isMapped_ = true;
+
+  if (size < sizeof(BinaryHeader)) {
+    PyBuffer_Release(&buffer_);
+    throw PythonException(PyExc_ValueError, "binary sequence model truncated");
+  }
+  memcpy(&header, data, sizeof(BinaryHeader));
+  bool isQuantized = (memcmp(header.magic, BinaryHeader::quantizedMagicString(), sizeof(header.magic)) == 0);
+  size_t nodesSize = size_t(header.nNodes) * sizeof(Node);
+  CodebookHeader codebookHeader;
+  memset(&codebookHeader, 0, sizeof(codebookHeader));
+  const char *error = 0;
+  if (!isQuantized && memcmp(header.magic, BinaryHeader::magicString(), sizeof(header.magic)) != 0)
+    error = "not a binary sequence model";
+  else if (header.byteOrder != BinaryHeader::byteOrderMark ||
+           header.nodeSize != sizeof(Node) ||
+           (!isQuantized && header.wordProbabilitySize != sizeof(WordProbability)))
+    error = "binary sequence model was written on an incompatible platform";
+  else if (header.nNodes < 2 || header.nWordProbabilities < 1)
+    error = "binary sequence model truncated";
+  else if (!isQuantized &&
+           size < sizeof(BinaryHeader) + nodesSize
+           + size_t(header.nWordProbabilities) * sizeof(WordProbability))
+    error = "binary sequence model truncated";
+  else if (isQuantized &&
+           size < sizeof(BinaryHeader) + nodesSize + sizeof(CodebookHeader))
+    error = "binary sequence model truncated";
+  else if (reinterpret_cast<size_t>(data) % sizeof(double))
+    error = "binary sequence model is not properly aligned";
+  if (!error && isQuantized) {
+    memcpy(&codebookHeader, data + sizeof(BinaryHeader) + nodesSize, sizeof(CodebookHeader));
+    if ((codebookHeader.bits != 8 && codebookHeader.bits != 16) ||
+        header.wordProbabilitySize != codebookHeader.bits / 8)
+      error = "binary sequence model has an unsupported quantization";
+    else if (size < sizeof(BinaryHeader) + nodesSize
+             + QuantizedImage(codebookHeader.nOrders, codebookHeader.nCodes,
+                              header.nWordProbabilities, codebookHeader.bits).size)
+      error = "binary sequence model truncated";
+  }
+  if (error) {
+    PyBuffer_Release(&buffer_);
+    throw PythonException(PyExc_ValueError, error);
+  }
+
+  nodes = reinterpret_cast<const Node*>(data + sizeof(BinaryHeader));
+  nodesEnd = nodes + header.nNodes;
+  if (isQuantized) {
+    quantization_ = codebookHeader.bits;
+    nOrders = codebookHeader.nOrders;
+    nCodes = codebookHeader.nCodes;
+    QuantizedImage image(nOrders, nCodes, header.nWordProbabilities, quantization_);
+    const char *base = reinterpret_cast<const char*>(nodesEnd);
+    codebookBegin = reinterpret_cast<const u32*>(base + image.codebookBegin);
+    codebook = reinterpret_cast<const LogProbability*>(base + image.codebook);
+    wordTokens = reinterpret_cast<const Token*>(base + image.tokens);
+    wordTokensEnd = wordTokens + header.nWordProbabilities;
+    wordCodes = reinterpret_cast<const u8*>(base + image.codes);
+  } else {
+    wordProbabilities = reinterpret_cast<const WordProbability*>(nodesEnd);
+    wordProbabilitiesEnd = wordProbabilities + header.nWordProbabilities;
+  }
+
+  error = checkImage();
+  if (error) {
+    PyBuffer_Release(&buffer_);
+    throw PythonException(PyExc_ValueError, error);
+  }
+}
+
+/**
+ * Check that all references between the parts of a mapped image stay
+ * within their arrays, so that a corrupt file cannot make us read
+ * outside of it: parents precede their children, the children and
+ * the word probabilities of consecutive nodes are consecutive ranges,
+ * and (if quantized) every code lies within the codebook of its
+ * history length.  Returns an error message, or zero.
+ */
+const char *SequenceModel::Internal::checkImage() const {
+  const char *corrupt = "binary sequence model is corrupt";
+  u64 nNodes = nodesEnd - nodes, nWords = nWordProbabilities();
+  const Node &sentinel(nodes[nNodes - 1]);
+  if (sentinel.childOffset_ != 0 || sentinel.firstWordProbability_ >= nWords)
+    return corrupt;
+  if (quantization_) {
+    if (codebookBegin[0] != 0) return corrupt;
+    for (u32 d = 0; d < nOrders; ++d)
+      if (codebookBegin[d] > codebookBegin[d + 1]) return corrupt;
+    if (codebookBegin[nOrders] > nCodes) return corrupt;
+  }
+  for (u64 i = 0; i + 1 < nNodes; ++i) {
+    const Node &n(nodes[i]);
+    if ((i == 0) ? (n.parentOffset_ != 0) : (n.parentOffset_ == 0 || n.parentOffset_ > i))
+      return corrupt;
+    u64 childrenBegin = i + n.childOffset_;
+    u64 childrenEnd = i + 1 + nodes[i + 1].childOffset_;
+    if (childrenBegin <= i || childrenBegin > childrenEnd || childrenEnd >= nNodes)
+      return corrupt;
+    if (n.wordsBegin() > n.wordsEnd()) return corrupt;
+    if (!quantization_) continue;
+    if (n.depth() >= nOrders) return corrupt;
+    u32 nCodesOfDepth = codebookBegin[n.depth() + 1] - codebookBegin[n.depth()];
+    for (u32 w = n.wordsBegin(); w < n.wordsEnd(); ++w) {
+      u32 code = (quantization_ == 8) ? wordCodes[w] : reinterpret_cast<const u16*>(wordCodes)[w];
+      if (code >= nCodesOfDepth) return corrupt;
+    }
+  }
+  return 0;
+}
+
+/**
+ * Copy of a model with the word probabilities stored exactly
+ * (quantization zero) or as codes of the given number of bits.  The
+ * codebook of each history length is built from the probabilities of
+ * that length alone, since their distributions differ considerably.
+ */
+SequenceModel::Internal::Internal(const Internal &source, u32 quantization) :
+  quantization_(quantization), isMapped_(false),
+  wordProbabilities(0), wordProbabilitiesEnd(0),
+  wordTokens(0), wordTokensEnd(0), wordCodes(0), codebook(0), codebookBegin(0),
+  nOrders(0), nCodes(0)
+{
+  require(quantization == 0 || quantization == 8 || quantization == 16);
+  nodes_.assign(source.nodes, source.nodesEnd);
+  nodes = &*nodes_.begin();
+  nodesEnd = nodes + nodes_.size();
+  u32 nWords = source.nWordProbabilities();
+
+  if (!quantization_) {
+    wordProbabilities_.resize(nWords);
+    for (const Node *n = nodes; n+1 != nodesEnd; ++n) {
+      for (u32 i = n->wordsBegin(); i < n->wordsEnd(); ++i) {
+        wordProbabilities_[i].token_ = source.wordToken(i);
+        wordProbabilities_[i].probability_ = source.wordProbability(n, i);
+      }
+    }
+    wordProbabilities = &*wordProbabilities_.begin();
+    wordProbabilitiesEnd = wordProbabilities + wordProbabilities_.size();
+    return;
+  }
+
+  Node::Depth maxDepth = 0;
+  for (const Node *n = nodes; n+1 != nodesEnd; ++n)
+    maxDepth = std::max(maxDepth, n->depth());
+  std::vector<std::vector<double> > scores(maxDepth + 1), uppers(maxDepth + 1);
+  for (const Node *n = nodes; n+1 != nodesEnd; ++n)
+    for (u32 i = n->wordsBegin(); i < n->wordsEnd(); ++i)
+      scores[n->depth()].push_back(source.wordProbability(n, i).score());
+  codebookBegin_.push_back(0);
+  for (Node::Depth d = 0; d <= maxDepth; ++d) {
+    std::vector<double> centroids;
+    buildCodebook(scores[d], u32(1) << quantization_, centroids, uppers[d]);
+    for (std::vector<double>::const_iterator c = centroids.begin(); c != centroids.end(); ++c)
+      codebook_.push_back(LogProbability(*c));
+    codebookBegin_.push_back(codebook_.size());
+  }
+
+  wordTokens_.resize(nWords, 0);
+  wordCodes_.resize(size_t(nWords) * (quantization_ / 8), 0);
+  for (const Node *n = nodes; n+1 != nodesEnd; ++n) {
+    const std::vector<double> &upper(uppers[n->depth()]);
+    for (u32 i = n->wordsBegin(); i < n->wordsEnd(); ++i) {
+      wordTokens_[i] = source.wordToken(i);
+      u32 code = std::lower_bound(upper.begin(), upper.end(),
+                                  source.wordProbability(n, i).score()) - upper.begin();
+      if (quantization_ == 8)
+        wordCodes_[i] = code;
+      else
+        reinterpret_cast<u16*>(&wordCodes_[0])[i] = code;
+    }
+  }
+
+  codebook_.shrink_to_fit();
+  nOrders = maxDepth + 1;
+  nCodes = codebook_.size();
+  codebookBegin = codebookBegin_.data();
+  codebook = codebook_.data();
+  wordTokens = wordTokens_.data();
+  wordTokensEnd = wordTokens + wordTokens_.size();
+  wordCodes = wordCodes_.data();
+}
+
+SequenceModel::Internal::~Internal() {
+  if (isMapped_)
+    PyBuffer_Release(&buffer_);
+}
 
 const SequenceModel::Node *SequenceModel::Internal::build(InitItem *begin, InitItem *end) {
+  InitRanges ranges;
   Node root;
   root.token_        = 0;
   root.backOffWeight_ = LogProbability::impossible();
   root.depth_        = 0;
-  root.parent_.init  = Node::invalidIndex;
-  root.node_struct.init.begin    = begin;
-  root.node_struct.init.end      = end;
-  nodes.push_back(root);
+  root.parentOffset_ = 0;
+  nodes_.push_back(root);
+  ranges.push_back(std::make_pair(begin, end));
 
-  for (Node::Index n = 0; n < nodes.size(); ++n)
-    buildNode(n);
+  for (Node::Index n = 0; n < nodes_.size(); ++n)
+    buildNode(n, ranges);
 
   Node sentinel;
-  sentinel.node_struct.done.firstChild_     = nodes.size();
-  sentinel.node_struct.done.firstWordProbability_ = wordProbabilities.size();
+  sentinel.childOffset_  = 0;
+  sentinel.firstWordProbability_ = wordProbabilities_.size();
   sentinel.token_        = 0;   // phony
   sentinel.backOffWeight_ = LogProbability::certain(); // phony
   sentinel.depth_        = 0;   // phony
-  sentinel.parent_.init  = nodes.size(); // phony
-  nodes.push_back(sentinel);
+  sentinel.parentOffset_ = 0;   // phony
+  nodes_.push_back(sentinel);
   WordProbability sentinel2;
-  wordProbabilities.push_back(sentinel2);
-
-  for (Nodes::iterator n = nodes.begin(); n != nodes.end(); ++n) {
-    Node::Index parent         = n->parent_.init;
-    n->parent_.finalized       = (parent != Node::invalidIndex) ? &nodes[parent] : 0;
-    Node::Index firstChild     = n->node_struct.done.firstChild_;
-    Node::Index firstWordProbability = n->node_struct.done.firstWordProbability_;
-    n->node_struct.finalized.firstChild_     = &nodes[firstChild];
-    n->node_struct.finalized.firstWordProbability_ = &wordProbabilities[firstWordProbability];
-  }
-  nodes[0].parent_.finalized = 0;
+  wordProbabilities_.push_back(sentinel2);
 
-  return &nodes[0];
+  nodes = &*nodes_.begin();
+  nodesEnd = nodes + nodes_.size();
+  wordProbabilities = &*wordProbabilities_.begin();
+  wordProbabilitiesEnd = wordProbabilities + wordProbabilities_.size();
+  return nodes;
 }
 
-void SequenceModel::Internal::buildNode(Node::Index ni) {
-  Node &n(nodes[ni]);
-  InitItem *i = n.node_struct.init.begin, *end = n.node_struct.init.end;
+void SequenceModel::Internal::buildNode(Node::Index ni, InitRanges &ranges) {
+  InitItem *i = ranges[ni].first, *end = ranges[ni].second;
 
   std::sort(i, end, InitItemOrdering());
 
-  n.node_struct.done.firstWordProbability_ = wordProbabilities.size();
+  nodes_[ni].firstWordProbability_ = wordProbabilities_.size();
   for (; i < end && i->history[0] == 0; ++i) {
     if (i->token) {
       WordProbability ws;
       ws.token_ = i->token;
       ws.probability_ = i->probability;
-      wordProbabilities.push_back(ws);
+      wordProbabilities_.push_back(ws);
     } else {
-      n.backOffWeight_ = i->probability;
+      nodes_[ni].backOffWeight_ = i->probability;
     }
   }
 
-  n.node_struct.done.firstChild_ = nodes.size();
-  Node::Depth d = n.depth_ + 1;
+  nodes_[ni].childOffset_ = nodes_.size() - ni;
+  Node::Depth d = nodes_[ni].depth_ + 1;
   for (; i < end ;) {
     verify(i->history[0]);
     Node nn;
-    nn.parent_.init    = ni;
+    nn.parentOffset_   = nodes_.size() - ni;
     nn.depth_          = d;
     nn.token_          = *i->history++;
     nn.backOffWeight_   = LogProbability::certain();
-    nn.node_struct.init.begin      = i++;
+    InitItem *childBegin = i++;
     while (i < end && *i->history == nn.token_) { i->history++; ++i; }
-    nn.node_struct.init.end        = i;
-    nodes.push_back(nn); // CAVEAT: invalidates n
+    nodes_.push_back(nn);
+    ranges.push_back(std::make_pair(childBegin, i));
   }
 }
 
+/**
+ * Direct-mapped table of (history, token) -> advanced history, with
+ * nodes given as indices into the node array.  A slot that is all
+ * zero is empty (histories are stored off by one).  Each slot is guarded
+ * by a sequence number which is odd while the slot is being written,
+ * so that readers in other threads never use a torn entry.  A writer
+ * that finds the slot busy simply does not cache its result.  Hits and
+ * misses are counted in one cache line per thread (threads beyond
+ * nCounters share lines), so that counting does not make the threads
+ * contend for a single line; stats() sums them up.
+ */
+class SequenceModel::SuccessorCache {
+  private:
+    struct Slot {
+      std::atomic<u32> sequence;
+      std::atomic<u32> history, token, successor;
+    };
+    Slot *slots_;
+    u32 log2Size_;
+
+    struct Counters {
+      std::atomic<u64> hits, misses;
+      char padding[64 - 2 * sizeof(std::atomic<u64>)];
+    };
+    static const u32 nCounters = 16;
+    mutable Counters counters_[nCounters];
+
+    static Counters &threadCounters(Counters *counters) {
+      static std::atomic<u32> nThreads(0);
+      static thread_local u32 index = nThreads.fetch_add(1, std::memory_order_relaxed);
+      return counters[index % nCounters];
+    }
+
+    void allocate() {
+      slots_ = new Slot[size()](); // zero-initialized
+    }
+
+    Slot &slot(u32 history, Token token) const {
+      u64 key = (u64(history) << 32) | u64(token);
+      return slots_[(key * 0x9e3779b97f4a7c15ULL) >> (64 - log2Size_)];
+    }
+
+  public:
+    static size_t slotSize() { return sizeof(Slot); }
+
+    SuccessorCache(u32 log2Size) : slots_(0), log2Size_(log2Size) {
+      require(log2Size > 0 && log2Size < 32);
+      allocate();
+      resetStats();
+    }
+
+    ~SuccessorCache() { delete[] slots_; }
+
+    size_t size() const { return size_t(1) << log2Size_; }
+
+    bool find(u32 history, Token token, u32 &successor) const {
+      ++history;
+      Slot &s(slot(history, token));
+      u32 sequence = s.sequence.load(std::memory_order_acquire);
+      if (!(sequence & 1) &&
+          s.history.load(std::memory_order_relaxed) == history &&
+          s.token.load(std::memory_order_relaxed) == token) {
+        successor = s.successor.load(std::memory_order_relaxed);
+        std::atomic_thread_fence(std::memory_order_acquire);
+        if (s.sequence.load(std::memory_order_relaxed) == sequence) {
+          threadCounters(counters_).hits.fetch_add(1, std::memory_order_relaxed);
+          return true;
+        }
+      }
+      threadCounters(counters_).misses.fetch_add(1, std::memory_order_relaxed);
+      return false;
+    }
+
+    void insert(u32 history, Token token, u32 successor) {
+      ++history;
+      Slot &s(slot(history, token));
+      u32 sequence = s.sequence.load(std::memory_order_relaxed);
+      if ((sequence & 1) ||
+          !s.sequence.compare_exchange_strong(sequence, sequence + 1, std::memory_order_acquire))
+        return;
+      std::atomic_thread_fence(std::memory_order_release);
+      s.history.store(history, std::memory_order_relaxed);
+      s.token.store(token, std::memory_order_relaxed);
+      s.successor.store(successor, std::memory_order_relaxed);
+      s.sequence.store(sequence + 2, std::memory_order_release);
+    }
+
+    void stats(u64 &hits, u64 &misses) const {
+      hits = misses = 0;
+      for (u32 i = 0; i < nCounters; ++i) {
+        hits += counters_[i].hits.load(std::memory_order_relaxed);
+        misses += counters_[i].misses.load(std::memory_order_relaxed);
+      }
+    }
+
+    void resetStats() {
+      for (u32 i = 0; i < nCounters; ++i) {
+        counters_[i].hits.store(0, std::memory_order_relaxed);
+        counters_[i].misses.store(0, std::memory_order_relaxed);
+      }
+    }
+};
+
 SequenceModel::SequenceModel() {
   internal_ = 0;
   root_ = 0;
+  successorCache_ = 0;
+  successorCacheBudget_ = 0;
+  layout_ = compactLayout;
   initialize(0, 0);
   sentenceBegin_ = sentenceEnd_ = 0;
 }
@@ -280,24 +699,118 @@ void SequenceModel::initialize(InitItem *begin, InitItem *end) {
 
   internal_ = new Internal(nNodes, nWordProbabilities);
   root_ = internal_->build(begin, end);
+  applyLayout();
+  resetSuccessorCache();
 }
 
 size_t SequenceModel::memoryUsed() const {
   return sizeof(SequenceModel)
     + sizeof(Internal)
-    + internal_->nodes.capacity() * sizeof(Internal::Nodes::value_type)
-    + internal_->wordProbabilities.capacity() * sizeof(Internal::WordProbabilities::value_type);
+    + internal_->nodes_.capacity() * sizeof(Internal::Nodes::value_type)
+    + internal_->wordProbabilities_.capacity() * sizeof(Internal::WordProbabilities::value_type)
+    + internal_->wordTokens_.capacity() * sizeof(Token)
+    + internal_->wordCodes_.capacity() * sizeof(u8)
+    + internal_->codebook_.capacity() * sizeof(LogProbability)
+    + internal_->codebookBegin_.capacity() * sizeof(u32)
+    + ((internal_->isMapped_) ? internal_->buffer_.len : 0)
+    + successorCacheSize()
+    + (denseChildren_.capacity() + denseProbabilities_.capacity()) * sizeof(u32);
+}
+
+void SequenceModel::setLayout(Layout layout) {
+  layout_ = layout;
+  applyLayout();
+}
+
+/**
+ * Dense root layout: denseChildren_[t] is the index of the root's
+ * child for token t, denseProbabilities_[t] one plus the index of
+ * p(t) among the word probabilities; zero means there is none.
+ */
+void SequenceModel::applyLayout() {
+  std::vector<u32>().swap(denseChildren_);
+  std::vector<u32>().swap(denseProbabilities_);
+  if (layout_ != denseRootLayout) return;
+
+  Token maxChild = 0, maxWord = 0;
+  for (const Node *n = root_->childrenBegin(); n != root_->childrenEnd(); ++n)
+    maxChild = std::max(maxChild, n->token());
+  for (u32 i = root_->wordsBegin(); i < root_->wordsEnd(); ++i)
+    maxWord = std::max(maxWord, internal_->wordToken(i));
+
+  denseChildren_.resize(maxChild + 1, 0);
+  for (const Node *n = root_->childrenBegin(); n != root_->childrenEnd(); ++n)
+    denseChildren_[n->token()] = n - root_;
+  denseProbabilities_.resize(maxWord + 1, 0);
+  for (u32 i = root_->wordsBegin(); i < root_->wordsEnd(); ++i)
+    denseProbabilities_[internal_->wordToken(i)] = i + 1;
+}
+
+inline const SequenceModel::Node *SequenceModel::rootChild(Token t) const {
+  if (layout_ == denseRootLayout) {
+    u32 i = (t < denseChildren_.size()) ? denseChildren_[t] : 0;
+    return (i) ? root_ + i : 0;
+  }
+  return root_->findChild(t);
+}
+
+void SequenceModel::setQuantization(u32 bits) {
+  if (bits != 0 && bits != 8 && bits != 16)
+    throw PythonException(PyExc_ValueError, "quantization must be 0, 8 or 16 bits");
+  if (bits == internal_->quantization_) return;
+  Internal *internal = new Internal(*internal_, bits);
+  delete internal_;
+  internal_ = internal;
+  root_ = internal_->nodes;
+  applyLayout();
+  resetSuccessorCache();
+}
+
+u32 SequenceModel::quantization() const {
+  return internal_->quantization_;
+}
+
+void SequenceModel::setSuccessorCacheSize(size_t bytes) {
+  successorCacheBudget_ = bytes;
+  resetSuccessorCache();
+}
+
+void SequenceModel::resetSuccessorCache() {
+  delete successorCache_;
+  successorCache_ = 0;
+  size_t nGrams = (internal_->nodesEnd - internal_->nodes)
+    + internal_->nWordProbabilities();
+  size_t maxSlots = std::min(successorCacheBudget_ / SuccessorCache::slotSize(), 16 * nGrams);
+  u32 log2Size = 0;
+  while (log2Size < 31 && (size_t(2) << log2Size) <= maxSlots)
+    ++log2Size;
+  if (log2Size > 0)
+    successorCache_ = new SuccessorCache(log2Size);
+}
+
+size_t SequenceModel::successorCacheSize() const {
+  return (successorCache_) ? successorCache_->size() * SuccessorCache::slotSize() : 0;
+}
+
+void SequenceModel::successorCacheStats(u64 &hits, u64 &misses) const {
+  hits = misses = 0;
+  if (successorCache_) successorCache_->stats(hits, misses);
+}
+
+void SequenceModel::resetSuccessorCacheStats() {
+  if (successorCache_) successorCache_->resetStats();
 }
 
 // ===========================================================================
 // sequence model interface
 
 SequenceModel::~SequenceModel() {
+  delete successorCache_;
   delete internal_;
 }
 
 SequenceModel::History SequenceModel::initial() const {
-  const Node *n = root_->findChild(sentenceBegin_);
+  const Node *n = rootChild(sentenceBegin_);
   if (!n) n = root_;
   ensure(n);
   return n;
@@ -305,22 +818,37 @@ SequenceModel::History SequenceModel::initial() const {
 
 SequenceModel::History SequenceModel::advanced(const Node *old, Token w) const {
   require_(old);
-  Token *hist = new Token[old->depth() + 1];
+  if (!successorCache_)
+    return advancedUncached(old, w);
+  u32 successor;
+  if (successorCache_->find(old - root_, w, successor))
+    return root_ + successor;
+  const Node *result = advancedUncached(old, w);
+  successorCache_->insert(old - root_, w, result - root_);
+  return result;
+}
+
+const SequenceModel::Node *SequenceModel::advancedUncached(const Node *old, Token w) const {
+  Token buffer[16];
+  std::vector<Token> longHistory;
+  Token *hist = buffer;
+  if (old->depth() + 1 > 16) {
+    longHistory.resize(old->depth() + 1);
+    hist = &longHistory[0];
+  }
 
   for (const Node *n = old; n; n = n->parent())
     hist[n->depth()] = n->token();
   verify(!hist[0]);
   hist[0] = w;
 
-  const Node *result = root_;
-  for (Node::Depth d = 0; d <= old->depth(); ++d) {
+  const Node *result = rootChild(hist[0]);
+  if (!result) return root_;
+  for (Node::Depth d = 1; d <= old->depth(); ++d) {
     const Node *n = result->findChild(hist[d]);
     if (!n) break;
     result = n;
   }
-  ensure(result);
-
-  delete[] hist;
   return result;
 }
 
@@ -377,9 +905,14 @@ LogProbability SequenceModel::probability(Token w, const Node *h) const {
   require_(h);
   LogProbability probability = LogProbability::certain();
   for (const Node *n = h; n;  n = n->parent()) {
-    const WordProbability *ws = n->findWordProbability(w);
-    if (ws) {
-      probability *= ws->probability();
+    u32 i;
+    if (n == root_ && layout_ == denseRootLayout) {
+      i = (w < denseProbabilities_.size()) ? denseProbabilities_[w] - 1 : Internal::noWord;
+    } else {
+      i = internal_->findWord(n, w);
+    }
+    if (i != Internal::noWord) {
+      probability *= internal_->wordProbability(n, i);
       break;
     }
     probability *= n->backOffWeight();
@@ -387,14 +920,60 @@ LogProbability SequenceModel::probability(Token w, const Node *h) const {
   return probability;
 }
 
-LogProbability SequenceModel::probability(Token w, const std::vector<Token> &history) const {
+/**
+ * A history of length d either predicts t explicitly, or backs off to
+ * its parent, so the bound for length d is the larger of the explicit
+ * probabilities of t at length d and the bound for length d-1 times
+ * the largest back-off weight at length d.
+ */
+LogProbability SequenceModel::probabilityBounds(std::vector<LogProbability> &bounds) const {
+  Token maxToken = 0;
+  Node::Depth maxDepth = 0;
+  for (const Node *n = internal_->nodes; n+1 != internal_->nodesEnd; ++n) {
+    maxDepth = std::max(maxDepth, n->depth());
+    for (u32 i = n->wordsBegin(); i < n->wordsEnd(); ++i)
+      maxToken = std::max(maxToken, internal_->wordToken(i));
+  }
+
+  LogProbability other = root_->backOffWeight(), otherBound = other;
+  std::vector<LogProbability> current(maxToken + 1, other), explicitMax;
+  for (u32 i = root_->wordsBegin(); i < root_->wordsEnd(); ++i)
+    current[internal_->wordToken(i)] = internal_->wordProbability(root_, i);
+  bounds = current;
+
+  for (Node::Depth d = 1; d <= maxDepth; ++d) {
+    LogProbability maxBackOff = LogProbability::impossible();
+    explicitMax.assign(maxToken + 1, LogProbability::impossible());
+    for (const Node *n = internal_->nodes; n+1 != internal_->nodesEnd; ++n) {
+      if (n->depth() != d) continue;
+      maxBackOff = std::max(maxBackOff, n->backOffWeight());
+      for (u32 i = n->wordsBegin(); i < n->wordsEnd(); ++i) {
+        LogProbability &m(explicitMax[internal_->wordToken(i)]);
+        m = std::max(m, internal_->wordProbability(n, i));
+      }
+    }
+    for (Token t = 0; t <= maxToken; ++t) {
+      current[t] = std::max(explicitMax[t], current[t] * maxBackOff);
+      bounds[t] = std::max(bounds[t], current[t]);
+    }
+    other *= maxBackOff;
+    otherBound = std::max(otherBound, other);
+  }
+  return otherBound;
+}
+
+SequenceModel::History SequenceModel::history(const std::vector<Token> &history) const {
   const Node *hn = root_;
   for (unsigned int i = history.size(); i;) {
-    const Node *n = hn->findChild(history[--i]);
+    const Node *n = (hn == root_) ? rootChild(history[--i]) : hn->findChild(history[--i]);
     if (!n) break;
     hn = n;
   }
-  return probability(w, hn);
+  return hn;
+}
+
+LogProbability SequenceModel::probability(Token w, const std::vector<Token> &history) const {
+  return probability(w, this->history(history));
 }
 
 // ===========================================================================
@@ -513,12 +1092,12 @@ void SequenceModel::setInitAndTerm(u32 init, u32 term) {
 
 
 PyObject *SequenceModel::get() const {
-  PyObject *result = PyList_New(internal_->nodes.size() + internal_->wordProbabilities.size() - 2);
+  PyObject *result = PyList_New((internal_->nodesEnd - internal_->nodes) + internal_->nWordProbabilities() - 2);
   int i = 0;
-  for (Internal::Nodes::iterator n = internal_->nodes.begin(); n+1 != internal_->nodes.end(); ++n) {
-    PyObject *history = historyAsTuple(&*n);
-    for (const WordProbability *ws = n->probabilitiesBegin(); ws != n->probabilitiesEnd(); ++ws) {
-      PyObject *hps = Py_BuildValue("(Oif)", history, ws->token_, ws->probability_.score());
+  for (const Node *n = internal_->nodes; n+1 != internal_->nodesEnd; ++n) {
+    PyObject *history = historyAsTuple(n);
+    for (u32 w = n->wordsBegin(); w < n->wordsEnd(); ++w) {
+      PyObject *hps = Py_BuildValue("(Oif)", history, internal_->wordToken(w), internal_->wordProbability(n, w).score());
       verify_(i < PyList_GET_SIZE(result));
       PyList_SET_ITEM(result, i++, hps);
     }
@@ -533,13 +1112,75 @@ PyObject *SequenceModel::get() const {
 
 PyObject *SequenceModel::getNode(const Node *nn) const {
   require(nn);
-  PyObject *result = PyList_New(nn->probabilitiesEnd() - nn->probabilitiesBegin() + 1);
+  PyObject *result = PyList_New(nn->wordsEnd() - nn->wordsBegin() + 1);
   int i = 0;
   PyList_SET_ITEM(result, i++, Py_BuildValue(
         "(Of)", Py_None, nn->backOffWeight_.score()));
-  for (const WordProbability *wp = nn->probabilitiesBegin(); wp != nn->probabilitiesEnd(); ++wp)
+  for (u32 w = nn->wordsBegin(); w < nn->wordsEnd(); ++w)
     PyList_SET_ITEM(result, i++, Py_BuildValue(
-          "(if)", wp->token_, wp->probability_.score()));
+          "(if)", internal_->wordToken(w), internal_->wordProbability(nn, w).score()));
   verify(i == PyList_GET_SIZE(result));
   return result;
 }
+
+PyObject *SequenceModel::getBinary() const {
+  const Internal &in(*internal_);
+  BinaryHeader header;
+  memset(&header, 0, sizeof(header));
+  memcpy(header.magic, (in.quantization_) ? BinaryHeader::quantizedMagicString() : BinaryHeader::magicString(), sizeof(header.magic));
+  header.byteOrder = BinaryHeader::byteOrderMark;
+  header.nodeSize = sizeof(Node);
+  header.wordProbabilitySize = (in.quantization_) ? in.quantization_ / 8 : sizeof(WordProbability);
+  header.nNodes = in.nodesEnd - in.nodes;
+  header.nWordProbabilities = in.nWordProbabilities();
+  header.sentenceBegin = sentenceBegin_;
+  header.sentenceEnd = sentenceEnd_;
+
+  size_t nodesSize = size_t(header.nNodes) * sizeof(Node);
+  size_t wordProbabilitiesSize = (in.quantization_)
+    ? QuantizedImage(in.nOrders, in.nCodes, header.nWordProbabilities, in.quantization_).size
+    : size_t(header.nWordProbabilities) * sizeof(WordProbability);
+  PyObject *result = PyBytes_FromStringAndSize(0, sizeof(header) + nodesSize + wordProbabilitiesSize);
+  if (!result) throw ExistingPythonException();
+  char *data = PyBytes_AS_STRING(result);
+  memcpy(data, &header, sizeof(header));
+  data += sizeof(header);
+  memcpy(data, in.nodes, nodesSize);
+  data += nodesSize;
+  if (!in.quantization_) {
+    memcpy(data, in.wordProbabilities, wordProbabilitiesSize);
+    return result;
+  }
+
+  memset(data, 0, wordProbabilitiesSize);
+  QuantizedImage image(in.nOrders, in.nCodes, header.nWordProbabilities, in.quantization_);
+  CodebookHeader codebookHeader;
+  memset(&codebookHeader, 0, sizeof(codebookHeader));
+  codebookHeader.bits = in.quantization_;
+  codebookHeader.nOrders = in.nOrders;
+  codebookHeader.nCodes = in.nCodes;
+  memcpy(data, &codebookHeader, sizeof(codebookHeader));
+  memcpy(data + image.codebookBegin, in.codebookBegin, (size_t(in.nOrders) + 1) * sizeof(u32));
+  memcpy(data + image.codebook, in.codebook, size_t(in.nCodes) * sizeof(LogProbability));
+  memcpy(data + image.tokens, in.wordTokens, size_t(header.nWordProbabilities) * sizeof(Token));
+  memcpy(data + image.codes, in.wordCodes, size_t(header.nWordProbabilities) * (in.quantization_ / 8));
+  return result;
+}
+
+/**
+ * Use the binary image in the given buffer object (e.g. a memory
+ * mapped file) as model data without copying it.  The buffer is held
+ * until the model is replaced or destroyed.
+ */
+
+void SequenceModel::setBinary(PyObject *buffer) {
+  BinaryHeader header;
+  Internal *internal = new Internal(buffer, header);
+  delete internal_;
+  internal_ = internal;
+  root_ = internal_->nodes;
+  applyLayout();
+  resetSuccessorCache();
+  sentenceBegin_ = header.sentenceBegin;
+  sentenceEnd_   = header.sentenceEnd;
+}
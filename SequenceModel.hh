@@ -106,10 +106,25 @@ public:
     struct InitItem; class InitData;
     struct WordProbability;
 
+    /** How the back-off tree is searched, see setLayout(). */
+    enum Layout {
+      compactLayout,  /**< binary search everywhere */
+      denseRootLayout /**< direct lookup tables for the root node */
+    };
+
 private:
+    struct BinaryHeader;
     class Internal; Internal *internal_;
     class Node; const Node *root_;
+    class SuccessorCache; SuccessorCache *successorCache_;
+    size_t successorCacheBudget_;
+    Layout layout_;
+    std::vector<u32> denseChildren_, denseProbabilities_;
     void initialize(InitItem *begin, InitItem *end);
+    void resetSuccessorCache();
+    void applyLayout();
+    const Node *rootChild(Token) const;
+    const Node *advancedUncached(const Node*, Token) const;
 
     Token sentenceBegin_, sentenceEnd_;
 
@@ -127,6 +142,8 @@ public:
     void set(PyObject*);
     PyObject *get() const;
     PyObject *getNode(History) const;
+    PyObject *getBinary() const;
+    void setBinary(PyObject*);
 
     History initial() const;
     History culDeSac() const { return 0; }
@@ -135,13 +152,49 @@ public:
      * @return zero if h was the empty history */
     History shortened(History h) const;
     u32 historyLength(History) const;
+
+    /** Remember the results of advanced() in a table of at most
+     * @c bytes (zero disables the table).  The table is filled
+     * lazily, emptied whenever the model changes, and may be used by
+     * several threads at once.  It never gets bigger than a few
+     * slots per n-gram of the model. */
+    void setSuccessorCacheSize(size_t bytes);
+    size_t successorCacheSize() const;
+    /** Number of advanced() calls answered from / missing the
+     * table since the last reset. */
+    void successorCacheStats(u64 &hits, u64 &misses) const;
+    void resetSuccessorCacheStats();
+
+    /** Choose the search structure for the model.  The layout stays
+     * in effect when the model data is replaced.  The dense root
+     * layout adds two tables indexed by token, which answers the
+     * lookups every back-off chain ends in with one load instead of a
+     * binary search over the whole vocabulary.  It does not change
+     * the binary image. */
+    void setLayout(Layout);
+    Layout layout() const { return layout_; }
+
+    /** Store the word probabilities as codes of 8 or 16 bits, which
+     * index a codebook per history length, or exactly (zero bits).
+     * The token and the code of a word probability take 5 or 6 bytes
+     * instead of 16.  Back-off weights are kept exactly.  set()
+     * always stores exactly, setBinary() keeps the quantization of the
+     * image. */
+    void setQuantization(u32 bits);
+    u32 quantization() const;
 #ifdef OBSOLETE
     std::string formatHistory(History, const StringInventory *si = 0) const;
 #endif // OBSOLETE
     void historyAsVector(History, std::vector<Token>&) const;
     PyObject *historyAsTuple(History) const;
+    /** longest known history matching a token sequence (oldest first) */
+    History history(const std::vector<Token>&) const;
     LogProbability probability(Token, const std::vector<Token> &history) const;
     LogProbability probability(Token, History) const;
+    /** Upper bounds of p(t | h) over all histories h: bounds[t] for
+     * every token the model has an explicit probability of, the
+     * return value for all other tokens. */
+    LogProbability probabilityBounds(std::vector<LogProbability> &bounds) const;
 
     Token init() const { return sentenceBegin_; }
     Token term() const { return sentenceEnd_; }
@@ -151,8 +204,10 @@ public:
 
 struct SequenceModel::WordProbability {
     Token token_;
+    u32 padding_; /**< explicit, so that binary images are reproducible */
     LogProbability probability_;
 public:
+    WordProbability() { memset(static_cast<void*>(this), 0, sizeof(*this)); }
     Token token() const { return token_; }
     LogProbability probability() const { return probability_; }
 };
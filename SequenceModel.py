@@ -290,16 +290,34 @@ class SequenceModelEstimator:
 
 
 class SequenceModel(sequitur_.SequenceModel):
+    # Memory budget in bytes for the table of history transitions
+    # given to every new model (see setSuccessorCacheSize).
+    successorCacheBudget = 0
+    # Search structure given to every new model (see setLayout).
+    defaultLayout = sequitur_.SequenceModel.compactLayout
+
+    def __init__(self):
+        super(SequenceModel, self).__init__()
+        if self.successorCacheBudget:
+            self.setSuccessorCacheSize(self.successorCacheBudget)
+        if self.defaultLayout != self.compactLayout:
+            self.setLayout(self.defaultLayout)
+
     def __getstate__(self):
         dct = copy.copy(self.__dict__)
         del dct["this"]
-        return (self.init(), self.term(), self.get(), dct)
-
-    def __setstate__(self, data):
-        super(SequenceModel, self).__init__()
-        init, term, data, dct = data
+        state = (self.init(), self.term(), self.get(), dct)
+        if self.quantization():
+            state += (self.quantization(),)
+        return state
+
+    def __setstate__(self, state):
+        self.__init__()
+        init, term, data, dct = state[:4]
         self.setInitAndTerm(init, term)
         self.set(data)
+        if len(state) > 4:
+            self.setQuantization(state[4])
         self.__dict__.update(dct)
 
     def size(self):
@@ -363,6 +381,138 @@ class SequenceModel(sequitur_.SequenceModel):
         data = [((), None, math.log(vocabularySize))]
         self.set(data)
 
+    def prune(self, threshold=None, size=None):
+        """
+        Relative entropy pruning (A. Stolcke: "Entropy-based Pruning of
+        Backoff Language Models", 1998).  Each n-gram is rated by how
+        much the relative entropy between the original and the pruned
+        model grows when it is removed and its probability is taken
+        from the back-off distribution instead.  N-grams rated below
+        threshold are removed, and if size is given, the lowest rated
+        ones are removed until at most size n-grams remain.  The
+        probabilities of the empty history are kept.  Back-off weights
+        are recomputed and histories left without n-grams are dropped.
+        Returns the number of n-grams before and after pruning.
+        """
+
+        scores = {}
+        explicit = {}
+        backOff = {}
+        for history, predicted, score in self.get():
+            scores[(history, predicted)] = score
+            if predicted is None:
+                backOff[history] = math.exp(-score)
+            else:
+                explicit.setdefault(history, {})[predicted] = math.exp(-score)
+        oldSize = len(scores) - len(backOff)
+        if not any(explicit):
+            return oldSize, oldSize
+
+        def probability(history, predicted):
+            weight = 1.0
+            while True:
+                if predicted in explicit.get(history, ()):
+                    return weight * explicit[history][predicted]
+                weight *= backOff.get(history, 1.0)
+                if not history:
+                    return weight
+                history = history[1:]
+
+        # Graphone models usually have no explicit probabilities for the
+        # empty history, so the frequency of the oldest token of a
+        # history is taken from the stationary distribution of the
+        # bigram part of the model rather than from p(token | ()).
+        tokens = set()
+        for history, words in explicit.items():
+            tokens.update(history)
+            tokens.update(words)
+        rootProbability = dict((t, probability((), t)) for t in tokens)
+        frequency = dict((t, 1.0 / len(tokens)) for t in tokens)
+        for iteration in range(100):
+            backedOff = sum(f * backOff.get((t,), 1.0) for t, f in frequency.items())
+            newFrequency = dict((t, backedOff * rootProbability[t]) for t in tokens)
+            for t, f in frequency.items():
+                weight = backOff.get((t,), 1.0)
+                for predicted, p in explicit.get((t,), {}).items():
+                    newFrequency[predicted] += f * (
+                        p - weight * rootProbability[predicted]
+                    )
+            total = sum(newFrequency.values())
+            change = sum(abs(newFrequency[t] / total - frequency[t]) for t in tokens)
+            frequency = dict((t, f / total) for t, f in newFrequency.items())
+            if change < 1e-9:
+                break
+
+        def historyProbability(history):
+            result = frequency[history[0]]
+            for i in range(1, len(history)):
+                result *= probability(history[:i], history[i])
+            return result
+
+        candidates = []
+        for history, words in explicit.items():
+            if not history:
+                continue
+            weight = backOff.get(history, 1.0)
+            lower = dict((w, probability(history[1:], w)) for w in words)
+            numerator = 1.0 - sum(words.values())
+            denominator = 1.0 - sum(lower.values())
+            historyWeight = historyProbability(history)
+            for predicted, p in words.items():
+                newDenominator = denominator + lower[predicted]
+                if not (lower[predicted] > 0.0 and newDenominator > 0.0):
+                    continue
+                newWeight = (numerator + p) / newDenominator
+                if not newWeight > 0.0:
+                    continue
+                change = p * (
+                    math.log(lower[predicted])
+                    + math.log(newWeight)
+                    + scores[(history, predicted)]
+                )
+                if numerator > 0.0 and weight > 0.0:
+                    change += numerator * (math.log(newWeight) - math.log(weight))
+                candidates.append((-historyWeight * change, history, predicted))
+        candidates.sort()
+
+        nPruned = 0
+        if threshold is not None:
+            while nPruned < len(candidates) and candidates[nPruned][0] < threshold:
+                nPruned += 1
+        if size is not None:
+            nPruned = max(nPruned, min(oldSize - size, len(candidates)))
+
+        changed = set()
+        for delta, history, predicted in candidates[:nPruned]:
+            del explicit[history][predicted]
+            del scores[(history, predicted)]
+            changed.add(history)
+
+        for history in sorted(backOff, key=len):
+            if not any(history[i:] in changed for i in range(len(history))):
+                continue
+            words = explicit.get(history, {})
+            numerator = 1.0 - sum(words.values())
+            denominator = 1.0 - sum(probability(history[1:], w) for w in words)
+            if numerator > 0.0 and denominator > 0.0:
+                backOff[history] = numerator / denominator
+                scores[(history, None)] = -math.log(backOff[history])
+
+        parents = set()
+        for history in sorted(backOff, key=len, reverse=True):
+            if (
+                history in changed
+                and not explicit[history]
+                and history not in parents
+                and backOff[history] == 1.0
+            ):
+                del scores[(history, None)]
+            else:
+                parents.add(history[1:])
+
+        self.set([key + (score,) for key, score in scores.items()])
+        return oldSize, oldSize - nPruned
+
 
 def evidenceFromSequence(sequence, order):
     result = []
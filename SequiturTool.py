@@ -39,9 +39,13 @@ from sequitur import (
     StaticDiscounts,
     FixedDiscounts,
     EagerDiscountAdjuster,
+    Sample,
 )
 from sequitur import Translator
 from Evaluation import Evaluator
+from misc import gOpenOut
+import ModelFile
+import SequenceModel
 from tool import UsageError
 import sys
 
@@ -168,6 +172,11 @@ class Tool:
             return
         template.minIterations = self.options.minIterations
         template.maxIterations = self.options.maxIterations
+        if getattr(self.options, "jobs", None):
+            template.nJobs = self.options.jobs
+        if self.options.nThreads:
+            template.nThreads = self.options.nThreads
+        template.graphCacheSize = self.options.graphCacheSize * 1024 * 1024
         if self.options.checkpoint and self.options.newModelFile:
             template.checkpointInterval = 8 * 60 * 60
             base, ext = os.path.splitext(self.options.newModelFile)
@@ -196,11 +205,19 @@ class Tool:
         return estimationContext.bestModel
 
     def procureModel(self):
+        SequenceModel.SequenceModel.successorCacheBudget = int(
+            getattr(self.options, "successorCacheSize", 0) * 1024 * 1024
+        )
+        SequenceModel.SequenceModel.defaultLayout = modelLayouts[
+            getattr(self.options, "modelLayout", None) or "compact"
+        ]
         if self.options.resume_from_checkpoint:
             model = ModelTemplate.resume(self.options.resume_from_checkpoint)
             self.sequitur = model.sequitur
         elif self.options.modelFile:
-            if sys.version_info[:2] >= (3, 0):
+            if ModelFile.isBinaryModelFile(self.options.modelFile):
+                model = ModelFile.load(self.options.modelFile)
+            elif sys.version_info[:2] >= (3, 0):
                 model = pickle.load(
                     open(self.options.modelFile, "rb"), encoding="latin1"
                 )
@@ -236,16 +253,32 @@ class Tool:
         if self.options.shouldTranspose:
             model.transpose()
 
+        pruneThreshold = getattr(self.options, "pruneThreshold", None)
+        pruneSize = getattr(self.options, "pruneSize", None)
+        if pruneThreshold is not None or pruneSize is not None:
+            oldSize, newSize = model.sequenceModel.prune(pruneThreshold, pruneSize)
+            print(
+                "pruned model from %d to %d n-grams" % (oldSize, newSize),
+                file=self.log,
+            )
+
+        quantization = getattr(self.options, "quantization", None)
+        if quantization is not None:
+            model.sequenceModel.setQuantization(int(quantization))
+
         if self.options.newModelFile:
             oldSize, newSize = model.strip()
             print(
                 "stripped number of multigrams from %d to %d" % (oldSize, newSize),
                 file=self.log,
             )
-            f = open(self.options.newModelFile, "wb")
-            pickle.dump(model, f, pickle.HIGHEST_PROTOCOL)
-            f.close()
-            del f
+            if self.options.shouldWriteBinaryModel:
+                ModelFile.save(model, self.options.newModelFile)
+            else:
+                f = open(self.options.newModelFile, "wb")
+                pickle.dump(model, f, pickle.HIGHEST_PROTOCOL)
+                f.close()
+                del f
 
         if self.options.shouldSelfTest:
             print(
@@ -267,11 +300,30 @@ class Tool:
         return model
 
 
+modelLayouts = {
+    "compact": SequenceModel.SequenceModel.compactLayout,
+    "dense-root": SequenceModel.SequenceModel.denseRootLayout,
+}
+
+
 def procureModel(options, loadSample, log=sys.stdout):
     tool = Tool(options, loadSample, log)
     return tool.procureModel()
 
 
+def writeStatistics(statistics, fname):
+    """
+    Save search statistics, see Translator.statistics(), as JSON.
+    """
+    import json
+
+    f = gOpenOut(fname, "UTF-8")
+    json.dump(statistics, f, indent=1, sort_keys=True, ensure_ascii=False)
+    print(file=f)
+    if fname != "-":
+        f.close()
+
+
 def addTrainOptions(optparser):
     optparser.add_option(
         "-t",
@@ -322,6 +374,39 @@ def addTrainOptions(optparser):
         help="write model to FILE",
         metavar="FILE",
     )
+    optparser.add_option(
+        "--binary-model",
+        dest="shouldWriteBinaryModel",
+        action="store_true",
+        help="write model (see --write-model) in memory-mappable binary format. "
+        "Binary models are recognized automatically by --model.",
+    )
+    optparser.add_option(
+        "--prune",
+        dest="pruneThreshold",
+        type="float",
+        help="remove the n-grams whose removal changes the model by less than "
+        "THRESHOLD in relative entropy (e.g. 1e-7) from the loaded or trained "
+        "model, typically before writing it with --write-model",
+        metavar="THRESHOLD",
+    )
+    optparser.add_option(
+        "--prune-size",
+        dest="pruneSize",
+        type="int",
+        help="like --prune, but remove the least important n-grams until at "
+        "most N remain",
+        metavar="N",
+    )
+    optparser.add_option(
+        "--quantize",
+        dest="quantization",
+        choices=["0", "8", "16"],
+        help="store the probabilities of the model (after loading or training, "
+        "and as written by --write-model) as BITS bit codes, which saves memory "
+        "at a small loss of accuracy; 0 restores exact storage",
+        metavar="BITS",
+    )
     optparser.add_option(
         "--continuous-test",
         dest="shouldTestContinuously",
@@ -391,6 +476,42 @@ def addTrainOptions(optparser):
         default=ModelTemplate.maxIterations,
         help="maximum number of EM iterations during training",
     )
+    optparser.add_option(
+        "--threads",
+        dest="nThreads",
+        type="int",
+        help="use N threads for evidence and log-likelihood computation during training",
+        metavar="N",
+    )
+    optparser.add_option(
+        "--graph-cache-mb",
+        dest="graphCacheSize",
+        type="int",
+        default=Sample.graphCacheSize // (1024 * 1024),
+        help="keep up to MB megabytes of estimation graphs in memory for each of "
+        "the training and development samples; the rest is rebuilt in every "
+        "pass (default: %default)",
+        metavar="MB",
+    )
+    optparser.add_option(
+        "--successor-cache-mb",
+        dest="successorCacheSize",
+        type="float",
+        default=0,
+        help="memorize history transitions of the sequence models in a table of "
+        "up to MB megabytes per model (default: off)",
+        metavar="MB",
+    )
+    optparser.add_option(
+        "--model-layout",
+        dest="modelLayout",
+        choices=sorted(modelLayouts),
+        default="compact",
+        help="search structure of the sequence models: 'compact' uses binary "
+        "search only, 'dense-root' adds lookup tables for the most frequent "
+        "queries at some memory cost (default: %default)",
+        metavar="LAYOUT",
+    )
     optparser.add_option(
         "--eager-discount-adjustment",
         action="store_true",
@@ -30,72 +30,285 @@
 
 #if defined(__GXX_EXPERIMENTAL_CXX0X__) || (__cplusplus >= 201103L) || (__APPLE__) || (_MSC_VER)
 #include <unordered_map>
-using std::unordered_multimap;
 using std::unordered_map;
 #else
 #include <tr1/unordered_map>
-using std::tr1::unordered_multimap;
 using std::tr1::unordered_map;
 #endif
 
+#include <atomic>
+#include <chrono>
 #include <memory>
+#include <mutex>
+#include <vector>
 #include <stdexcept>
+#include <string>
 
 #include "Assertions.hh"
 #include "Graph.hh"
 #include "Multigram.hh"
 #include "MultigramGraph.hh"
+#include "Obstack.hh"
 #include "PriorityQueue.hh"
 #include "Probability.hh"
 #include "SequenceModel.hh"
 #include "Utility.hh"
 
+/**
+ * Once the inventory and sequence model are set, a Translator may be
+ * used by several threads at the same time: all search state lives on
+ * the stack of the calling thread, and the model is only read.  An
+ * NBestContext must not be shared between threads, though.
+ */
 class Translator {
   private:
     MultigramInventory *inventory_;
     SequenceModel *sequenceModel_;
 
-    u32 minLeftLen_,  maxLeftLen_;
-    typedef unordered_multimap<Multigram, SequenceModel::Token, Multigram::Hash> LeftMap;
-    LeftMap leftMap_;
+    LeftMultigramTrie leftTrie_;
 
     u32 stackLimit_;
-    u32 stackUsage_;
+    std::atomic<u32> stackUsage_;
+
+    double beam_;   /**< score margin, negative if threshold pruning is off */
+    u32 beamSize_;  /**< hypotheses expanded per position, zero if unlimited */
+
+    bool lazyNBest_, exactPosteriors_;
+    std::vector<LogProbability> probabilityBounds_; /**< only if lazyNBest_ */
+    LogProbability otherProbabilityBound_;
+
+    void updateStackUsage(u32 stackSize) {
+      u32 usage = stackUsage_.load();
+      while (usage < stackSize && !stackUsage_.compare_exchange_weak(usage, stackSize));
+    }
 
   public:
     Translator() :
       inventory_(0), sequenceModel_(0),
-      stackLimit_(2147483647), stackUsage_(0)
+      stackLimit_(2147483647), stackUsage_(0),
+      beam_(-1.0), beamSize_(0),
+      lazyNBest_(false), exactPosteriors_(true)
   {}
 
+    ~Translator() {
+      for (size_t i = 0; i < idleArenas_.size(); ++i)
+        delete idleArenas_[i];
+    }
+
     void setMultigramInventory(MultigramInventory *mi) {
       require(mi);
 
       inventory_ = mi;
-
-      leftMap_.clear();
-      minLeftLen_ = Multigram::maximumLength;
-      maxLeftLen_ = 0;
-      for (MultigramIndex q = 1; q <= inventory_->size(); ++q) {
-        JointMultigram jmg(inventory_->symbol(q));
-        leftMap_.insert(std::make_pair(jmg.left, q));
-        minLeftLen_ = std::min(minLeftLen_, jmg.left.length());
-        maxLeftLen_ = std::max(maxLeftLen_, jmg.left.length());
-      }
+      leftTrie_.build(*inventory_);
     }
 
     void setSequenceModel(SequenceModel *sm) {
       require(sm);
       sequenceModel_ = sm;
+      updateProbabilityBounds();
     }
 
     u32 stackUsage() {
-      u32 result = stackUsage_;
-      stackUsage_ = 0;
-      return result;
+      return stackUsage_.exchange(0);
     }
     void setStackLimit(u32 l) { stackLimit_ = l; }
 
+    /**
+     * Turn the exact search into a beam search: hypotheses whose
+     * score exceeds that of the best hypothesis covering the same
+     * number of source symbols by more than @c margin (negative log
+     * probability) are dropped.  A negative margin disables threshold
+     * pruning.
+     */
+    void setBeam(double margin) { beam_ = margin; }
+
+    /**
+     * Expand at most @c n hypotheses per number of covered source
+     * symbols (histogram pruning).  Zero means no limit.
+     */
+    void setBeamSize(u32 n) { beamSize_ = n; }
+
+    /**
+     * Let nBest() search the variants lazily instead of building the
+     * complete search graph first: an A* search over partial
+     * translations, which stops as soon as enough variants have been
+     * found.  The beam settings do not apply to it.  The model must
+     * not change while lazy n-best search is on, unless it is set
+     * again.
+     */
+    void setLazyNBest(bool lazy) {
+      lazyNBest_ = lazy;
+      updateProbabilityBounds();
+    }
+
+    /**
+     * Whether lazy n-best search normalizes the posteriors by the
+     * total likelihood of the input (exact, one extra pass over all
+     * translations), or by the sum over the variants found
+     * (approximate, needs a maximum number of variants).
+     */
+    void setExactPosteriors(bool exact) { exactPosteriors_ = exact; }
+
+    // ===========================================================================
+    // statistics
+  public:
+    /** Cost of the search for one input. */
+    struct SearchStatistics {
+      u32 expanded;   /**< hypotheses expanded */
+      u32 openPeak;   /**< largest size of the open list */
+      u32 graphNodes; /**< nodes of the n-best search graph */
+      u64 microseconds;
+      bool failed;
+      SearchStatistics() :
+        expanded(0), openPeak(0), graphNodes(0), microseconds(0), failed(false) {}
+    };
+
+    /**
+     * Aggregate over all searches since the last reset: total,
+     * maximum and a histogram of each counter, where bucket b > 0
+     * holds the values from 2^(b-1) to 2^b - 1 (the last one also
+     * all larger values) and bucket 0 the zeros, and the slowest
+     * inputs.
+     */
+    struct Statistics {
+      enum Counter {
+        expandedCounter, openPeakCounter, graphNodesCounter, microsecondsCounter,
+        nCounters
+      };
+      static const u32 nBuckets = 40;
+      static const u32 nSlowest = 10;
+
+      u64 searches, failures;
+      u64 total[nCounters], maximum[nCounters];
+      u64 histogram[nCounters][nBuckets];
+      /** in order of decreasing time */
+      std::vector<std::pair<SearchStatistics, Sequence> > slowest;
+
+      Statistics() { clear(); }
+
+      void clear() {
+        searches = failures = 0;
+        std::fill(&total[0], &total[nCounters], 0);
+        std::fill(&maximum[0], &maximum[nCounters], 0);
+        std::fill(&histogram[0][0], &histogram[0][0] + nCounters * nBuckets, 0);
+        slowest.clear();
+      }
+
+      static u32 bucket(u64 value) {
+        u32 b = 0;
+        for (; value && b + 1 < nBuckets; value >>= 1) ++b;
+        return b;
+      }
+
+      void add(const Sequence &left, const SearchStatistics &s) {
+        const u64 values[nCounters] = {s.expanded, s.openPeak, s.graphNodes, s.microseconds};
+        ++searches;
+        if (s.failed) ++failures;
+        for (u32 c = 0; c < nCounters; ++c) {
+          total[c] += values[c];
+          maximum[c] = std::max(maximum[c], values[c]);
+          ++histogram[c][bucket(values[c])];
+        }
+        if (slowest.size() < nSlowest || slowest.back().first.microseconds < s.microseconds) {
+          if (slowest.size() == nSlowest) slowest.pop_back();
+          size_t i = slowest.size();
+          while (i > 0 && slowest[i - 1].first.microseconds < s.microseconds) --i;
+          slowest.insert(slowest.begin() + i, std::make_pair(s, left));
+        }
+      }
+
+      /**
+       * Further work on a search added before, as done by
+       * nBestNext(): it counts towards the totals only, since the
+       * histograms, maxima and slowest list are per search, and not
+       * towards the open list peak, which is no sum.
+       */
+      void addToTotals(const SearchStatistics &s) {
+        const u64 values[nCounters] = {s.expanded, s.openPeak, s.graphNodes, s.microseconds};
+        for (u32 c = 0; c < nCounters; ++c)
+          if (c != openPeakCounter) total[c] += values[c];
+      }
+    };
+
+    /** Copy the statistics to @c out, and clear them if @c reset. */
+    void statistics(Statistics &out, bool reset) {
+      std::lock_guard<std::mutex> lock(statisticsMutex_);
+      out = statistics_;
+      if (reset) statistics_.clear();
+    }
+
+  private:
+    std::mutex statisticsMutex_;
+    Statistics statistics_;
+
+    /**
+     * Measures one search and adds it to the statistics when it goes
+     * out of scope, also if the search throws.
+     */
+    class SearchRecorder {
+      Translator &translator_;
+      const Sequence &left_;
+      std::chrono::steady_clock::time_point start_;
+    public:
+      SearchStatistics stats;
+      bool succeeded;
+
+      SearchRecorder(Translator &translator, const Sequence &left) :
+        translator_(translator), left_(left),
+        start_(std::chrono::steady_clock::now()), succeeded(false) {}
+
+      ~SearchRecorder() {
+        stats.failed = !succeeded;
+        stats.microseconds = std::chrono::duration_cast<std::chrono::microseconds>(
+            std::chrono::steady_clock::now() - start_).count();
+        std::lock_guard<std::mutex> lock(translator_.statisticsMutex_);
+        translator_.statistics_.add(left_, stats);
+      }
+    };
+
+    // ===========================================================================
+    // beam pruning
+  private:
+    /**
+     * Pruning state of a single search.  Since hypotheses are expanded
+     * best first, the first ones expanded at a position are also the
+     * best there, so histogram pruning just counts.
+     */
+    class Beam {
+      LogProbability margin_;
+      bool hasMargin_;
+      u32 size_;
+      std::vector<LogProbability> best_;
+      std::vector<u32> nExpanded_;
+    public:
+      Beam(const Translator &t, u32 length) :
+        margin_(std::max(t.beam_, 0.0)), hasMargin_(t.beam_ >= 0.0), size_(t.beamSize_)
+      {
+        if (hasMargin_) best_.resize(length + 1, LogProbability::impossible());
+        if (size_) nExpanded_.resize(length + 1, 0);
+      }
+
+      /** Should a new hypothesis at position @c pos be kept? */
+      bool admit(u32 pos, LogProbability p) {
+        if (!hasMargin_) return true;
+        if (p > best_[pos]) {
+          best_[pos] = p;
+          return true;
+        }
+        return p >= best_[pos] * margin_;
+      }
+
+      /** Should a hypothesis at position @c pos be expanded? */
+      bool expand(u32 pos, LogProbability p) {
+        if (hasMargin_ && p < best_[pos] * margin_) return false;
+        if (size_) {
+          if (nExpanded_[pos] >= size_) return false;
+          ++nExpanded_[pos];
+        }
+        return true;
+      }
+    };
+
     // ===========================================================================
     // single best translation
   private:
@@ -108,11 +321,45 @@ class Translator {
     struct Trace :
       public TracebackItem
   {
-    std::shared_ptr<Trace> back;
-    Trace(const std::shared_ptr<Trace> &_b, const MultigramIndex &_q, LogProbability _p) :
+    const Trace *back;
+    Trace(const Trace *_b, const MultigramIndex &_q, LogProbability _p) :
       TracebackItem(_q, _p), back(_b) {}
   };
 
+    /**
+     * The traces of a search are allocated from an arena, which is
+     * emptied, but keeps its memory, when the search is done.  Idle
+     * arenas are kept by the Translator, so that searches running at
+     * the same time each get one of their own.
+     */
+    typedef Core::Obstack<Trace> TraceArena;
+    std::mutex arenaMutex_;
+    std::vector<TraceArena*> idleArenas_;
+
+    class TraceArenaLease {
+      Translator &translator_;
+      TraceArena *arena_;
+    public:
+      TraceArenaLease(Translator &translator) : translator_(translator), arena_(0) {
+        {
+          std::lock_guard<std::mutex> lock(translator_.arenaMutex_);
+          if (!translator_.idleArenas_.empty()) {
+            arena_ = translator_.idleArenas_.back();
+            translator_.idleArenas_.pop_back();
+          }
+        }
+        if (!arena_) arena_ = new TraceArena;
+      }
+      ~TraceArenaLease() {
+        arena_->reset();
+        std::lock_guard<std::mutex> lock(translator_.arenaMutex_);
+        translator_.idleArenas_.push_back(arena_);
+      }
+      const Trace *add(const Trace *back, MultigramIndex q, LogProbability p) {
+        return arena_->add(Trace(back, q, p));
+      }
+    };
+
     struct State {
       u32 pos; /**< covered source positions */
       SequenceModel::History history;
@@ -145,7 +392,7 @@ class Translator {
 
     struct Hyp : public HypBase {
       MultigramIndex q;
-      std::shared_ptr<Trace> trace;
+      const Trace *trace;
     };
 
     typedef Core::TracedPriorityQueue<
@@ -154,16 +401,13 @@ class Translator {
       State::Hash> Open;
     typedef unordered_map<State, LogProbability, State::Hash> Closed;
 
-    Open open_;
-    Closed closed_;
-
-    inline bool insertOrRelax(const Hyp &nh) {
-      Closed::const_iterator relaxTo = closed_.find(nh.state);
-      if (relaxTo != closed_.end()) {
+    static inline bool insertOrRelax(Open &open, const Closed &closed, const Hyp &nh) {
+      Closed::const_iterator relaxTo = closed.find(nh.state);
+      if (relaxTo != closed.end()) {
         verify(nh.p <= relaxTo->second);
         return false;
       } else {
-        if (!open_.insertOrRelax(nh))
+        if (!open.insertOrRelax(nh))
           return false;
       }
 #if 0
@@ -181,88 +425,139 @@ class Translator {
         std::vector<MultigramIndex> &result)
     {
       require(sequenceModel_);
-      verify(open_.empty());
-      verify(closed_.empty());
-      u32 maxStackSize = 0;
+      SearchRecorder recorder(*this, left);
+      Open open;
+      Closed closed;
+      Beam beam(*this, left.size());
+      TraceArenaLease traces(*this);
+      u32 &maxStackSize(recorder.stats.openPeak);
 
       Hyp current, next;
       next.state.pos  = 0;
       next.state.history = sequenceModel_->initial();
       next.q = sequenceModel_->init();
       next.p = LogProbability::certain();
-      open_.insert(next);
+      next.trace = 0;
+      open.insert(next);
 
-      while (!open_.empty()) {
-        current = open_.top(); open_.pop();
+      while (!open.empty()) {
+        current = open.top(); open.pop();
 #if 0
         std::cerr << current.p.score()
           << "\tl=" << current.state.pos
           << "\th=" << sequenceModel_->formatHistory(current.state.history, 0)
           << "\tq=" << current.q << std::endl; // DEBUG
 #endif
-        Closed::const_iterator relaxTo = closed_.find(current.state);
-        verify(relaxTo == closed_.end()); // DEBUG BRAIN: really ???
-        if (relaxTo != closed_.end()) {
+        Closed::const_iterator relaxTo = closed.find(current.state);
+        verify(relaxTo == closed.end()); // DEBUG BRAIN: really ???
+        if (relaxTo != closed.end()) {
           verify(current.p <= relaxTo->second);
           continue;
         } else {
-          closed_[current.state] = current.p;
+          closed[current.state] = current.p;
         }
 
-        next.trace = std::make_shared<Trace>(current.trace, current.q, current.p);
+        next.trace = traces.add(current.trace, current.q, current.p);
 
         if (current.state.history == sequenceModel_->culDeSac() &&
             current.q == sequenceModel_->term()) {
           verify(current.state.pos == left.size());
           goto goalStateReached;
         }
+        if (!beam.expand(current.state.pos, current.p))
+          continue;
+        ++recorder.stats.expanded;
 
         verify(current.state.pos <= left.size());
-        int lb = current.state.pos;
-        LeftMap::const_iterator mi, mi_end;
-        for (int le = lb + (int)minLeftLen_;
-                 le <= lb + (int)maxLeftLen_ && le <= (int)left.size(); ++le) {
-          Multigram lmg(&left[lb], &left[le]);
-          for (Core::tie(mi, mi_end) = leftMap_.equal_range(lmg); mi != mi_end; ++mi) {
-            next.q = mi->second;
+        LeftMultigramTrie::Node node = LeftMultigramTrie::root();
+        for (u32 le = current.state.pos; node != LeftMultigramTrie::noNode(); ) {
+          for (const MultigramIndex *mi = leftTrie_.multigramsBegin(node);
+               mi != leftTrie_.multigramsEnd(node); ++mi) {
+            next.q = *mi;
             next.state.pos = le;
             next.state.history = sequenceModel_->advanced(current.state.history, next.q);
             next.p = current.p * sequenceModel_->probability(next.q, current.state.history);
-            insertOrRelax(next);
+            if (beam.admit(next.state.pos, next.p))
+              insertOrRelax(open, closed, next);
           }
+          node = (le < left.size()) ? leftTrie_.next(node, left[le++]) : LeftMultigramTrie::noNode();
         }
         if (current.state.pos == left.size()) { // end of string
           next.q = sequenceModel_->term();
           next.state.pos = left.size();
           next.state.history = sequenceModel_->culDeSac();
           next.p = current.p * sequenceModel_->probability(next.q, current.state.history);
-          insertOrRelax(next);
+          insertOrRelax(open, closed, next);
         }
 
-        if (maxStackSize < open_.size())
-          maxStackSize = open_.size();
-        if (open_.size() > stackLimit_) {
-          open_.clear(); closed_.clear();
+        if (maxStackSize < open.size())
+          maxStackSize = open.size();
+        if (open.size() > stackLimit_) {
           throw std::runtime_error("stack size limit exceeded");
         }
-      } // while (!open_.empty())
+      } // while (!open.empty())
 
-      closed_.clear();
       throw std::runtime_error("translation failed");
 
 goalStateReached:
-      if (stackUsage_ < maxStackSize)
-        stackUsage_ = maxStackSize;
-
-      open_.clear(); closed_.clear();
+      updateStackUsage(maxStackSize);
 
       result.clear();
-      for (std::shared_ptr<Trace> trace = next.trace; trace; trace = trace->back)
+      for (const Trace *trace = next.trace; trace; trace = trace->back)
         result.push_back(trace->q);
       std::reverse(result.begin(), result.end());
+      recorder.succeeded = true;
       return next.trace->p;
     } // translate()
 
+    // ===========================================================================
+    // batch translation
+  public:
+    struct BatchResult {
+      LogProbability p;
+      Sequence right;    /**< concatenated right-hand sides of first-best */
+      std::string error; /**< empty iff translation succeeded */
+    };
+
+    /**
+     * First-best translation of many inputs in one go.  Failures are
+     * recorded per input rather than thrown.  Does not touch any
+     * Python object, so the caller may release the interpreter lock.
+     */
+    void translateBatch(
+        const std::vector<Sequence> &lefts,
+        std::vector<BatchResult> &results)
+    {
+      require(inventory_);
+      std::vector<MultigramIndex> mgs;
+      results.resize(lefts.size());
+      for (size_t i = 0; i < lefts.size(); ++i) {
+        BatchResult &r(results[i]);
+        r.right.clear();
+        r.error.clear();
+        try {
+          r.p = translate(lefts[i], mgs);
+        } catch (const std::exception &e) {
+          r.error = e.what();
+          continue;
+        } catch (...) {
+          r.error = "unspecified exception";
+          continue;
+        }
+        appendRight(mgs, r.right);
+      }
+    }
+
+  private:
+    /** Right-hand sides of a multigram sequence framed by init and term. */
+    void appendRight(const std::vector<MultigramIndex> &mgs, Sequence &right) const {
+      for (size_t j = 1; j + 1 < mgs.size(); ++j) {
+        Multigram mg(inventory_->symbol(mgs[j]).right);
+        for (u32 k = 0; k < mg.length(); ++k)
+          right.push_back(mg[k]);
+      }
+    }
+
     // ===========================================================================
     // N-best translation
   public:
@@ -274,9 +569,11 @@ goalStateReached:
       NodeMap<LogProbability> forwardProbability_;
 
       typedef Translator::Trace Trace;
+      Core::Obstack<Trace> traces_;
+
       struct Hyp {
         Graph::NodeId n;
-        std::shared_ptr<Trace> trace;
+        const Trace *trace;
         LogProbability p, Q;
 
         struct PriorityFunction {
@@ -299,33 +596,37 @@ goalStateReached:
         open_.clear();
         Hyp init;
         init.n = final_;
+        init.trace = 0;
         init.p = LogProbability::certain();
         init.Q = forwardProbability_[init.n];
         open_.insert(init);
       }
 
-      std::shared_ptr<Trace> next() {
+      const Trace *next(SearchStatistics &stats) {
         Hyp current, next;
         while (!open_.empty()) {
           current = open_.top(); open_.pop();
 
           if (current.n == initial_)
             return current.trace;
+          ++stats.expanded;
 
           for (Graph::IncomingEdgeIterator e = graph_.incomingEdges(current.n); e; ++e) {
             next.n = graph_.source(*e);
             next.p = current.p * probability_[*e];
-            next.trace = std::make_shared<Trace>(current.trace, token_[*e], next.p);
+            next.trace = traces_.add(Trace(current.trace, token_[*e], next.p));
             next.Q = next.p * forwardProbability_[next.n];
             open_.insert(next);
           }
 
+          if (stats.openPeak < open_.size())
+            stats.openPeak = open_.size();
           if (open_.size() > stackLimit_) {
             open_.clear();
             throw std::runtime_error("stack size limit exceeded");
           }
         }
-        return std::shared_ptr<Trace>();
+        return 0;
       }
 #if defined(INSTRUMENTATION)
       public:
@@ -356,16 +657,14 @@ goalStateReached:
       BuildHyp, State,
       BuildHyp::KeyFunction, BuildHyp::PriorityFunction,
       State::Hash> OpenNodes;
-    StateNodeMap stateNodes_;
-    OpenNodes openNodes_;
 
     bool buildAndInsertOrRelax(
-        NBestContext *context,
+        NBestContext *context, StateNodeMap &stateNodes, OpenNodes &openNodes,
         const BuildHyp &current, Graph::NodeId currentNode, const BuildHyp &next, SequenceModel::Token token)
     {
-      Graph::NodeId nextNode = stateNodes_[next.state];
+      Graph::NodeId nextNode = stateNodes[next.state];
       if (!nextNode) {
-        nextNode = stateNodes_[next.state] = context->graph_.newNode();
+        nextNode = stateNodes[next.state] = context->graph_.newNode();
         context->forwardProbability_.set(nextNode, LogProbability::invalid());
       }
       Graph::EdgeId edge = context->graph_.newEdge(currentNode, nextNode);
@@ -373,33 +672,33 @@ goalStateReached:
       context->probability_.set(
           edge, sequenceModel_->probability(token, current.state.history));
       if (context->forwardProbability_[nextNode] == LogProbability::invalid()) {
-        return openNodes_.insertOrRelax(next);
+        return openNodes.insertOrRelax(next);
       } else {
         verify(next.p <= context->forwardProbability_[nextNode]);
       }
       return false;
     }
 
-  public:
-    NBestContext *nBestInit(const Sequence &left) {
+    NBestContext *buildNBestContext(const Sequence &left, SearchStatistics &stats) {
       require(sequenceModel_);
-      verify(openNodes_.empty());
-      verify(stateNodes_.empty());
-      u32 maxStackSize = 0;
+      StateNodeMap stateNodes;
+      OpenNodes openNodes;
+      Beam beam(*this, left.size());
+      u32 &maxStackSize(stats.openPeak);
 
-      NBestContext *context = new NBestContext(stackLimit_);
+      std::unique_ptr<NBestContext> context(new NBestContext(stackLimit_));
       BuildHyp current, next;
       current.state.pos  = 0;
       current.state.history = sequenceModel_->initial();
       current.p = LogProbability::certain();
-      context->initial_ = stateNodes_[current.state] = context->graph_.newNode();
+      context->initial_ = stateNodes[current.state] = context->graph_.newNode();
       context->forwardProbability_.set(context->initial_, LogProbability::invalid());
-      openNodes_.insert(current);
+      openNodes.insert(current);
 
-      while (!openNodes_.empty()) {
-        current = openNodes_.top(); openNodes_.pop();
+      while (!openNodes.empty()) {
+        current = openNodes.top(); openNodes.pop();
 
-        Graph::NodeId currentNode = stateNodes_[current.state];
+        Graph::NodeId currentNode = stateNodes[current.state];
         verify(currentNode);
         verify(context->forwardProbability_[currentNode] == LogProbability::invalid());
         context->forwardProbability_[currentNode] = current.p;
@@ -408,48 +707,58 @@ goalStateReached:
           verify(current.state.pos == left.size());
           continue;
         }
+        if (!beam.expand(current.state.pos, current.p))
+          continue;
+        ++stats.expanded;
 
         verify(current.state.pos <= left.size());
-        int lb = current.state.pos;
-        LeftMap::const_iterator mi, mi_end;
-        for (int le = lb + (int)minLeftLen_;
-                 le <= lb +(int) maxLeftLen_ && le <= (int)left.size(); ++le) {
-          Multigram lmg(&left[lb], &left[le]);
-          for (Core::tie(mi, mi_end) = leftMap_.equal_range(lmg); mi != mi_end; ++mi) {
-            SequenceModel::Token q = mi->second;
+        LeftMultigramTrie::Node node = LeftMultigramTrie::root();
+        for (u32 le = current.state.pos; node != LeftMultigramTrie::noNode(); ) {
+          for (const MultigramIndex *mi = leftTrie_.multigramsBegin(node);
+               mi != leftTrie_.multigramsEnd(node); ++mi) {
+            SequenceModel::Token q = *mi;
             next.state.pos = le;
             next.state.history = sequenceModel_->advanced(current.state.history, q);
             next.p = current.p * sequenceModel_->probability(q, current.state.history);
-            buildAndInsertOrRelax(context, current, currentNode, next, q);
+            if (beam.admit(next.state.pos, next.p))
+              buildAndInsertOrRelax(context.get(), stateNodes, openNodes, current, currentNode, next, q);
           }
+          node = (le < left.size()) ? leftTrie_.next(node, left[le++]) : LeftMultigramTrie::noNode();
         }
         if (current.state.pos == left.size()) { // end of string
           next.state.pos = left.size();
           next.state.history = sequenceModel_->culDeSac();
           next.p = current.p * sequenceModel_->probability(sequenceModel_->term(), current.state.history);
-          buildAndInsertOrRelax(context, current, currentNode, next, sequenceModel_->term());
+          buildAndInsertOrRelax(context.get(), stateNodes, openNodes, current, currentNode, next, sequenceModel_->term());
         }
 
-        if (maxStackSize < openNodes_.size())
-          maxStackSize = openNodes_.size();
-        if (openNodes_.size() > stackLimit_) {
-          openNodes_.clear(); stateNodes_.clear();
+        if (maxStackSize < openNodes.size())
+          maxStackSize = openNodes.size();
+        stats.graphNodes = stateNodes.size();
+        if (openNodes.size() > stackLimit_) {
           throw std::runtime_error("stack size limit exceeded");
         }
-      } // while (!openNodes_.empty())
+      } // while (!openNodes.empty())
+      stats.graphNodes = stateNodes.size();
 
       current.state.pos = left.size();
       current.state.history = sequenceModel_->culDeSac();
-      context->final_ = stateNodes_[current.state];
+      context->final_ = stateNodes[current.state];
 
-      verify(openNodes_.empty());
-      stateNodes_.clear();
-      if (stackUsage_ < maxStackSize)
-        stackUsage_ = maxStackSize;
+      verify(openNodes.empty());
+      updateStackUsage(maxStackSize);
 
       if (!context->final_) throw std::runtime_error("translation failed");
 
       context->initStack();
+      return context.release();
+    }
+
+  public:
+    NBestContext *nBestInit(const Sequence &left) {
+      SearchRecorder recorder(*this, left);
+      NBestContext *context = buildNBestContext(left, recorder.stats);
+      recorder.succeeded = true;
       return context;
     }
 
@@ -457,11 +766,19 @@ goalStateReached:
         NBestContext *context,
         std::vector<MultigramIndex> &result)
     {
-      std::shared_ptr<Trace> next = context->next();
+      SearchStatistics stats;
+      std::chrono::steady_clock::time_point start = std::chrono::steady_clock::now();
+      const Trace *next = context->next(stats);
+      stats.microseconds = std::chrono::duration_cast<std::chrono::microseconds>(
+          std::chrono::steady_clock::now() - start).count();
+      {
+        std::lock_guard<std::mutex> lock(statisticsMutex_);
+        statistics_.addToTotals(stats);
+      }
       result.clear();
       if (!next) throw std::runtime_error("no further translations");
       result.push_back(sequenceModel_->init());
-      for (std::shared_ptr<Trace> trace = next; trace; trace = trace->back)
+      for (const Trace *trace = next; trace; trace = trace->back)
         result.push_back(trace->q);
       return next->p;
     }
@@ -503,4 +820,262 @@ goalStateReached:
       return forward[context->final_];
     }
 
+    struct NBestVariant {
+      LogProbability p;
+      Sequence right; /**< concatenated right-hand sides */
+    };
+
+    /**
+     * N-best translation in one go: build the search graph for left
+     * and collect variants in order of decreasing probability until
+     * maxVariants have been found (unless zero) or their posteriors
+     * add up to mass.  Returns the total likelihood of left, which
+     * the posteriors are relative to.  Does not touch any Python
+     * object.  Searches lazily if so configured, see lazyNBest().
+     */
+    LogProbability nBest(
+        const Sequence &left, u32 maxVariants, double mass,
+        std::vector<NBestVariant> &variants)
+    {
+      SearchRecorder recorder(*this, left);
+      if (lazyNBest_) {
+        LogProbability total = lazyNBest(left, maxVariants, mass, variants, recorder.stats);
+        recorder.succeeded = true;
+        return total;
+      }
+      require(inventory_);
+      std::unique_ptr<NBestContext> context(buildNBestContext(left, recorder.stats));
+      LogProbability total = nBestTotalLogLik(context.get());
+      std::vector<MultigramIndex> mgs;
+      double totalPosterior = 0.0;
+      variants.clear();
+      while (totalPosterior < mass && (!maxVariants || variants.size() < maxVariants)) {
+        const Trace *trace = context->next(recorder.stats);
+        if (!trace) break;
+        mgs.clear();
+        mgs.push_back(sequenceModel_->init());
+        for (const Trace *t = trace; t; t = t->back)
+          mgs.push_back(t->q);
+        variants.push_back(NBestVariant());
+        variants.back().p = trace->p;
+        appendRight(mgs, variants.back().right);
+        totalPosterior += (trace->p / total).probability();
+      }
+      recorder.succeeded = true;
+      return total;
+    }
+
+    // ===========================================================================
+    // lazy N-best translation
+  private:
+    void updateProbabilityBounds() {
+      std::vector<LogProbability>().swap(probabilityBounds_);
+      if (lazyNBest_ && sequenceModel_)
+        otherProbabilityBound_ = sequenceModel_->probabilityBounds(probabilityBounds_);
+    }
+
+    LogProbability probabilityBound(MultigramIndex q) const {
+      return (q < probabilityBounds_.size()) ? probabilityBounds_[q] : otherProbabilityBound_;
+    }
+
+    static bool isUnreachable(LogProbability p) {
+      return p <= LogProbability::impossible();
+    }
+
+    /**
+     * Admissible A* heuristic: bounds[pos] is at least the probability
+     * of the most likely completion of a translation that has covered
+     * pos letters of left, whatever its history.  Empty left-hand
+     * sides cannot raise the bound and are skipped.
+     */
+    void completionBounds(const Sequence &left, std::vector<LogProbability> &bounds) const {
+      bounds.assign(left.size() + 1, LogProbability::impossible());
+      bounds[left.size()] = probabilityBound(sequenceModel_->term());
+      for (u32 pos = left.size(); pos-- > 0;) {
+        LeftMultigramTrie::Node node = LeftMultigramTrie::root();
+        for (u32 le = pos; le < left.size(); ) {
+          node = leftTrie_.next(node, left[le++]);
+          if (node == LeftMultigramTrie::noNode()) break;
+          for (const MultigramIndex *mi = leftTrie_.multigramsBegin(node);
+               mi != leftTrie_.multigramsEnd(node); ++mi)
+            bounds[pos] = std::max(bounds[pos], probabilityBound(*mi) * bounds[le]);
+        }
+      }
+    }
+
+    struct LazyHyp : public HypBase {
+      LogProbability Q; /**< p times the completion bound */
+      const Trace *trace;
+
+      struct PriorityFunction {
+        bool operator() (const LazyHyp &lhs, const LazyHyp &rhs) const {
+          return lhs.Q > rhs.Q;
+        }
+      };
+    };
+    typedef Core::PriorityQueue<LazyHyp, LazyHyp::PriorityFunction> LazyOpen;
+
+  public:
+    /**
+     * Total likelihood of left, summed over all its translations in a
+     * forward pass over the search states, without building a graph.
+     * Like nBestTotalLogLik() it does not follow cycles of empty
+     * left-hand sides back to states it has already passed on.
+     */
+    LogProbability totalLogLik(const Sequence &left) const {
+      require(sequenceModel_);
+      typedef unordered_map<SequenceModel::History, u32> Index;
+      typedef std::vector<std::pair<SequenceModel::History, LogProbability> > Column;
+      std::vector<Index> index(left.size() + 1);
+      std::vector<Column> forward(left.size() + 1);
+      forward[0].push_back(std::make_pair(sequenceModel_->initial(), LogProbability::certain()));
+      index[0][sequenceModel_->initial()] = 0;
+
+      ProbabilityAccumulator total;
+      for (u32 pos = 0; pos <= left.size(); ++pos) {
+        for (u32 i = 0; i < forward[pos].size(); ++i) {
+          SequenceModel::History history = forward[pos][i].first;
+          LogProbability p = forward[pos][i].second;
+          LeftMultigramTrie::Node node = LeftMultigramTrie::root();
+          for (u32 le = pos; node != LeftMultigramTrie::noNode(); ) {
+            for (const MultigramIndex *mi = leftTrie_.multigramsBegin(node);
+                 mi != leftTrie_.multigramsEnd(node); ++mi) {
+              SequenceModel::History next = sequenceModel_->advanced(history, *mi);
+              LogProbability np = p * sequenceModel_->probability(*mi, history);
+              std::pair<Index::iterator, bool> slot =
+                index[le].insert(std::make_pair(next, u32(forward[le].size())));
+              if (slot.second)
+                forward[le].push_back(std::make_pair(next, np));
+              else if (le > pos || slot.first->second > i)
+                forward[le][slot.first->second].second += np;
+            }
+            node = (le < left.size()) ? leftTrie_.next(node, left[le++]) : LeftMultigramTrie::noNode();
+          }
+          if (pos == left.size())
+            total.add(p * sequenceModel_->probability(sequenceModel_->term(), history));
+        }
+        Index().swap(index[pos]);
+        Column().swap(forward[pos]);
+      }
+      return total.sum();
+    }
+
+  private:
+    /**
+     * Lazy counterpart of nBest(): variants are popped from an A*
+     * search over partial translations in order of decreasing
+     * probability.  With a maximum number of variants k, no search
+     * state is expanded more than k times, since the k best partial
+     * translations reaching it already complete to k better
+     * variants.  With approximate posteriors the variants are
+     * normalized by their sum, and the mass is applied afterwards.
+     * A mass of one or more does not limit the number of variants,
+     * whatever the rounding of the posteriors.
+     */
+    LogProbability lazyNBest(
+        const Sequence &left, u32 maxVariants, double mass,
+        std::vector<NBestVariant> &variants, SearchStatistics &stats)
+    {
+      require(inventory_);
+      require(sequenceModel_);
+      require(lazyNBest_);
+      if (!exactPosteriors_ && !maxVariants)
+        throw std::runtime_error("approximate posteriors need a maximum number of variants");
+
+      LogProbability total = LogProbability::impossible();
+      if (exactPosteriors_) {
+        total = totalLogLik(left);
+        if (isUnreachable(total)) throw std::runtime_error("translation failed");
+      }
+      std::vector<LogProbability> bounds;
+      completionBounds(left, bounds);
+
+      LazyOpen open;
+      unordered_map<State, u32, State::Hash> expansions;
+      TraceArenaLease traces(*this);
+      u32 &maxStackSize(stats.openPeak);
+      std::vector<MultigramIndex> mgs;
+      double totalPosterior = 0.0;
+      variants.clear();
+
+      LazyHyp current, next;
+      next.state.pos = 0;
+      next.state.history = sequenceModel_->initial();
+      next.p = LogProbability::certain();
+      next.Q = bounds[0];
+      next.trace = 0;
+      if (!isUnreachable(next.Q)) open.insert(next);
+
+      while (!open.empty()) {
+        if (maxVariants && variants.size() >= maxVariants) break;
+        if (exactPosteriors_ && mass < 1.0 && totalPosterior >= mass) break;
+        current = open.top(); open.pop();
+
+        if (current.state.history == sequenceModel_->culDeSac()) {
+          mgs.clear();
+          for (const Trace *trace = current.trace; trace; trace = trace->back)
+            mgs.push_back(trace->q);
+          mgs.push_back(sequenceModel_->init());
+          std::reverse(mgs.begin(), mgs.end());
+          variants.push_back(NBestVariant());
+          variants.back().p = current.p;
+          appendRight(mgs, variants.back().right);
+          if (exactPosteriors_)
+            totalPosterior += (current.p / total).probability();
+          continue;
+        }
+        if (maxVariants && ++expansions[current.state] > maxVariants)
+          continue;
+        ++stats.expanded;
+
+        verify(current.state.pos <= left.size());
+        LeftMultigramTrie::Node node = LeftMultigramTrie::root();
+        for (u32 le = current.state.pos; node != LeftMultigramTrie::noNode(); ) {
+          if (!isUnreachable(bounds[le])) {
+            for (const MultigramIndex *mi = leftTrie_.multigramsBegin(node);
+                 mi != leftTrie_.multigramsEnd(node); ++mi) {
+              next.state.pos = le;
+              next.state.history = sequenceModel_->advanced(current.state.history, *mi);
+              next.p = current.p * sequenceModel_->probability(*mi, current.state.history);
+              next.Q = next.p * bounds[le];
+              next.trace = traces.add(current.trace, *mi, next.p);
+              open.insert(next);
+            }
+          }
+          node = (le < left.size()) ? leftTrie_.next(node, left[le++]) : LeftMultigramTrie::noNode();
+        }
+        if (current.state.pos == left.size()) { // end of string
+          next.state.pos = left.size();
+          next.state.history = sequenceModel_->culDeSac();
+          next.p = current.p * sequenceModel_->probability(sequenceModel_->term(), current.state.history);
+          next.Q = next.p;
+          next.trace = traces.add(current.trace, sequenceModel_->term(), next.p);
+          open.insert(next);
+        }
+
+        if (maxStackSize < open.size())
+          maxStackSize = open.size();
+        if (open.size() > stackLimit_) {
+          throw std::runtime_error("stack size limit exceeded");
+        }
+      }
+      updateStackUsage(maxStackSize);
+      if (variants.empty()) throw std::runtime_error("translation failed");
+
+      if (!exactPosteriors_) {
+        ProbabilityAccumulator sum;
+        for (size_t i = 0; i < variants.size(); ++i)
+          sum.add(variants[i].p);
+        total = sum.sum();
+        for (size_t i = 0; mass < 1.0 && i < variants.size(); ++i) {
+          totalPosterior += (variants[i].p / total).probability();
+          if (totalPosterior >= mass) {
+            variants.resize(i + 1);
+            break;
+          }
+        }
+      }
+      return total;
+    }
+
 }; // class Translator
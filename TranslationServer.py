@@ -0,0 +1,412 @@
+"""
+Translation server
+
+Keeps a translator resident and serves requests over a Unix domain
+socket.  The protocol is line-delimited JSON: each request is an
+object with the "word" to convert (or its "left" symbols), an optional
+"id" which is echoed in the reply, and optionally the maximum number
+of "variants" and their "mass" (total posterior) for n-best requests.
+Replies are written in the order of the requests of each connection,
+so clients may pipeline as many requests as they like.  A first-best
+reply carries "right" and "logLik", an n-best reply a list of
+"variants", each with "posterior" and "right", and a failed one an
+"error" message.
+
+Requests arriving concurrently, from one or many connections, are
+collected into batches, and the first-best requests of each batch are
+converted in a single translateBatch() call.  N-best requests are not
+batched; they are handed to a small pool of worker threads, so that
+they do not hold up the first-best replies.  A long n-best request
+still delays the replies to later requests on the same connection.
+
+Unix domain sockets are not available on all platforms (notably
+Windows), where serve() fails and TranslationServer is not defined.
+"""
+
+from __future__ import print_function
+
+__copyright__ = "Copyright (c) 2026  Sequitur G2P contributors"
+__license__ = """
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License Version 2 (June
+1991) as published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, you will find it at
+http://www.gnu.org/licenses/gpl.html, or write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110,
+USA.
+
+Should a provision of no. 9 and 10 of the GNU General Public License
+be invalid or become invalid, a valid provision is deemed to have been
+agreed upon which comes closest to what the parties intended
+commercially. In any case guarantee/warranty shall be limited to gross
+negligent actions or intended actions or fraudulent concealment.
+"""
+
+
+import concurrent.futures
+import errno, json, os, queue, signal, socket, socketserver, sys, threading
+
+
+class PendingReply:
+    """
+    The reply to one request, to be filled in by the batcher thread.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.reply = None
+        self.ready = threading.Event()
+
+    def answer(self, **reply):
+        if "id" in self.request:
+            reply["id"] = self.request["id"]
+        self.reply = reply
+        self.ready.set()
+
+    def wait(self):
+        self.ready.wait()
+        return self.reply
+
+
+class ConnectionHandler(socketserver.StreamRequestHandler):
+    """
+    Reads the requests of one connection and submits them to the
+    server.  The replies are written by a second thread, so that
+    reading continues while earlier requests are being translated.
+    """
+
+    def handle(self):
+        pending = queue.Queue()
+        writer = threading.Thread(target=self.writeReplies, args=(pending,))
+        writer.daemon = True
+        writer.start()
+        try:
+            for line in self.rfile:
+                if line.strip():
+                    pending.put(self.server.submit(line))
+        except socket.error:
+            pass
+        finally:
+            pending.put(None)
+            writer.join()
+
+    def writeReplies(self, pending):
+        connected = True
+        while True:
+            reply = pending.get()
+            if reply is None:
+                break
+            reply = reply.wait()
+            if not connected:
+                continue
+            try:
+                self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+            except socket.error:
+                connected = False
+
+
+class TranslationServerMixIn:
+    """
+    Serves translator on a stream socket.  parse turns a word into the
+    left-hand sequence to be translated; it is not applied to requests
+    which give "left" explicitly.  Requests with symbols the model does
+    not know are rejected, so that clients cannot add symbols to its
+    inventory.  At most maxBatchSize requests are translated in one
+    batch, and n-best requests are run by variantsWorkers threads.
+    """
+
+    daemon_threads = True
+    maxBatchSize = 500
+    variantsWorkers = 2
+
+    def setTranslator(self, translator, parse):
+        self.translator = translator
+        self.parse = parse
+        self.requests = queue.Queue()
+        self.variantsPool = concurrent.futures.ThreadPoolExecutor(self.variantsWorkers)
+        self.batcher = threading.Thread(target=self.processRequests)
+        self.batcher.daemon = True
+        self.batcher.start()
+
+    def knownSymbols(self):
+        model = getattr(self.translator, "model", None)
+        if model is None:
+            return None
+        return model.sequitur.leftInventory.dir
+
+    def submit(self, line):
+        pending = PendingReply({})
+        try:
+            request = json.loads(line.decode("utf-8"))
+            if not isinstance(request, dict):
+                raise ValueError("request is not an object")
+            pending.request = request
+            if "left" in request:
+                left = request["left"]
+                if not isinstance(left, list):
+                    raise ValueError('"left" is not a list')
+            else:
+                word = request["word"]
+                if not isinstance(word, str):
+                    raise ValueError('"word" is not a string')
+                left = self.parse(word)
+            if not all(isinstance(symbol, str) for symbol in left):
+                raise ValueError("symbols must be strings")
+            left = tuple(left)
+            variants = request.get("variants")
+            mass = request.get("mass")
+            if variants is not None:
+                variants = int(variants)
+            if mass is not None:
+                mass = float(mass)
+        except (ValueError, KeyError, TypeError):
+            pending.answer(error="bad request: %s" % sys.exc_info()[1])
+            return pending
+        known = self.knownSymbols()
+        if known is not None:
+            unknown = [symbol for symbol in left if symbol not in known]
+            if unknown:
+                pending.answer(error="unknown symbols: %s" % " ".join(unknown))
+                return pending
+        self.requests.put((left, variants, mass, pending))
+        return pending
+
+    def processRequests(self):
+        while True:
+            batch = [self.requests.get()]
+            while len(batch) < self.maxBatchSize:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                batch = [request for request in batch if request is not None]
+                self.translate(batch)
+                break
+            self.translate(batch)
+
+    def translate(self, batch):
+        for left, variants, mass, pending in batch:
+            if variants or mass:
+                self.variantsPool.submit(
+                    self.translateVariants, left, variants, mass, pending
+                )
+        try:
+            self.translateFirstBest([r for r in batch if not (r[1] or r[2])])
+        except Exception:
+            # answer whatever is left, rather than leaving the clients hanging
+            exc = sys.exc_info()[1]
+            for left, variants, mass, pending in batch:
+                if not (variants or mass or pending.ready.is_set()):
+                    pending.answer(error="internal error: %s" % exc)
+
+    def translateOne(self, left):
+        translator = self.translator
+        try:
+            if hasattr(translator, "translateBatch"):
+                return translator.translateBatch([left])[0]
+            return None, translator(left)
+        except translator.TranslationFailure:
+            return sys.exc_info()[1]
+        except Exception:
+            return translator.TranslationFailure(
+                "internal error: %s" % sys.exc_info()[1]
+            )
+
+    def translateFirstBest(self, batch):
+        if not batch:
+            return
+        translator = self.translator
+        lefts = [left for left, _, _, _ in batch]
+        results = None
+        if hasattr(translator, "translateBatch"):
+            try:
+                results = translator.translateBatch(lefts)
+            except Exception:
+                pass  # find out which request failed, see below
+        if results is None:
+            results = [self.translateOne(left) for left in lefts]
+        for (left, _, _, pending), result in zip(batch, results):
+            if isinstance(result, translator.TranslationFailure):
+                pending.answer(error=str(result))
+            else:
+                logLik, right = result
+                pending.answer(logLik=logLik, right=list(right))
+
+    def translateVariants(self, left, variants, mass, pending):
+        translator = self.translator
+        try:
+            results = translator.variants(left, mass or 1.0, variants or None)
+        except translator.TranslationFailure:
+            pending.answer(error=str(sys.exc_info()[1]))
+            return
+        except Exception:
+            pending.answer(error="internal error: %s" % sys.exc_info()[1])
+            return
+        pending.answer(
+            variants=[
+                {"posterior": posterior, "right": list(right)}
+                for posterior, right in results
+            ]
+        )
+
+    def stopTranslating(self):
+        self.requests.put(None)
+        self.batcher.join()
+        self.variantsPool.shutdown(wait=True)
+
+
+if hasattr(socket, "AF_UNIX"):
+
+    class TranslationServer(
+        TranslationServerMixIn,
+        socketserver.ThreadingMixIn,
+        socketserver.UnixStreamServer,
+    ):
+        """
+        TranslationServerMixIn on the Unix domain socket path.
+        """
+
+        def __init__(self, path, translator, parse=tuple):
+            socketserver.UnixStreamServer.__init__(self, path, ConnectionHandler)
+            self.setTranslator(translator, parse)
+
+        def server_close(self):
+            socketserver.UnixStreamServer.server_close(self)
+            self.stopTranslating()
+
+
+def removeStaleSocket(path):
+    """
+    Remove the socket file left behind by a server which is no longer
+    running.  Raises socket.error if a server is listening on path.
+    """
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error:
+        exc = sys.exc_info()[1]
+        if exc.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+            raise
+        os.unlink(path)
+    else:
+        raise socket.error(errno.EADDRINUSE, "server already running on %s" % path)
+    finally:
+        probe.close()
+
+
+def _terminate(signum, frame):
+    raise SystemExit(0)
+
+
+def serve(translator, path, parse=tuple, log=sys.stderr):
+    """
+    Serve translator on path until interrupted or terminated.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        raise socket.error(
+            errno.EAFNOSUPPORT, "Unix domain sockets are not supported here"
+        )
+    removeStaleSocket(path)
+    server = TranslationServer(path, translator, parse)
+    previous = signal.signal(signal.SIGTERM, _terminate)
+    print("serving on %s" % path, file=log)
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        server.server_close()
+        os.unlink(path)
+
+
+class TranslationClient:
+    """
+    Client for a TranslationServer.  translate() converts a single
+    word; translateMany() pipelines many requests, sending them in
+    chunks of chunkSize and yielding the replies in order.
+    """
+
+    class TranslationFailure(RuntimeError):
+        pass
+
+    chunkSize = 100
+
+    def __init__(self, path, timeout=None):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(path)
+        self.replies = self.socket.makefile("rb")
+
+    def close(self):
+        self.replies.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def request(self, word, variants=None, mass=None):
+        request = {"word": word}
+        if variants:
+            request["variants"] = variants
+        if mass:
+            request["mass"] = mass
+        return request
+
+    def readReply(self):
+        line = self.replies.readline()
+        if not line:
+            raise socket.error(errno.ECONNRESET, "connection closed by server")
+        return json.loads(line.decode("utf-8"))
+
+    def translateMany(self, requests):
+        """
+        requests are dicts as described in the module documentation,
+        or plain words for first-best translations.  Yields (request,
+        reply) pairs.
+        """
+        chunk = []
+        for request in requests:
+            if not isinstance(request, dict):
+                request = self.request(request)
+            chunk.append(request)
+            if len(chunk) >= self.chunkSize:
+                for pair in zip(chunk, self.exchange(chunk)):
+                    yield pair
+                chunk = []
+        if chunk:
+            for pair in zip(chunk, self.exchange(chunk)):
+                yield pair
+
+    def exchange(self, requests):
+        lines = [json.dumps(request) + "\n" for request in requests]
+        self.socket.sendall("".join(lines).encode("utf-8"))
+        return [self.readReply() for line in lines]
+
+    def translate(self, word, variants=None, mass=None):
+        """
+        The first-best right-hand sequence of word, or with variants
+        or mass a list of (posterior, right) pairs.
+        """
+        (reply,) = self.exchange([self.request(word, variants, mass)])
+        if "error" in reply:
+            raise self.TranslationFailure(reply["error"])
+        if "variants" in reply:
+            return [
+                (variant["posterior"], tuple(variant["right"]))
+                for variant in reply["variants"]
+            ]
+        return tuple(reply["right"])
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""
+Measure the accuracy versus speed trade-off of beam search.
+
+Translates a held-out lexicon once with exact search and once for each
+combination of beam margin and beam size, and prints one line per
+setting: translation time, throughput, error rates and the number of
+words whose first-best differs from the exact search.
+"""
+
+from __future__ import print_function
+
+__copyright__ = "Copyright (c) 2026  Sequitur G2P contributors"
+__license__ = """
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License Version 2 (June
+1991) as published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, you will find it at
+http://www.gnu.org/licenses/gpl.html, or write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110,
+USA.
+
+Should a provision of no. 9 and 10 of the GNU General Public License
+be invalid or become invalid, a valid provision is deemed to have been
+agreed upon which comes closest to what the parties intended
+commercially. In any case guarantee/warranty shall be limited to gross
+negligent actions or intended actions or fraudulent concealment.
+"""
+
+import pickle
+import sys
+import time
+
+import g2p
+import ModelFile
+from Evaluation import Evaluator
+from sequitur import Translator
+
+
+def loadModel(fname):
+    if ModelFile.isBinaryModelFile(fname):
+        return ModelFile.load(fname)
+    return pickle.load(open(fname, "rb"), encoding="latin1")
+
+
+def parseList(s, convert):
+    return [None if v in ("", "none", "inf") else convert(v) for v in s.split(",")]
+
+
+class Replay(object):
+    """Hands out previously computed translations to the Evaluator."""
+
+    TranslationFailure = Translator.TranslationFailure
+
+    def __init__(self, sources, candidates):
+        self.candidates = dict(zip(sources, candidates))
+
+    def __call__(self, left):
+        candidate = self.candidates[left]
+        if candidate is None:
+            raise self.TranslationFailure()
+        return candidate
+
+
+def translateAll(translator, evaluator):
+    start = time.time()
+    candidates = list(evaluator.translate(translator))
+    elapsed = time.time() - start
+    return candidates, elapsed
+
+
+def main(options, args):
+    model = loadModel(options.modelFile)
+    translator = Translator(model)
+    evaluator = Evaluator()
+    evaluator.setSample(g2p.loadG2PSample(options.testSample))
+
+    exact, exactTime = translateAll(translator, evaluator)
+    print("exact search: %.3f s" % exactTime)
+    print(
+        "%8s %6s %8s %9s %8s %8s %7s %7s"
+        % (
+            "beam",
+            "size",
+            "time/s",
+            "words/s",
+            "str-err",
+            "sym-err",
+            "failed",
+            "differ",
+        )
+    )
+    for beam in parseList(options.beams, float):
+        for beamSize in parseList(options.beamSizes, int):
+            translator.setBeam(beam)
+            translator.setBeamSize(beamSize)
+            candidates, elapsed = translateAll(translator, evaluator)
+            result = evaluator.evaluate(Replay(evaluator.sources, candidates))
+            nDiffer = sum(1 for e, c in zip(exact, candidates) if e != c)
+            print(
+                "%8s %6s %8.3f %9.1f %7.2f%% %7.2f%% %7d %7d"
+                % (
+                    "-" if beam is None else "%g" % beam,
+                    beamSize or "-",
+                    elapsed,
+                    len(candidates) / max(elapsed, 1e-9),
+                    100.0 * result.nStringsIncorrect / max(result.nStrings, 1),
+                    100.0 * result.nSymbolsIncorrect / max(result.nSymbols, 1),
+                    result.nStringsFailed,
+                    nDiffer,
+                )
+            )
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    import optparse
+    import tool
+
+    optparser = optparse.OptionParser(
+        usage="%prog [OPTION]...\n" + str(__doc__),
+    )
+    tool.addOptions(optparser)
+    optparser.add_option(
+        "-m", "--model", dest="modelFile", help="read model from FILE", metavar="FILE"
+    )
+    optparser.add_option(
+        "-d",
+        "--test",
+        dest="testSample",
+        help="use held-out lexicon FILE",
+        metavar="FILE",
+    )
+    optparser.add_option(
+        "-e",
+        "--encoding",
+        default="ISO-8859-15",
+        help="use character set encoding ENC",
+        metavar="ENC",
+    )
+    optparser.add_option(
+        "--beams",
+        default="none,20,10,5,3,2,1",
+        help="comma-separated list of beam margins to try ('none' for no "
+        "threshold pruning)",
+        metavar="LIST",
+    )
+    optparser.add_option(
+        "--beam-sizes",
+        dest="beamSizes",
+        default="none",
+        help="comma-separated list of beam sizes to try ('none' for no "
+        "histogram pruning)",
+        metavar="LIST",
+    )
+    options, args = optparser.parse_args()
+    if not (options.modelFile and options.testSample):
+        optparser.error("both --model and --test are required")
+
+    g2p.defaultEncoding = options.encoding
+    tool.run(main, options, args)
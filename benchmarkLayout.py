@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+"""
+Compare the search structures of the sequence model.
+
+For every layout (see SequenceModel.setLayout) the model is loaded
+again and timed on two workloads that consist almost entirely of
+sequence model lookups: re-scoring the estimation graphs of a lexicon,
+which performs one history transition and one probability lookup per
+edge, and first-best conversion of its words.  Memory use of the
+sequence model is reported as well.
+"""
+
+from __future__ import print_function
+
+__copyright__ = "Copyright (c) 2026  Sequitur G2P contributors"
+__license__ = """
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License Version 2 (June
+1991) as published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, you will find it at
+http://www.gnu.org/licenses/gpl.html, or write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110,
+USA.
+
+Should a provision of no. 9 and 10 of the GNU General Public License
+be invalid or become invalid, a valid provision is deemed to have been
+agreed upon which comes closest to what the parties intended
+commercially. In any case guarantee/warranty shall be limited to gross
+negligent actions or intended actions or fraudulent concealment.
+"""
+
+import sys
+import time
+
+import g2p
+import SequenceModel
+import SequiturTool
+from benchmarkBeam import loadModel
+from sequitur import EstimationGraphBuilder, Sample, Translator
+
+
+def knownSample(sequitur, sample):
+    def isKnown(symbols, inventory):
+        return all(s in inventory.dir for s in symbols)
+
+    return sequitur.compileSample(
+        [
+            (left, right)
+            for left, right in sample
+            if isKnown(left, sequitur.leftInventory)
+            and isKnown(right, sequitur.rightInventory)
+        ]
+    )
+
+
+def bestOf(nRepetitions, function):
+    times = []
+    for i in range(nRepetitions):
+        start = time.time()
+        result = function()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def benchmark(options, layout, sample):
+    SequenceModel.SequenceModel.defaultLayout = SequiturTool.modelLayouts[layout]
+    SequenceModel.SequenceModel.successorCacheBudget = int(
+        options.successorCacheSize * 1024 * 1024
+    )
+    model = loadModel(options.modelFile)
+    sequenceModel = model.sequenceModel
+    sequitur = model.sequitur
+
+    graphs = Sample(
+        sequitur,
+        sequitur.inventory.sizeTemplates(),
+        EstimationGraphBuilder.suppressNewMultigrams,
+        knownSample(sequitur, sample),
+        sequenceModel,
+    )
+    graphs.storeGraphs()
+    store = graphs.graphStore
+    rescoreTime, dummy = bestOf(
+        options.repetitions, lambda: store.update(sequenceModel)
+    )
+
+    translator = Translator(model)
+    words = sorted(set(left for left, right in sample))
+
+    def translateAll():
+        return translator.translateBatch(words)
+
+    translateTime, translations = bestOf(options.repetitions, translateAll)
+    translations = [
+        None if isinstance(t, Translator.TranslationFailure) else t
+        for t in translations
+    ]
+    return (
+        sequenceModel.memoryUsed(),
+        rescoreTime,
+        store.size(),
+        translateTime,
+        len(words),
+        translations,
+    )
+
+
+def main(options, args):
+    sample = g2p.loadG2PSample(options.testSample)
+    print(
+        "%-12s %10s %12s %12s %12s %12s"
+        % ("layout", "memory/kB", "rescore/s", "graphs/s", "convert/s", "words/s")
+    )
+    reference = None
+    for layout in options.layouts.split(","):
+        memory, rescoreTime, nGraphs, translateTime, nWords, translations = benchmark(
+            options, layout, sample
+        )
+        print(
+            "%-12s %10.1f %12.4f %12.1f %12.4f %12.1f"
+            % (
+                layout,
+                memory / 1024.0,
+                rescoreTime,
+                nGraphs / max(rescoreTime, 1e-9),
+                translateTime,
+                nWords / max(translateTime, 1e-9),
+            )
+        )
+        sys.stdout.flush()
+        if reference is None:
+            reference = translations
+        elif translations != reference:
+            print("error: %s layout changes the translations" % layout)
+            return 1
+
+
+if __name__ == "__main__":
+    import optparse
+    import tool
+
+    optparser = optparse.OptionParser(
+        usage="%prog [OPTION]...\n" + str(__doc__),
+    )
+    tool.addOptions(optparser)
+    optparser.add_option(
+        "-m", "--model", dest="modelFile", help="read model from FILE", metavar="FILE"
+    )
+    optparser.add_option(
+        "-d",
+        "--test",
+        dest="testSample",
+        help="use lexicon FILE",
+        metavar="FILE",
+    )
+    optparser.add_option(
+        "-e",
+        "--encoding",
+        default="ISO-8859-15",
+        help="use character set encoding ENC",
+        metavar="ENC",
+    )
+    optparser.add_option(
+        "--layouts",
+        default=",".join(sorted(SequiturTool.modelLayouts)),
+        help="comma-separated list of layouts to compare (default: %default)",
+        metavar="LIST",
+    )
+    optparser.add_option(
+        "--successor-cache-mb",
+        dest="successorCacheSize",
+        type="float",
+        default=0,
+        help="give the models a successor cache of MB megabytes",
+        metavar="MB",
+    )
+    optparser.add_option(
+        "-n",
+        "--repetitions",
+        type="int",
+        default=5,
+        help="report the best of N runs (default: %default)",
+        metavar="N",
+    )
+    options, args = optparser.parse_args()
+    if not (options.modelFile and options.testSample):
+        optparser.error("both --model and --test are required")
+
+    g2p.defaultEncoding = options.encoding
+    tool.run(main, options, args)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""
+Measure the memory versus accuracy trade-off of quantized models.
+
+Loads the model once for each number of bits per probability code
+(0 meaning exact storage), evaluates it on a held-out lexicon and
+prints one line per setting: memory used by the sequence model, the
+saving relative to exact storage, error rates, their difference to
+exact storage, and the number of words whose first-best differs.
+"""
+
+from __future__ import print_function
+
+__copyright__ = "Copyright (c) 2026  Sequitur G2P contributors"
+__license__ = """
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License Version 2 (June
+1991) as published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, you will find it at
+http://www.gnu.org/licenses/gpl.html, or write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110,
+USA.
+
+Should a provision of no. 9 and 10 of the GNU General Public License
+be invalid or become invalid, a valid provision is deemed to have been
+agreed upon which comes closest to what the parties intended
+commercially. In any case guarantee/warranty shall be limited to gross
+negligent actions or intended actions or fraudulent concealment.
+"""
+
+import sys
+
+import g2p
+from benchmarkBeam import Replay, loadModel, translateAll
+from Evaluation import Evaluator
+from sequitur import Translator
+
+
+def main(options, args):
+    evaluator = Evaluator()
+    evaluator.setSample(g2p.loadG2PSample(options.testSample))
+
+    print(
+        "%5s %10s %7s %8s %8s %8s %8s %7s"
+        % (
+            "bits",
+            "memory/kB",
+            "saving",
+            "str-err",
+            "delta",
+            "sym-err",
+            "delta",
+            "differ",
+        )
+    )
+    exact = None
+    for bits in [0] + [int(b) for b in options.bits.split(",")]:
+        model = loadModel(options.modelFile)
+        model.sequenceModel.setQuantization(bits)
+        memory = model.sequenceModel.memoryUsed()
+        candidates, elapsed = translateAll(Translator(model), evaluator)
+        result = evaluator.evaluate(Replay(evaluator.sources, candidates))
+        stringError = 100.0 * result.nStringsIncorrect / max(result.nStrings, 1)
+        symbolError = 100.0 * result.nSymbolsIncorrect / max(result.nSymbols, 1)
+        if exact is None:
+            exact = memory, stringError, symbolError, candidates
+        print(
+            "%5d %10.1f %6.1f%% %7.2f%% %+7.2f%% %7.2f%% %+7.2f%% %7d"
+            % (
+                bits,
+                memory / 1024.0,
+                100.0 * (1.0 - float(memory) / exact[0]),
+                stringError,
+                stringError - exact[1],
+                symbolError,
+                symbolError - exact[2],
+                sum(1 for e, c in zip(exact[3], candidates) if e != c),
+            )
+        )
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    import optparse
+    import tool
+
+    optparser = optparse.OptionParser(
+        usage="%prog [OPTION]...\n" + str(__doc__),
+    )
+    tool.addOptions(optparser)
+    optparser.add_option(
+        "-m", "--model", dest="modelFile", help="read model from FILE", metavar="FILE"
+    )
+    optparser.add_option(
+        "-d",
+        "--test",
+        dest="testSample",
+        help="use held-out lexicon FILE",
+        metavar="FILE",
+    )
+    optparser.add_option(
+        "-e",
+        "--encoding",
+        default="ISO-8859-15",
+        help="use character set encoding ENC",
+        metavar="ENC",
+    )
+    optparser.add_option(
+        "--bits",
+        default="16,8",
+        help="comma-separated list of code sizes to compare with exact storage "
+        "(default: %default)",
+        metavar="LIST",
+    )
+    options, args = optparser.parse_args()
+    if not (options.modelFile and options.testSample):
+        optparser.error("both --model and --test are required")
+
+    g2p.defaultEncoding = options.encoding
+    tool.run(main, options, args)
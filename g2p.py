@@ -35,12 +35,16 @@ commercially. In any case guarantee/warranty shall be limited to gross
 negligent actions or intended actions or fraudulent concealment.
 """
 
-import math
 import sys
 import SequiturTool
 from sequitur import Translator
+from PronunciationCache import PersistentCachedTranslator
+from ModelHandle import ModelHandle
+import ModelFile
 from misc import gOpenIn, gOpenOut, set
 import codecs
+import signal
+import socket
 
 
 # ===========================================================================
@@ -186,6 +190,178 @@ def mainTest(translator, testSample, options, output_file):
     print(result)
 
 
+def applyWord(translator, word, left, variants=None):
+    """
+    Convert a single word and return the lines to be printed for it,
+    together with the error message in case the conversion failed.
+    """
+    lines = []
+    try:
+        if variants:
+            threshold, nVariantsLimit = variants
+            results = translator.variants(left, threshold, nVariantsLimit)
+            for nVariants, (posterior, result) in enumerate(results):
+                lines.append(
+                    "%s\t%d\t%f\t%s" % (word, nVariants, posterior, " ".join(result))
+                )
+        else:
+            result = translator(left)
+            lines.append("%s\t%s" % (word, " ".join(result)))
+    except translator.TranslationFailure:
+        exc = sys.exc_info()[1]
+        return lines, 'failed to convert "%s": %s' % (word, exc)
+    return lines, None
+
+
+def applyWords(translator, words, variants=None):
+    """
+    Convert a chunk of (word, left) pairs, returning a (lines, error)
+    pair for each of them.  First-best translations are done in a
+    single batch call, if the translator supports it.
+    """
+    if variants or not hasattr(translator, "translateBatch"):
+        return [applyWord(translator, word, left, variants) for word, left in words]
+    results = translator.translateBatch([left for word, left in words])
+    applied = []
+    for (word, left), result in zip(words, results):
+        if isinstance(result, translator.TranslationFailure):
+            applied.append(([], 'failed to convert "%s": %s' % (word, result)))
+        else:
+            logLik, right = result
+            applied.append((["%s\t%s" % (word, " ".join(right))], None))
+    return applied
+
+
+def printApplied(lines, error, output_file):
+    for line in lines:
+        print(line, file=output_file)
+    if error is not None:
+        try:
+            print(error, file=stderr)
+        except:
+            pass
+
+
+# ===========================================================================
+# parallel application
+#
+# The model is handed to the worker processes through the pool
+# initializer.  With the "fork" start method this does not involve any
+# pickling: the workers share the parent's model pages copy-on-write.
+
+applyChunkSize = 500
+
+_workerTranslator = None
+
+
+def configureSearch(
+    translator,
+    stackLimit=None,
+    beam=None,
+    beamSize=None,
+    lazyNBest=False,
+    exactPosteriors=True,
+):
+    if stackLimit:
+        translator.setStackLimit(stackLimit)
+    if beam is not None:
+        translator.setBeam(beam)
+    if beamSize:
+        translator.setBeamSize(beamSize)
+    if lazyNBest or not exactPosteriors:
+        translator.setLazyNBest(True, exactPosteriors)
+
+
+def searchOptions(options):
+    return dict(
+        stackLimit=options.stack_limit,
+        beam=options.beam,
+        beamSize=options.beam_size,
+        lazyNBest=options.lazy_nbest,
+        exactPosteriors=not options.approximate_posteriors,
+    )
+
+
+def makeTranslator(model, options):
+    translator = Translator(model)
+    configureSearch(translator, **searchOptions(options))
+    if options.cacheFile:
+        translator = PersistentCachedTranslator(
+            translator,
+            options.cacheFile,
+            ModelFile.fingerprint(model),
+            searchOptions(options),
+        )
+    return translator
+
+
+def _initApplyWorker(model, search, cache):
+    global _workerTranslator
+    _workerTranslator = Translator(model)
+    configureSearch(_workerTranslator, **search)
+    if cache:
+        _workerTranslator = PersistentCachedTranslator(_workerTranslator, *cache)
+
+
+def _applyChunk(chunk, variants):
+    result = applyWords(_workerTranslator, chunk, variants)
+    if hasattr(_workerTranslator, "flush"):
+        _workerTranslator.flush()
+    return result, _workerTranslator.statistics(reset=True)
+
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def mainApplyParallel(translator, words, variants, options, output_file):
+    import collections
+    import multiprocessing
+
+    if isinstance(translator, PersistentCachedTranslator):
+        cache = (translator.fname, translator.fingerprint, translator.search)
+    else:
+        cache = None
+    if "fork" in multiprocessing.get_all_start_methods():
+        mp = multiprocessing.get_context("fork")
+    else:
+        mp = multiprocessing.get_context()
+    pool = mp.Pool(
+        options.jobs,
+        initializer=_initApplyWorker,
+        initargs=(translator.model, searchOptions(options), cache),
+    )
+    statistics = translator.statistics()
+
+    def collect(result):
+        applied, chunkStatistics = result.get()
+        for lines, error in applied:
+            printApplied(lines, error, output_file)
+        return Translator.mergeStatistics(statistics, chunkStatistics)
+
+    try:
+        # keep a bounded number of chunks in flight, so that memory does
+        # not grow with the input size
+        pending = collections.deque()
+        for chunk in chunked(words, applyChunkSize):
+            pending.append(pool.apply_async(_applyChunk, (chunk, variants)))
+            if len(pending) >= 2 * options.jobs:
+                statistics = collect(pending.popleft())
+        while pending:
+            statistics = collect(pending.popleft())
+    finally:
+        pool.terminate()
+        pool.join()
+    return statistics
+
+
 def mainApply(translator, options, output_file):
     if options.phoneme_to_phoneme:
         words = readApplyP2P(options.applySample, options.encoding)
@@ -195,42 +371,18 @@ def mainApply(translator, options, output_file):
         words = readApply(options.applySample, options.encoding)
 
     if options.variants_mass or options.variants_number:
-        wantVariants = True
         threshold = options.variants_mass or 1.0
-        nVariantsLimit = options.variants_number or 1e9
+        nVariantsLimit = options.variants_number or None
+        variants = (threshold, nVariantsLimit)
     else:
-        wantVariants = False
+        variants = None
 
-    for word, left in words:
-        try:
-            if wantVariants:
-                totalPosterior = 0.0
-                nVariants = 0
-                nBest = translator.nBestInit(left)
-                while totalPosterior < threshold and nVariants < nVariantsLimit:
-                    try:
-                        logLik, result = translator.nBestNext(nBest)
-                    except StopIteration:
-                        break
-                    posterior = math.exp(logLik - nBest.logLikTotal)
-                    print(
-                        (
-                            "%s\t%d\t%f\t%s"
-                            % (word, nVariants, posterior, " ".join(result))
-                        ),
-                        file=output_file,
-                    )
-                    totalPosterior += posterior
-                    nVariants += 1
-            else:
-                result = translator(left)
-                print(("%s\t%s" % (word, " ".join(result))), file=output_file)
-        except translator.TranslationFailure:
-            exc = sys.exc_info()[1]
-            try:
-                print('failed to convert "%s": %s' % (word, exc), file=stderr)
-            except:
-                pass
+    if options.jobs and options.jobs > 1 and hasattr(translator, "model"):
+        return mainApplyParallel(translator, words, variants, options, output_file)
+
+    for chunk in chunked(words, applyChunkSize):
+        for lines, error in applyWords(translator, chunk, variants):
+            printApplied(lines, error, output_file)
 
 
 def mainApplyWord(translator, options, output_file):
@@ -251,6 +403,26 @@ def mainApplyWord(translator, options, output_file):
             pass
 
 
+def mainServe(translator, options, log):
+    from TranslationServer import serve
+
+    if options.phoneme_to_phoneme or options.shouldTranspose:
+
+        def parse(word):
+            return tuple(word.split())
+
+    else:
+        parse = tuple
+    if hasattr(translator, "reload") and hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: translator.reload())
+    try:
+        serve(translator, options.serve, parse, log)
+    except socket.error:
+        exc = sys.exc_info()[1]
+        print("cannot serve on %s: %s" % (options.serve, exc), file=log)
+        return 1
+
+
 def main(options, args):
     import locale
 
@@ -282,31 +454,59 @@ def main(options, args):
     #    else sys.stderr
     # )
 
+    translator = None
     if options.fakeTranslator:
         translator = MemoryTranslator(loadSample(options.fakeTranslator))
     else:
         model = SequiturTool.procureModel(options, loadSample, log=log_stdout)
         if not model:
             return 1
-        if options.testSample or options.applySample or options.applyWord:
-            translator = Translator(model)
-            if options.stack_limit:
-                translator.setStackLimit(options.stack_limit)
+        if (
+            options.testSample
+            or options.applySample
+            or options.applyWord
+            or options.serve
+        ):
+            if options.serve:
+                translator = ModelHandle(
+                    lambda: SequiturTool.procureModel(options, loadSample, log_stderr),
+                    lambda model: makeTranslator(model, options),
+                    model=model,
+                    log=log_stderr,
+                )
+            else:
+                translator = makeTranslator(model, options)
         del model
 
+    statistics = None
     if options.testSample:
         mainTest(translator, loadSample(options.testSample), options, log_stdout)
         translator.reportStats(log_stdout)
 
     if options.applySample:
-        mainApply(
+        statistics = mainApply(
             translator, options, gOpenOut("-", options.encoding or defaultEncoding)
         )
         translator.reportStats(log_stderr)
+        if statistics is not None:  # the searches were done by worker processes
+            Translator.reportSearchStatistics(statistics, log_stderr)
 
     if options.applyWord:
         mainApplyWord(translator, options, log_stdout)
 
+    if options.serve:
+        if mainServe(translator, options, log_stderr):
+            return 1
+        translator.reportStats(log_stderr)
+
+    if options.statsJson and hasattr(translator, "statistics"):
+        SequiturTool.writeStatistics(
+            statistics or translator.statistics(), options.statsJson
+        )
+
+    if hasattr(translator, "close"):
+        translator.close()
+
 
 # ===========================================================================
 if __name__ == "__main__":
@@ -381,14 +581,70 @@ if __name__ == "__main__":
         " model (use in combination with -x to evaluate two files against each other)",
         metavar="FILE",
     )
+    optparser.add_option(
+        "--cache",
+        dest="cacheFile",
+        help="keep pronunciations in the persistent cache FILE, which is "
+        "reset automatically whenever the model changes",
+        metavar="FILE",
+    )
     optparser.add_option(
         "--stack-limit",
         type="int",
         help="limit size of search stack to N elements",
         metavar="N",
     )
+    optparser.add_option(
+        "--beam",
+        type="float",
+        help="prune hypotheses scoring more than MARGIN (natural log) below "
+        "the best one covering the same letters; faster, but no longer exact",
+        metavar="MARGIN",
+    )
+    optparser.add_option(
+        "--beam-size",
+        type="int",
+        help="expand at most N hypotheses per number of covered letters",
+        metavar="N",
+    )
+    optparser.add_option(
+        "--stats-json",
+        dest="statsJson",
+        help="write search statistics (hypotheses expanded, open list peaks, "
+        "time per word, and the slowest words) as JSON to FILE",
+        metavar="FILE",
+    )
+    optparser.add_option(
+        "--lazy-nbest",
+        action="store_true",
+        help="search pronunciation variants lazily, which is faster if only "
+        "few of them are needed; the beam settings do not apply",
+    )
+    optparser.add_option(
+        "--approximate-posteriors",
+        action="store_true",
+        help="with --lazy-nbest, normalize the posteriors of the variants "
+        "by their sum instead of the total likelihood of the word "
+        "(requires --variants-number)",
+    )
+    optparser.add_option(
+        "--serve",
+        help="keep the model loaded and convert words requested as "
+        "line-delimited JSON on the Unix domain socket SOCKET, "
+        "e.g. by g2p_client.py; on SIGHUP the model is loaded again",
+        metavar="SOCKET",
+    )
+    optparser.add_option(
+        "-j",
+        "--jobs",
+        type="int",
+        help="use N worker processes for --apply and for training",
+        metavar="N",
+    )
 
     options, args = optparser.parse_args()
+    if options.approximate_posteriors and not options.variants_number:
+        optparser.error("--approximate-posteriors requires --variants-number")
 
     global stdout, stderr, defaultEncoding
     if sys.version_info[:2] <= (2, 5):
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+"""
+Client for g2p.py --serve
+
+Converts words using a model kept loaded by a running g2p.py --serve
+SOCKET, which saves loading the model for every invocation.  The
+output has the same format as that of g2p.py --apply.
+"""
+
+from __future__ import print_function
+
+__copyright__ = "Copyright (c) 2026  Sequitur G2P contributors"
+__license__ = """
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License Version 2 (June
+1991) as published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, you will find it at
+http://www.gnu.org/licenses/gpl.html, or write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110,
+USA.
+
+Should a provision of no. 9 and 10 of the GNU General Public License
+be invalid or become invalid, a valid provision is deemed to have been
+agreed upon which comes closest to what the parties intended
+commercially. In any case guarantee/warranty shall be limited to gross
+negligent actions or intended actions or fraudulent concealment.
+"""
+
+import socket
+import sys
+from misc import gOpenIn, gOpenOut
+from TranslationServer import TranslationClient
+
+
+def readWords(options):
+    if options.applyWord:
+        yield options.applyWord
+    if options.applySample:
+        for line in gOpenIn(options.applySample, options.encoding):
+            yield line.strip()
+
+
+def main(options, args):
+    output = gOpenOut("-", options.encoding)
+    try:
+        client = TranslationClient(options.socket)
+    except socket.error:
+        exc = sys.exc_info()[1]
+        print("cannot connect to %s: %s" % (options.socket, exc), file=sys.stderr)
+        return 1
+
+    requests = (
+        client.request(word, options.variants_number, options.variants_mass)
+        for word in readWords(options)
+    )
+    with client:
+        for request, reply in client.translateMany(requests):
+            word = request["word"]
+            if "error" in reply:
+                print(
+                    'failed to convert "%s": %s' % (word, reply["error"]),
+                    file=sys.stderr,
+                )
+            elif "variants" in reply:
+                for nVariants, variant in enumerate(reply["variants"]):
+                    print(
+                        "%s\t%d\t%f\t%s"
+                        % (
+                            word,
+                            nVariants,
+                            variant["posterior"],
+                            " ".join(variant["right"]),
+                        ),
+                        file=output,
+                    )
+            else:
+                print("%s\t%s" % (word, " ".join(reply["right"])), file=output)
+
+
+# ===========================================================================
+if __name__ == "__main__":
+    import optparse
+
+    optparser = optparse.OptionParser(
+        usage="%prog [OPTION]...\n" + str(__doc__),
+    )
+    optparser.add_option(
+        "-s",
+        "--socket",
+        help="connect to the g2p.py --serve server on SOCKET",
+        metavar="SOCKET",
+    )
+    optparser.add_option(
+        "-e",
+        "--encoding",
+        default="ISO-8859-15",
+        help="use character set encoding ENC",
+        metavar="ENC",
+    )
+    optparser.add_option(
+        "-a",
+        "--apply",
+        dest="applySample",
+        help="apply grapheme-to-phoneme conversion to words read from FILE",
+        metavar="FILE",
+    )
+    optparser.add_option(
+        "-w",
+        "--word",
+        dest="applyWord",
+        help="apply grapheme-to-phoneme conversion to word",
+        metavar="string",
+    )
+    optparser.add_option(
+        "-V",
+        "--variants-mass",
+        type="float",
+        help="generate pronunciation variants until \\sum_i p(var_i) >= Q",
+        metavar="Q",
+    )
+    optparser.add_option(
+        "--variants-number",
+        type="int",
+        help="generate up to N pronunciation variants",
+        metavar="N",
+    )
+
+    options, args = optparser.parse_args()
+    if not options.socket:
+        optparser.error("--socket is required")
+    sys.exit(main(options, args))
@@ -37,9 +37,10 @@ negligent actions or intended actions or fraudulent concealment.
 import math
 import sys
 import SequiturTool
-from sequitur import Translator
+from sequitur import Translator, CachedTranslator
 from misc import gOpenIn, gOpenOut, set
 import codecs
+import itertools
 import re
 
 
@@ -232,32 +233,71 @@ def mainTest(translator, testSample, options, output_file):
     print(result)
 
 
+def groupSentences(words):
+    """
+    Group the items yielded by readApplySentences into (sentence ID,
+    items) pairs.  Items without a sentence ID (from readApplyP2P or
+    readApplyP2G) form a group of their own each.
+    """
+    # The sentence ID is unique per line, so the words of a sentence are
+    # consecutive
+    for sentence, items in itertools.groupby(words, lambda item: item[2:]):
+        if sentence:
+            yield sentence[0], list(items)
+        else:
+            for item in items:
+                yield None, [item]
+
+
+def translateWords(translator, lefts, variants=None):
+    """
+    Convert each of the distinct left-hand sequences in lefts once.
+    Returns a dict mapping each of them to its transcription, or to its
+    list of variants if variants is given as (threshold, nVariantsLimit),
+    or to the TranslationFailure.  First-best transcriptions are done
+    in a single translateBatch() call if the translator supports it.
+    """
+    if not variants and hasattr(translator, "translateBatch"):
+        results = translator.translateBatch(lefts)
+        converted = {}
+        for left, result in zip(lefts, results):
+            if isinstance(result, translator.TranslationFailure):
+                converted[left] = result
+            else:
+                converted[left] = result[1]
+        return converted
+
+    converted = {}
+    for left in lefts:
+        try:
+            if variants:
+                converted[left] = translator.variants(left, *variants)
+            else:
+                converted[left] = translator(left)
+        except translator.TranslationFailure:
+            converted[left] = sys.exc_info()[1]
+    return converted
+
+
 def mainApply(translator, options, output_file):
-    # Initialize counters for error tracking and verification
+    """
+    Convert the input in a single streaming pass.  Sentences are read
+    in windows of options.sentence_window sentences; the distinct words
+    of a window are converted once each, and its sentences are written
+    as soon as that is done.  Nothing but the current window is kept in
+    memory, so the input may be of any size (and may be "-" for
+    standard input).  Since nothing of a window is written before all
+    of it has been read, the window defaults to a single sentence when
+    reading standard input, which may be interactive.
+    """
+    # Initialize counters for error tracking and verification; the input
+    # lines are counted while they are converted, so that it is read once
     input_line_count = 0
     output_line_count = 0
     error_count = 0
     processing_stats = {'total_words': 0, 'successful_words': 0, 'failed_words': 0}
-    
-    # Dictionary to store transcriptions by sentence
-    sentence_transcriptions = {}
-    # Keep track of current sentence for words in the same sentence
-    current_sentence = None
-    # Track processed sentences to avoid duplicates in output
-    processed_sentences = set()
-    
+
     try:
-        # Count the number of lines in the input file
-        try:
-            with gOpenIn(options.applySample, options.encoding) as f:
-                for line in f:
-                    if line.strip():  # Skip empty lines in count
-                        input_line_count += 1
-            print(f"INFO: Input file contains {input_line_count} non-empty lines", file=stderr)
-        except Exception as e:
-            print(f"ERROR: Failed to count input lines: {str(e)}", file=stderr)
-            input_line_count = 0  # Set to 0 to indicate failure
-        
         if options.phoneme_to_phoneme:
             words = readApplyP2P(options.applySample, options.encoding)
         elif options.shouldTranspose:
@@ -268,92 +308,85 @@ def mainApply(translator, options, output_file):
         if options.variants_mass or options.variants_number:
             wantVariants = True
             threshold = options.variants_mass or 1.0
-            nVariantsLimit = options.variants_number or 1e9
+            nVariantsLimit = options.variants_number or None
         else:
             wantVariants = False
-            
-        # Process each item from the input
-        for item in words:
-            if len(item) == 3:  # Process as sentence
-                word, left, sentence = item
-                if sentence != current_sentence:
-                    # If we're starting a new sentence, output the previous one
-                    if current_sentence and current_sentence in sentence_transcriptions and current_sentence not in processed_sentences:
-                        separator = options.sentence_separator
-                        # Extract the original sentence text (remove line number prefix)
-                        original_sentence = current_sentence.split(':', 1)[1]
-                        phoneme_sequence = separator.join([phoneme for _, phoneme in sentence_transcriptions[current_sentence]])
-                        print(("%s\t%s" % (original_sentence, phoneme_sequence)), file=output_file)
-                        output_line_count += 1
-                        # Mark this sentence as processed
-                        processed_sentences.add(current_sentence)
-                    # Start tracking new sentence
-                    current_sentence = sentence
-                    if sentence not in sentence_transcriptions:
-                        sentence_transcriptions[sentence] = []
-            else:  # Process as single word
-                word, left = item
-                sentence = None
 
-            try:
-                if wantVariants:
-                    totalPosterior = 0.0
-                    nVariants = 0
-                    nBest = translator.nBestInit(left)
-                    while totalPosterior < threshold and nVariants < nVariantsLimit:
+        window_size = options.sentence_window
+        if window_size is None:
+            window_size = 1 if options.applySample == "-" else 1000
+
+        sentences = groupSentences(words)
+        while True:
+            window = list(itertools.islice(sentences, max(window_size, 1)))
+            if not window:
+                break
+
+            # Convert each distinct word of the window only once
+            lefts = list(dict.fromkeys(item[1] for _, items in window for item in items))
+            converted = translateWords(
+                translator,
+                lefts,
+                (threshold, nVariantsLimit) if wantVariants else None,
+            )
+
+            for sentence, items in window:
+                if sentence:
+                    input_line_count += 1
+                    # Transcriptions of the current sentence only
+                    sentence_transcriptions = []
+
+                for item in items:
+                    word, left = item[:2]
+                    if not sentence:
+                        input_line_count += 1
+                    if not wantVariants:
+                        processing_stats['total_words'] += 1
+                    result = converted[left]
+                    if isinstance(result, translator.TranslationFailure):
+                        error_count += 1
+                        processing_stats['failed_words'] += 1
                         try:
-                            logLik, result = translator.nBestNext(nBest)
-                        except StopIteration:
-                            break
-                        posterior = math.exp(logLik - nBest.logLikTotal)
-                        result_str = " ".join(result)
-                        
-                        if sentence and nVariants == 0:
-                            # Store for sentence output (first variant only)
-                            sentence_transcriptions[sentence].append((word, result_str))
-                        elif not sentence:
-                            # Normal variant output for single word
-                            print(
-                                (
-                                    "%s\t%d\t%f\t%s"
-                                    % (word, nVariants, posterior, result_str)
-                                ),
-                                file=output_file,
-                            )
-                        
-                        totalPosterior += posterior
-                        nVariants += 1
-                else:
-                    processing_stats['total_words'] += 1
-                    result = translator(left)
-                    result_str = " ".join(result)
-                    processing_stats['successful_words'] += 1
-                    
-                    if sentence:
-                        # Store for sentence output
-                        sentence_transcriptions[sentence].append((word, result_str))
+                            print('ERROR: Failed to convert "%s": %s' % (word, result), file=stderr)
+                        except:
+                            pass
+                    elif wantVariants:
+                        for nVariants, (posterior, right) in enumerate(result):
+                            result_str = " ".join(right)
+
+                            if sentence and nVariants == 0:
+                                # Store for sentence output (first variant only)
+                                sentence_transcriptions.append((word, result_str))
+                            elif not sentence:
+                                # Normal variant output for single word
+                                print(
+                                    (
+                                        "%s\t%d\t%f\t%s"
+                                        % (word, nVariants, posterior, result_str)
+                                    ),
+                                    file=output_file,
+                                )
                     else:
-                        # Output single word immediately
-                        print(("%s\t%s" % (word, result_str)), file=output_file)
-                        output_line_count += 1
-            except translator.TranslationFailure:
-                exc = sys.exc_info()[1]
-                error_count += 1
-                processing_stats['failed_words'] += 1
-                try:
-                    print('ERROR: Failed to convert "%s": %s' % (word, exc), file=stderr)
-                except:
-                    pass
-
-        # Output the final sentence if there is one and it hasn't been processed yet
-        if current_sentence and current_sentence in sentence_transcriptions and current_sentence not in processed_sentences:
-            separator = options.sentence_separator
-            # Extract the original sentence text (remove line number prefix)
-            original_sentence = current_sentence.split(':', 1)[1]
-            phoneme_sequence = separator.join([phoneme for _, phoneme in sentence_transcriptions[current_sentence]])
-            print(("%s\t%s" % (original_sentence, phoneme_sequence)), file=output_file)
-            output_line_count += 1
-            
+                        result_str = " ".join(result)
+                        processing_stats['successful_words'] += 1
+
+                        if sentence:
+                            # Store for sentence output
+                            sentence_transcriptions.append((word, result_str))
+                        else:
+                            # Output single word immediately
+                            print(("%s\t%s" % (word, result_str)), file=output_file)
+                            output_line_count += 1
+
+                if sentence:
+                    # Output the sentence now that all its words are converted
+                    separator = options.sentence_separator
+                    # Extract the original sentence text (remove line number prefix)
+                    original_sentence = sentence.split(':', 1)[1]
+                    phoneme_sequence = separator.join([phoneme for _, phoneme in sentence_transcriptions])
+                    print(("%s\t%s" % (original_sentence, phoneme_sequence)), file=output_file)
+                    output_line_count += 1
+
         # Print final statistics
         print(f"\nProcessing Summary:", file=stderr)
         print(f"  Input lines: {input_line_count}", file=stderr)
@@ -362,13 +395,13 @@ def mainApply(translator, options, output_file):
         print(f"  Successfully converted words: {processing_stats['successful_words']}", file=stderr)
         print(f"  Failed conversions: {processing_stats['failed_words']}", file=stderr)
         print(f"  Total errors: {error_count}", file=stderr)
-        
+
         # Check if input and output line counts match
         if input_line_count > 0 and input_line_count != output_line_count:
             print(f"WARNING: Input line count ({input_line_count}) does not match output line count ({output_line_count})!", file=stderr)
         elif input_line_count > 0:
             print(f"SUCCESS: Input and output line counts match ({input_line_count} lines).", file=stderr)
-    
+
     except Exception as e:
         print(f"CRITICAL ERROR during processing: {str(e)}", file=stderr)
         import traceback
@@ -431,6 +464,12 @@ def main(options, args):
             translator = Translator(model)
             if options.stack_limit:
                 translator.setStackLimit(options.stack_limit)
+            if options.beam is not None:
+                translator.setBeam(options.beam)
+            if options.beam_size:
+                translator.setBeamSize(options.beam_size)
+            if options.cache_size:
+                translator = CachedTranslator(translator, options.cache_size)
         del model
 
     if options.testSample:
@@ -446,6 +485,9 @@ def main(options, args):
     if options.applyWord:
         mainApplyWord(translator, options, log_stdout)
 
+    if options.statsJson and hasattr(translator, "statistics"):
+        SequiturTool.writeStatistics(translator.statistics(), options.statsJson)
+
 
 # ===========================================================================
 if __name__ == "__main__":
@@ -526,6 +568,41 @@ if __name__ == "__main__":
         help="limit size of search stack to N elements",
         metavar="N",
     )
+    optparser.add_option(
+        "--beam",
+        type="float",
+        help="prune hypotheses scoring more than MARGIN (natural log) below "
+        "the best one covering the same letters; faster, but no longer exact",
+        metavar="MARGIN",
+    )
+    optparser.add_option(
+        "--beam-size",
+        type="int",
+        help="expand at most N hypotheses per number of covered letters",
+        metavar="N",
+    )
+    optparser.add_option(
+        "--cache-size",
+        type="int",
+        help="cache the pronunciations of up to N distinct words "
+        "(only effective with --apply)",
+        metavar="N",
+    )
+    optparser.add_option(
+        "--stats-json",
+        dest="statsJson",
+        help="write search statistics (hypotheses expanded, open list peaks, "
+        "time per word, and the slowest words) as JSON to FILE",
+        metavar="FILE",
+    )
+    optparser.add_option(
+        "--sentence-window",
+        type="int",
+        help="convert the distinct words of N sentences at a time, "
+        "each of them only once; nothing is written before N sentences "
+        "have been read (default: 1000, or 1 when reading standard input)",
+        metavar="N",
+    )
     optparser.add_option(
         "--sentence-separator",
         default=" # ",
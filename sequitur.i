@@ -188,6 +188,10 @@ class SequenceModel {
 public:
 //  typedef size_t History;
     typedef unsigned int Token;
+    enum Layout {
+        compactLayout,
+        denseRootLayout
+    };
 
     SequenceModel();
     ~SequenceModel();
@@ -195,6 +199,8 @@ public:
     void set(PyObject*);
     PyObject *get();
     PyObject *getNode(SequenceModel::History) const;
+    PyObject *getBinary() const;
+    void setBinary(PyObject*);
 
     Token init() const;
     Token term() const;
@@ -205,8 +211,23 @@ public:
     PyObject *historyAsTuple(SequenceModel::History) const;
     Probability probability(Token, SequenceModel::History) const;
 
+    void setSuccessorCacheSize(size_t);
+    size_t successorCacheSize() const;
+    void resetSuccessorCacheStats();
+    void setLayout(Layout);
+    Layout layout() const;
+    void setQuantization(int);
+    int quantization() const;
+
     int memoryUsed();
 };
+%extend SequenceModel {
+    PyObject *successorCacheStats() const {
+        u64 hits, misses;
+        self->successorCacheStats(hits, misses);
+        return Py_BuildValue("(KK)", (unsigned long long) hits, (unsigned long long) misses);
+    }
+};
 
 #if defined(INSTRUMENTATION)
 class StringInventory {
@@ -229,6 +250,17 @@ public:
     int memoryUsed();
 };
 
+%rename(compact) EstimationGraphStore::yield;
+class EstimationGraphStore {
+public:
+    EstimationGraphStore();
+    bool add(const EstimationGraph*);
+    void update(SequenceModel*);
+    void yield();
+    size_t size();
+    int memoryUsed();
+};
+
 class EstimationGraphBuilder {
 public:
     void setSequenceModel(MultigramInventory*, SequenceModel*);
@@ -252,6 +284,7 @@ public:
     EvidenceStore();
     void setSequenceModel(SequenceModel*);
     PyObject *asList();
+    void accumulateList(PyObject*);
     size_t size();
     int maximumHistoryLength();
     Probability maximum();
@@ -274,6 +307,23 @@ public:
     }
 };
 
+%{
+    static void estimationGraphsFromPyObject(PyObject *obj, EstimationGraphList &result) {
+        PyObject *seq = PySequence_Fast(obj, "not a sequence");
+        if (!seq) throw ExistingPythonException();
+        int length = PySequence_Fast_GET_SIZE(seq);
+        result.resize(length);
+        for (int i = 0; i < length; ++i) {
+            void *eg = 0;
+            if (!SWIG_IsOK(SWIG_ConvertPtr(PySequence_Fast_GET_ITEM(seq, i), &eg, SWIGTYPE_p_EstimationGraph, 0))) {
+                Py_DECREF(seq);
+                throw PythonException(PyExc_TypeError, "not an EstimationGraph");
+            }
+            result[i] = reinterpret_cast<EstimationGraph*>(eg);
+        }
+        Py_DECREF(seq);
+    }
+%}
 
 class Accumulator {
 public:
@@ -282,6 +332,28 @@ public:
     LogProbability accumulate(EstimationGraph*, Probability weight);
     LogProbability logLik(EstimationGraph*);
 };
+%extend Accumulator {
+    double accumulateMany(PyObject *graphs, Probability weight, int nThreads) {
+        EstimationGraphList egs;
+        estimationGraphsFromPyObject(graphs, egs);
+        AllowThreads nogil;
+        return self->accumulateMany(egs, weight, nThreads);
+    }
+    double logLikMany(PyObject *graphs, int nThreads) {
+        EstimationGraphList egs;
+        estimationGraphsFromPyObject(graphs, egs);
+        AllowThreads nogil;
+        return self->logLikMany(egs, nThreads);
+    }
+    double accumulateStore(EstimationGraphStore *graphs, Probability weight, int nThreads) {
+        AllowThreads nogil;
+        return self->accumulateStore(*graphs, weight, nThreads);
+    }
+    double logLikStore(EstimationGraphStore *graphs, int nThreads) {
+        AllowThreads nogil;
+        return self->logLikStore(*graphs, nThreads);
+    }
+}
 
 class ViterbiAccumulator {
 public:
@@ -300,6 +372,26 @@ public:
             PyList_SET_ITEM(result, i, PyInt_FromLong(mgs[i]));
         return Py_BuildValue("(fN)", -p.score(), result);
     }
+    double accumulateMany(PyObject *graphs, Probability weight, int nThreads) {
+        EstimationGraphList egs;
+        estimationGraphsFromPyObject(graphs, egs);
+        AllowThreads nogil;
+        return self->accumulateMany(egs, weight, nThreads);
+    }
+    double logLikMany(PyObject *graphs, int nThreads) {
+        EstimationGraphList egs;
+        estimationGraphsFromPyObject(graphs, egs);
+        AllowThreads nogil;
+        return self->logLikMany(egs, nThreads);
+    }
+    double accumulateStore(EstimationGraphStore *graphs, Probability weight, int nThreads) {
+        AllowThreads nogil;
+        return self->accumulateStore(*graphs, weight, nThreads);
+    }
+    double logLikStore(EstimationGraphStore *graphs, int nThreads) {
+        AllowThreads nogil;
+        return self->logLikStore(*graphs, nThreads);
+    }
 }
 
 class OneForAllAccumulator {
@@ -308,11 +400,45 @@ public:
     void setTarget(EvidenceStore*);
     void accumulate(EstimationGraph*, Probability weight);
 };
+%extend OneForAllAccumulator {
+    void accumulateMany(PyObject *graphs, Probability weight, int nThreads) {
+        EstimationGraphList egs;
+        estimationGraphsFromPyObject(graphs, egs);
+        AllowThreads nogil;
+        self->accumulateMany(egs, weight, nThreads);
+    }
+    void accumulateStore(EstimationGraphStore *graphs, Probability weight, int nThreads) {
+        AllowThreads nogil;
+        self->accumulateStore(*graphs, weight, nThreads);
+    }
+}
 
 // ===========================================================================
 %{
 #include "Translation.cc"
 typedef Translator::NBestContext Translator_NBestContext;
+
+    static void sequenceFromPyObject(PyObject *obj, Sequence &result) {
+        PyObject *seq = PySequence_Fast(obj, "not a sequence");
+        if (!seq) throw ExistingPythonException();
+        int length = PySequence_Fast_GET_SIZE(seq);
+        result.clear();
+        result.reserve(length);
+        for (int i = 0; i < length; ++i) {
+            PyObject *sym = PySequence_Fast_GET_ITEM(seq, i);
+            if (!PyInt_Check(sym)) {
+                Py_DECREF(seq);
+                throw PythonException(PyExc_TypeError, "element not an integer");
+            }
+            long ind = PyInt_AsLong(sym);
+            if (ind < 0 || ind > Core::Type<Symbol>::max) {
+                Py_DECREF(seq);
+                throw PythonException(PyExc_ValueError, "symbol out of range");
+            }
+            result.push_back(ind);
+        }
+        Py_DECREF(seq);
+    }
 %}
 
 class Translator_NBestContext {
@@ -331,24 +457,122 @@ public:
     void setSequenceModel(SequenceModel*);
     int stackUsage();
     void setStackLimit(int);
+    void setBeam(double);
+    void setBeamSize(int);
+    void setLazyNBest(bool);
+    void setExactPosteriors(bool);
 
-    Translator_NBestContext *nBestInit(Sequence left);
     LogProbability nBestBestLogLik(Translator_NBestContext*);
-    LogProbability nBestTotalLogLik(Translator_NBestContext*);
 };
 %extend Translator {
+    PyObject *translateBatch(PyObject *lefts) {
+        PyObject *seq = PySequence_Fast(lefts, "not a sequence");
+        if (!seq) throw ExistingPythonException();
+        int n = PySequence_Fast_GET_SIZE(seq);
+        std::vector<Sequence> sequences(n);
+        try {
+            for (int i = 0; i < n; ++i)
+                sequenceFromPyObject(PySequence_Fast_GET_ITEM(seq, i), sequences[i]);
+        } catch (...) {
+            Py_DECREF(seq);
+            throw;
+        }
+        Py_DECREF(seq);
+
+        std::vector<Translator::BatchResult> results(n);
+        {
+            AllowThreads nogil;
+            self->translateBatch(sequences, results);
+        }
+
+        PyObject *result = PyList_New(n);
+        for (int i = 0; i < n; ++i) {
+            const Translator::BatchResult &r(results[i]);
+            PyObject *item;
+            if (r.error.empty()) {
+                u32 len = r.right.size();
+                PyObject *right = PyTuple_New(len);
+                for (u32 j = 0; j < len; ++j)
+                    PyTuple_SET_ITEM(right, j, PyInt_FromLong(r.right[j]));
+                item = Py_BuildValue("(fN)", -r.p.score(), right);
+            } else {
+                item = PyUnicode_FromString(r.error.c_str());
+            }
+            PyList_SET_ITEM(result, i, item);
+        }
+        return result;
+    }
     PyObject *__call__(Sequence left) {
         std::vector<MultigramIndex> mgs;
-        LogProbability p = self->translate(left, mgs);
+        LogProbability p;
+        {
+            AllowThreads nogil;
+            p = self->translate(left, mgs);
+        }
         u32 len = mgs.size();
         PyObject *result = PyList_New(len);
         for (u32 i = 0; i < len; ++i)
             PyList_SET_ITEM(result, i, PyInt_FromLong(mgs[i]));
         return Py_BuildValue("(fN)", -p.score(), result);
     }
+    Translator_NBestContext *nBestInit(Sequence left) {
+        AllowThreads nogil;
+        return self->nBestInit(left);
+    }
+    LogProbability nBestTotalLogLik(Translator_NBestContext *nbc) {
+        AllowThreads nogil;
+        return self->nBestTotalLogLik(nbc);
+    }
+    PyObject *nBest(Sequence left, int maxVariants, double mass) {
+        std::vector<Translator::NBestVariant> variants;
+        LogProbability total;
+        {
+            AllowThreads nogil;
+            total = self->nBest(left, maxVariants, mass, variants);
+        }
+        PyObject *result = PyList_New(variants.size());
+        for (u32 i = 0; i < variants.size(); ++i) {
+            const Translator::NBestVariant &v(variants[i]);
+            u32 len = v.right.size();
+            PyObject *right = PyTuple_New(len);
+            for (u32 j = 0; j < len; ++j)
+                PyTuple_SET_ITEM(right, j, PyInt_FromLong(v.right[j]));
+            PyList_SET_ITEM(result, i, Py_BuildValue("(dN)", (v.p / total).probability(), right));
+        }
+        return result;
+    }
+    PyObject *statistics(bool reset) {
+        Translator::Statistics s;
+        self->statistics(s, reset);
+        PyObject *counters = PyList_New(Translator::Statistics::nCounters);
+        for (u32 c = 0; c < Translator::Statistics::nCounters; ++c) {
+            PyObject *histogram = PyList_New(Translator::Statistics::nBuckets);
+            for (u32 b = 0; b < Translator::Statistics::nBuckets; ++b)
+                PyList_SET_ITEM(histogram, b, PyLong_FromUnsignedLongLong(s.histogram[c][b]));
+            PyList_SET_ITEM(counters, c, Py_BuildValue("(KKN)",
+                (unsigned long long) s.total[c], (unsigned long long) s.maximum[c], histogram));
+        }
+        PyObject *slowest = PyList_New(s.slowest.size());
+        for (u32 i = 0; i < s.slowest.size(); ++i) {
+            const Translator::SearchStatistics &ss(s.slowest[i].first);
+            const Sequence &left(s.slowest[i].second);
+            PyObject *l = PyTuple_New(left.size());
+            for (u32 j = 0; j < left.size(); ++j)
+                PyTuple_SET_ITEM(l, j, PyInt_FromLong(left[j]));
+            PyList_SET_ITEM(slowest, i, Py_BuildValue("(NIIIKO)",
+                l, ss.expanded, ss.openPeak, ss.graphNodes,
+                (unsigned long long) ss.microseconds, ss.failed ? Py_True : Py_False));
+        }
+        return Py_BuildValue("(KKNN)",
+            (unsigned long long) s.searches, (unsigned long long) s.failures, counters, slowest);
+    }
     PyObject *nBestNext(Translator_NBestContext *nbc) {
         std::vector<MultigramIndex> mgs;
-        LogProbability p = self->nBestNext(nbc, mgs);
+        LogProbability p;
+        {
+            AllowThreads nogil;
+            p = self->nBestNext(nbc, mgs);
+        }
         u32 len = mgs.size();
         PyObject *result = PyList_New(len);
         for (u32 i = 0; i < len; ++i)
@@ -28,7 +28,7 @@ commercially. In any case guarantee/warranty shall be limited to gross
 negligent actions or intended actions or fraudulent concealment.
 """
 
-import itertools, math, sys
+import collections, itertools, math, sys, threading
 import numpy as num
 import sequitur_, SequenceModel, Minimization, misc
 from symbols import SymbolInventory
@@ -122,9 +122,11 @@ class Model(object):
                 predicted = oldSequitur.inventory.symbol(predicted)
                 predicted = self.sequitur.inventory.index(predicted)
             data.append((history, predicted, score))
+        quantization = self.sequenceModel.quantization()
         self.sequenceModel = SequenceModel.SequenceModel()
         self.sequenceModel.set(data)
         self.sequenceModel.setInitAndTerm(self.sequitur.term, self.sequitur.term)
+        self.sequenceModel.setQuantization(quantization)
 
         return oldSequitur.inventory.size(), self.sequitur.inventory.size()
 
@@ -181,7 +183,8 @@ class Sample(object):
 
         self.masterModel = model
         self.currentModel = None
-        self.storedGraphs = None
+        self.graphStore = None
+        self.graphsOnDemand = None
 
     def __getstate__(self):
         state = {
@@ -190,6 +193,8 @@ class Sample(object):
             "emergenceMode": self.emergenceMode,
             "sample": self.sample,
             "masterModel": self.masterModel,
+            "nThreads": self.nThreads,
+            "graphCacheSize": self.graphCacheSize,
         }
         return state
 
@@ -199,26 +204,33 @@ class Sample(object):
         self.builder.setSizeTemplates(self.sizeTemplates)
         self.builder.setEmergenceMode(self.emergenceMode)
         self.currentModel = None
-        self.storedGraphs = None
+        self.graphStore = None
+        self.graphsOnDemand = None
 
     def size(self):
         return len(self.sample)
 
-    def makeGraphs(self):
-        for left, right in self.sample:
+    def createGraph(self, left, right):
+        try:
+            eg = self.builder.create(left, right)
+        except RuntimeError:
+            error = sys.exc_info()[1]
+            if str(error) != "final node not reachable":
+                raise
+            print(
+                "warning: dropping one sample that has no segmentation",
+                repr((left, right)),
+            )
+            return None
+        eg.thisown = True
+        return eg
+
+    def makeGraphs(self, sample):
+        for left, right in sample:
             self.builder.setSequenceModel(self.sequitur.inventory, self.masterModel)
-            try:
-                eg = self.builder.create(left, right)
-            except RuntimeError:
-                error = sys.exc_info()[1]
-                if str(error) != "final node not reachable":
-                    raise
-                print(
-                    "warning: dropping one sample that has no segmentation",
-                    repr((left, right)),
-                )
+            eg = self.createGraph(left, right)
+            if eg is None:
                 continue
-            eg.thisown = True
             if self.currentModel is not self.masterModel:
                 self.builder.setSequenceModel(
                     self.sequitur.inventory, self.currentModel
@@ -226,49 +238,60 @@ class Sample(object):
                 self.builder.update(eg)
             yield eg
 
-    class GraphsOnDemand:
-        def __init__(self, master, model):
-            self.master = master
-            self.model = model
-
-        def __iter__(self):
-            assert self.model is self.master.currentModel
-            return self.master.makeGraphs()
-
-    maxStoredGraphs = 5000
+    graphCacheSize = 1024 * 1024 * 1024  # bytes
+
+    def storeGraphs(self):
+        """
+        Pack the graphs into an EstimationGraphStore until it uses
+        graphCacheSize bytes.  Graphs for the remaining samples (and
+        the rare graph that is too big for the store) are created on
+        demand in each pass.
+        """
+        store = sequitur_.EstimationGraphStore()
+        onDemand = []
+        self.builder.setSequenceModel(self.sequitur.inventory, self.masterModel)
+        for i, (left, right) in enumerate(self.sample):
+            if store.memoryUsed() >= self.graphCacheSize:
+                onDemand += self.sample[i:]
+                break
+            eg = self.createGraph(left, right)
+            if eg is not None and not store.add(eg):
+                onDemand.append((left, right))
+        store.compact()
+        self.graphStore = store
+        self.graphsOnDemand = onDemand
+        self.currentModel = self.masterModel
 
     def graphs(self, model):
-        if len(self.sample) > self.maxStoredGraphs:
+        """
+        Return the estimation graphs for model as a pair: an
+        EstimationGraphStore, and an iterable over the graphs which
+        did not fit into the store.
+        """
+        if self.graphStore is None:
+            self.storeGraphs()
+        if model is not self.currentModel:
+            self.graphStore.update(model)
             self.currentModel = model
-            return self.GraphsOnDemand(self, model)
-        else:
-            if self.storedGraphs is None:
-                self.builder.setSequenceModel(self.sequitur.inventory, self.masterModel)
-                graphs = []
-                for left, right in self.sample:
-                    try:
-                        eg = self.builder.create(left, right)
-                    except RuntimeError:
-                        error = sys.exc_info()[1]
-                        if str(error) != "final node not reachable":
-                            raise
-                        print(
-                            "warning: dropping one sample that has no segmentation",
-                            repr((left, right)),
-                        )
-                        continue
-                    eg.thisown = True
-                    graphs.append(eg)
-                self.storedGraphs = graphs
-                self.currentModel = self.masterModel
-            if model is not self.currentModel:
-                self.builder.setSequenceModel(self.sequitur.inventory, model)
-                for eg in self.storedGraphs:
-                    self.builder.update(eg)
-                self.currentModel = model
-            return self.storedGraphs
+        return self.graphStore, self.makeGraphs(self.graphsOnDemand)
+
+    nThreads = 1
+    threadBatchSize = 1000
+
+    def graphBatches(self, graphs):
+        """
+        Group graphs created on demand into lists suitable for the
+        accumulateMany() methods, threadBatchSize graphs per thread.
+        """
+        graphs = iter(graphs)
+        batchSize = self.threadBatchSize * self.nThreads
+        while True:
+            batch = list(itertools.islice(graphs, batchSize))
+            if not batch:
+                break
+            yield batch
 
-    def evidence(self, model, useMaximumApproximation):
+    def accumulateEvidence(self, model, useMaximumApproximation):
         evidences = sequitur_.EvidenceStore()
         evidences.setSequenceModel(model)
         if useMaximumApproximation:
@@ -276,9 +299,18 @@ class Sample(object):
         else:
             accumulator = sequitur_.Accumulator()
         accumulator.setTarget(evidences)
-        logLik = 0.0
-        for eg in self.graphs(model):
-            logLik += accumulator.accumulate(eg, 1.0)
+        store, others = self.graphs(model)
+        logLik = accumulator.accumulateStore(store, 1.0, self.nThreads)
+        if self.nThreads > 1:
+            for graphs in self.graphBatches(others):
+                logLik += accumulator.accumulateMany(graphs, 1.0, self.nThreads)
+        else:
+            for eg in others:
+                logLik += accumulator.accumulate(eg, 1.0)
+        return evidences, logLik
+
+    def evidence(self, model, useMaximumApproximation):
+        evidences, logLik = self.accumulateEvidence(model, useMaximumApproximation)
         misc.reportMemoryUsage()
         return evidences, logLik
 
@@ -287,9 +319,14 @@ class Sample(object):
             accumulator = sequitur_.ViterbiAccumulator()
         else:
             accumulator = sequitur_.Accumulator()
-        logLik = 0.0
-        for eg in self.graphs(model):
-            logLik += accumulator.logLik(eg)
+        store, others = self.graphs(model)
+        logLik = accumulator.logLikStore(store, self.nThreads)
+        if self.nThreads > 1:
+            for graphs in self.graphBatches(others):
+                logLik += accumulator.logLikMany(graphs, self.nThreads)
+        else:
+            for eg in others:
+                logLik += accumulator.logLik(eg)
         return logLik
 
     def overlappingOccurenceCounts(self, model):
@@ -297,8 +334,180 @@ class Sample(object):
         counts.setSequenceModel(model)
         accumulator = sequitur_.OneForAllAccumulator()
         accumulator.setTarget(counts)
-        for eg in self.graphs(model):
-            accumulator.accumulate(eg, 1.0)
+        store, others = self.graphs(model)
+        accumulator.accumulateStore(store, 1.0, self.nThreads)
+        if self.nThreads > 1:
+            for graphs in self.graphBatches(others):
+                accumulator.accumulateMany(graphs, 1.0, self.nThreads)
+        else:
+            for eg in others:
+                accumulator.accumulate(eg, 1.0)
+        return counts
+
+    def close(self):
+        pass
+
+
+def _sampleWorker(connection, sample, inheritedConnections):
+    """
+    Serve requests of a ParallelSample for one slice of the sample.
+    The model is transferred as a binary image and only re-created
+    when it has changed, so that the stored graphs need not be
+    updated more often than in the serial case.
+    """
+    for inherited in inheritedConnections:
+        inherited.close()
+    image = model = None
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        method, newImage, args = request
+        try:
+            if newImage != image:
+                model = SequenceModel.SequenceModel()
+                model.setBinary(newImage)
+                image = newImage
+            if method == "evidence":
+                evidence, logLik = sample.accumulateEvidence(model, *args)
+                result = (evidence.asList(), logLik)
+            elif method == "overlappingOccurenceCounts":
+                result = sample.overlappingOccurenceCounts(model).asList()
+            else:
+                result = getattr(sample, method)(model, *args)
+            connection.send((True, result))
+        except Exception:
+            import traceback
+
+            connection.send((False, traceback.format_exc()))
+    connection.close()
+
+
+class ParallelSample(Sample):
+    """
+    Sample distributed over several worker processes.  Each worker
+    holds a slice of the sample together with its estimation graphs.
+    Evidence and log-likelihoods are computed by the workers and
+    reduced here, so the result equals that of a serial Sample up to
+    floating point rounding.
+    """
+
+    def __init__(self, sequitur, sizeTemplates, emergenceMode, sample, model, nJobs):
+        Sample.__init__(self, sequitur, sizeTemplates, emergenceMode, sample, model)
+        self.nJobs = nJobs
+        self.workers = None
+
+    def __getstate__(self):
+        state = Sample.__getstate__(self)
+        state["nJobs"] = self.nJobs
+        return state
+
+    def __setstate__(self, state):
+        Sample.__setstate__(self, state)
+        self.workers = None
+
+    def registerMultigrams(self):
+        """
+        Create all graphs once, so that every multigram that can
+        emerge is entered into the inventory before the workers are
+        started.  Otherwise workers would assign conflicting indices.
+        """
+        self.builder.setSequenceModel(self.sequitur.inventory, self.masterModel)
+        for left, right in self.sample:
+            try:
+                eg = self.builder.create(left, right)
+            except RuntimeError:
+                if str(sys.exc_info()[1]) != "final node not reachable":
+                    raise
+                continue
+            eg.thisown = True
+
+    def startWorkers(self):
+        import multiprocessing
+
+        if self.emergenceMode == EstimationGraphBuilder.emergeNewMultigrams:
+            self.registerMultigrams()
+        if "fork" in multiprocessing.get_all_start_methods():
+            mp = multiprocessing.get_context("fork")
+        else:
+            mp = multiprocessing.get_context()
+        self.workers = []
+        for i in range(self.nJobs):
+            shard = Sample(
+                self.sequitur,
+                self.sizeTemplates,
+                self.emergenceMode,
+                self.sample[i :: self.nJobs],
+                self.masterModel,
+            )
+            shard.nThreads = self.nThreads
+            shard.graphCacheSize = self.graphCacheSize // self.nJobs
+            connection, workerConnection = mp.Pipe()
+            inherited = [c for p, c in self.workers] + [connection]
+            process = mp.Process(
+                target=_sampleWorker, args=(workerConnection, shard, inherited)
+            )
+            process.daemon = True
+            process.start()
+            workerConnection.close()
+            self.workers.append((process, connection))
+
+    def close(self):
+        if self.workers is None:
+            return
+        for process, connection in self.workers:
+            try:
+                connection.send(None)
+            except (IOError, OSError):
+                pass
+            connection.close()
+        for process, connection in self.workers:
+            process.join()
+        self.workers = None
+
+    def request(self, method, model, *args):
+        if self.workers is None:
+            self.startWorkers()
+        # Evidence refers to the histories of model, so keep it alive
+        # for as long as a serial Sample would.
+        self.currentModel = model
+        image = model.getBinary()
+        for process, connection in self.workers:
+            connection.send((method, image, args))
+        results, failures = [], []
+        for process, connection in self.workers:
+            ok, result = connection.recv()
+            if ok:
+                results.append(result)
+            else:
+                failures.append(result)
+        if failures:
+            raise RuntimeError("worker failed:\n" + failures[0])
+        return results
+
+    def evidence(self, model, useMaximumApproximation):
+        evidences = sequitur_.EvidenceStore()
+        evidences.setSequenceModel(model)
+        logLik = 0.0
+        for partial, partialLogLik in self.request(
+            "evidence", model, useMaximumApproximation
+        ):
+            evidences.accumulateList(partial)
+            logLik += partialLogLik
+        misc.reportMemoryUsage()
+        return evidences, logLik
+
+    def logLik(self, model, useMaximumApproximation):
+        return sum(self.request("logLik", model, useMaximumApproximation))
+
+    def overlappingOccurenceCounts(self, model):
+        counts = sequitur_.EvidenceStore()
+        counts.setSequenceModel(model)
+        for partial in self.request("overlappingOccurenceCounts", model):
+            counts.accumulateList(partial)
         return counts
 
 
@@ -502,6 +711,9 @@ class ModelTemplate:
         self.observers = []
         self.shallUseMaximumApproximation = False
         self.emergenceMode = EstimationGraphBuilder.emergeNewMultigrams
+        self.nJobs = 1
+        self.nThreads = 1
+        self.graphCacheSize = Sample.graphCacheSize
 
     def useMaximumApproximation(self, viterbi):
         self.shallUseMaximumApproximation = viterbi
@@ -697,21 +909,45 @@ class ModelTemplate:
         else:
             context.model = self.obliviousModel()
         masterModel = self.masterSequenceModel(context.model)
-        context.trainSample = Sample(
-            self.sequitur,
-            self.sizeTemplates,
-            self.emergenceMode,
-            trainSample,
-            masterModel,
-        )
-        if develSample:
-            context.develSample = Sample(
+        if self.nJobs > 1:
+            context.trainSample = ParallelSample(
                 self.sequitur,
                 self.sizeTemplates,
-                EstimationGraphBuilder.anonymizeNewMultigrams,
-                develSample,
+                self.emergenceMode,
+                trainSample,
                 masterModel,
+                self.nJobs,
             )
+        else:
+            context.trainSample = Sample(
+                self.sequitur,
+                self.sizeTemplates,
+                self.emergenceMode,
+                trainSample,
+                masterModel,
+            )
+        context.trainSample.nThreads = self.nThreads
+        context.trainSample.graphCacheSize = self.graphCacheSize
+        if develSample:
+            if self.nJobs > 1:
+                context.develSample = ParallelSample(
+                    self.sequitur,
+                    self.sizeTemplates,
+                    EstimationGraphBuilder.anonymizeNewMultigrams,
+                    develSample,
+                    masterModel,
+                    self.nJobs,
+                )
+            else:
+                context.develSample = Sample(
+                    self.sequitur,
+                    self.sizeTemplates,
+                    EstimationGraphBuilder.anonymizeNewMultigrams,
+                    develSample,
+                    masterModel,
+                )
+            context.develSample.nThreads = self.nThreads
+            context.develSample.graphCacheSize = self.graphCacheSize
         else:
             context.develSample = None
         context.discountAdjuster = self.DiscountAdjustmentStrategy(
@@ -748,6 +984,9 @@ class ModelTemplate:
             misc.reportMemoryUsage()
             print("", file=context.log)
             context.log.flush()
+        context.trainSample.close()
+        if context.develSample:
+            context.develSample.close()
 
     def resume(cls, filename):
         from six.moves import cPickle as pickle
@@ -793,6 +1032,36 @@ class Translator:
     def setStackLimit(self, n):
         self.translator.setStackLimit(n)
 
+    def setBeam(self, margin):
+        """
+        Prune hypotheses whose log-probability falls short of the
+        best one covering the same part of the input by more than
+        margin.  Pass None to search exactly again.
+        """
+        if margin is None:
+            margin = -1.0
+        self.translator.setBeam(margin)
+
+    def setBeamSize(self, n):
+        """
+        Expand at most n hypotheses per covered input position.  Pass
+        None (or zero) to remove the limit.
+        """
+        self.translator.setBeamSize(n or 0)
+
+    def setLazyNBest(self, lazy=True, exactPosteriors=True):
+        """
+        Let nBest() and variants() search lazily, stopping as soon as
+        enough variants are found, instead of building the complete
+        search graph first.  With exactPosteriors the posteriors are
+        still relative to the total likelihood, which takes an extra
+        pass over the input.  Otherwise they are normalized by the sum
+        over the variants found, which requires a number of variants.
+        The beam settings do not apply to lazy search.
+        """
+        self.translator.setLazyNBest(lazy)
+        self.translator.setExactPosteriors(exactPosteriors)
+
     class TranslationFailure(RuntimeError):
         pass
 
@@ -838,6 +1107,23 @@ class Translator:
         logLik, right = self.firstBest(left)
         return right
 
+    def translateBatch(self, lefts):
+        """
+        First-best translation of many left-hand sequences in one call.
+        Returns a list with one entry per input: either a pair
+        (logLik, right) or a TranslationFailure instance.
+        """
+        parse = self.sequitur.leftInventory.parse
+        results = self.translator.translateBatch([parse(left) for left in lefts])
+        format = self.sequitur.rightInventory.format
+        for i, result in enumerate(results):
+            if isinstance(result, tuple):
+                logLik, right = result
+                results[i] = (logLik, format(right))
+            else:
+                results[i] = self.TranslationFailure(result)
+        return results
+
     def nBestInit(self, left):
         left = self.sequitur.leftInventory.parse(left)
         try:
@@ -863,8 +1149,271 @@ class Translator:
         left, right = self.jointToLeftRight(joint)
         return logLik, right
 
+    def nBest(self, left, k=None, mass=None):
+        """
+        The k most probable translations of left, or as many as needed
+        for their total posterior to reach mass, as a list of
+        (posterior, right) pairs in order of decreasing probability.
+        Without k and mass all translations are returned.  Unlike
+        nBestInit() and nBestNext() this needs a single call into the
+        translator.
+        """
+        left = self.sequitur.leftInventory.parse(left)
+        if mass is None:
+            mass = 2.0
+        try:
+            variants = self.translator.nBest(left, k or 0, mass)
+        except RuntimeError:
+            exc = sys.exc_info()[1]
+            raise self.TranslationFailure(*exc.args)
+        format = self.sequitur.rightInventory.format
+        return [(posterior, format(right)) for posterior, right in variants]
+
+    def variants(self, left, threshold=1.0, nVariantsLimit=None):
+        """
+        Pronunciation variants in order of decreasing probability as a
+        list of (posterior, right) pairs.  Variants are generated
+        until their total posterior reaches threshold, or until
+        nVariantsLimit variants have been found.
+        """
+        return self.nBest(left, nVariantsLimit, threshold)
+
+    statisticsCounters = ("expanded", "openPeak", "graphNodes", "microseconds")
+    nSlowest = 10  # as many as the C++ translator keeps
+
+    @staticmethod
+    def histogramBounds(bucket, nBuckets):
+        if bucket == 0:
+            return 0, 0
+        elif bucket + 1 == nBuckets:
+            return 2 ** (bucket - 1), None
+        else:
+            return 2 ** (bucket - 1), 2**bucket - 1
+
+    def statistics(self, reset=False):
+        """
+        Search statistics since the last reset as a dict: the number
+        of "searches" (one per word or n-best list) and of "failures",
+        the total, maximum and histogram of each counter, and the
+        "slowest" searches.  The counters are the hypotheses
+        "expanded", the peak size of the open list ("openPeak"), the
+        nodes of n-best search graphs ("graphNodes") and the wall
+        time in "microseconds".  Histograms are lists of [lower,
+        upper, count] with powers of two as bounds.
+        """
+        searches, failures, counters, slowest = self.translator.statistics(reset)
+        result = {"searches": searches, "failures": failures}
+        for name, (total, maximum, histogram) in zip(self.statisticsCounters, counters):
+            result[name] = {
+                "total": total,
+                "max": maximum,
+                "histogram": [
+                    list(self.histogramBounds(b, len(histogram))) + [count]
+                    for b, count in enumerate(histogram)
+                    if count
+                ],
+            }
+        format = self.sequitur.leftInventory.format
+        result["slowest"] = [
+            {
+                "left": list(format(left)),
+                "expanded": expanded,
+                "openPeak": openPeak,
+                "graphNodes": graphNodes,
+                "microseconds": microseconds,
+                "failed": failed,
+            }
+            for left, expanded, openPeak, graphNodes, microseconds, failed in slowest
+        ]
+        return result
+
+    @classmethod
+    def mergeStatistics(cls, a, b):
+        """
+        Combine two results of statistics(), e.g. of several processes.
+        """
+        result = {
+            "searches": a["searches"] + b["searches"],
+            "failures": a["failures"] + b["failures"],
+        }
+        for name in cls.statisticsCounters:
+            counts = {}
+            for lower, upper, count in a[name]["histogram"] + b[name]["histogram"]:
+                counts[lower, upper] = counts.get((lower, upper), 0) + count
+            result[name] = {
+                "total": a[name]["total"] + b[name]["total"],
+                "max": max(a[name]["max"], b[name]["max"]),
+                "histogram": [
+                    [lower, upper, count]
+                    for (lower, upper), count in sorted(counts.items())
+                ],
+            }
+        slowest = a["slowest"] + b["slowest"]
+        slowest.sort(key=lambda s: s["microseconds"], reverse=True)
+        result["slowest"] = slowest[: cls.nSlowest]
+        return result
+
+    @staticmethod
+    def histogramQuantile(counter, fraction):
+        """
+        Upper bound of the histogram bucket in which the given
+        fraction of the values of a counter of statistics() is
+        reached, but no more than the maximum value.
+        """
+        histogram = counter["histogram"]
+        needed = fraction * sum(count for lower, upper, count in histogram)
+        seen = 0
+        for lower, upper, count in histogram:
+            seen += count
+            if seen >= needed:
+                if upper is None:
+                    return counter["max"]
+                return min(upper, counter["max"])
+        return counter["max"]
+
     def reportStats(self, f):
         print("stack usage: ", self.translator.stackUsage(), file=f)
+        self.reportSearchStatistics(self.statistics(), f)
+        sequenceModel = self.model.sequenceModel
+        if sequenceModel.successorCacheSize():
+            hits, misses = sequenceModel.successorCacheStats()
+            print(
+                "successor cache hits: %d, misses: %d (%.1f%% hit rate)"
+                % (hits, misses, 100.0 * hits / max(hits + misses, 1)),
+                file=f,
+            )
+
+    @classmethod
+    def reportSearchStatistics(cls, statistics, f):
+        """
+        Print a summary of a result of statistics(), e.g. one merged
+        from several processes.
+        """
+        if statistics["searches"]:
+            n = statistics["searches"]
+            time = statistics["microseconds"]
+            expanded = statistics["expanded"]
+            print(
+                "searches: %d (%d failed), time per search: mean %.3f ms, "
+                "99%% below %.3f ms, max %.3f ms"
+                % (
+                    n,
+                    statistics["failures"],
+                    time["total"] / n / 1000.0,
+                    cls.histogramQuantile(time, 0.99) / 1000.0,
+                    time["max"] / 1000.0,
+                ),
+                file=f,
+            )
+            print(
+                "hypotheses expanded per search: mean %.1f, max %d, "
+                "open list peak: max %d"
+                % (
+                    expanded["total"] / n,
+                    expanded["max"],
+                    statistics["openPeak"]["max"],
+                ),
+                file=f,
+            )
+
+
+class CachedTranslator:
+    """
+    Bounded least-recently-used cache in front of a Translator.
+    First-best translations (also via translateBatch) and variant
+    lists (see Translator.variants) are cached, including failures.
+    translateBatch() looks up all of its inputs first and translates
+    the distinct missing ones in a single batch.  All other methods are passed
+    through to the underlying translator.
+    """
+
+    TranslationFailure = Translator.TranslationFailure
+
+    def __init__(self, translator, size):
+        self.translator = translator
+        self.size = size
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.translator, name)
+
+    def get(self, key):
+        with self.lock:
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+        return result
+
+    def put(self, key, result):
+        with self.lock:
+            self.misses += 1
+            self.cache[key] = result
+            if len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+
+    def lookup(self, key, translate):
+        result = self.get(key)
+        if result is None:
+            try:
+                result = (True, translate())
+            except self.TranslationFailure:
+                result = (False, sys.exc_info()[1].args)
+            self.put(key, result)
+        success, value = result
+        if not success:
+            raise self.TranslationFailure(*value)
+        return value
+
+    def firstBest(self, left):
+        return self.lookup((left,), lambda: self.translator.firstBest(left))
+
+    def __call__(self, left):
+        logLik, right = self.firstBest(left)
+        return right
+
+    def translateBatch(self, lefts):
+        results = [self.get((left,)) for left in lefts]
+        missing = list(
+            dict.fromkeys(left for left, r in zip(lefts, results) if r is None)
+        )
+        if missing:
+            found = {}
+            for left, result in zip(missing, self.translator.translateBatch(missing)):
+                if isinstance(result, self.TranslationFailure):
+                    found[left] = (False, result.args)
+                else:
+                    found[left] = (True, result)
+                self.put((left,), found[left])
+            results = [
+                found[left] if result is None else result
+                for left, result in zip(lefts, results)
+            ]
+        return [
+            value if success else self.TranslationFailure(*value)
+            for success, value in results
+        ]
+
+    def variants(self, left, threshold=1.0, nVariantsLimit=None):
+        return list(
+            self.lookup(
+                (left, threshold, nVariantsLimit),
+                lambda: tuple(
+                    self.translator.variants(left, threshold, nVariantsLimit)
+                ),
+            )
+        )
+
+    def reportStats(self, f):
+        self.translator.reportStats(f)
+        print(
+            "cache hits: %d, misses: %d, entries: %d"
+            % (self.hits, self.misses, len(self.cache)),
+            file=f,
+        )
 
 
 class Segmenter:
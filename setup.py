@@ -88,10 +88,15 @@ sequiturExtension = Extension(
 )
 
 sequiturModules = [
+    "AsyncTranslator",
     "Evaluation",
     "Minimization",
+    "ModelFile",
+    "ModelHandle",
+    "PronunciationCache",
     "SequenceModel",
     "SequiturTool",
+    "TranslationServer",
     "g2p",
     "misc",
     "sequitur",
@@ -100,7 +105,7 @@ sequiturModules = [
     "tool",
 ]
 
-sequiturScripts = ["g2p.py"]
+sequiturScripts = ["g2p.py", "g2p_client.py"]
 
 
 # os.system("cython -3  SparseVector.pyx")
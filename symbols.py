@@ -25,6 +25,8 @@ commercially. In any case guarantee/warranty shall be limited to gross
 negligent actions or intended actions or fraudulent concealment.
 """
 
+import threading
+
 
 class SymbolInventory:
     """
@@ -46,13 +48,17 @@ class SymbolInventory:
         "The number of symbols, including __term__, but not counting __void__."
         return len(self.list) - 1
 
+    _lock = threading.Lock()
+
     def index(self, sym):
         try:
             return self.dir[sym]
         except KeyError:
-            result = self.dir[sym] = len(self.list)
-            self.list.append(sym)
-            return result
+            with self._lock:
+                if sym not in self.dir:
+                    self.dir[sym] = len(self.list)
+                    self.list.append(sym)
+            return self.dir[sym]
 
     def parse(self, seq):
         return tuple(map(self.index, list(seq)))
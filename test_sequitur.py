@@ -27,9 +27,22 @@ commercially. In any case guarantee/warranty shall be limited to gross
 negligent actions or intended actions or fraudulent concealment.
 """
 
+import asyncio
+import io
+import optparse
+import os
+import pickle
+import socket
+import tempfile
+import threading
 import unittest
+import unittest.mock
 import math
 from sequitur import *
+import ModelFile
+from PronunciationCache import PersistentCachedTranslator
+from AsyncTranslator import AsyncTranslator
+from ModelHandle import ModelHandle
 
 
 class SequenceModelTestCase(unittest.TestCase):
@@ -82,6 +95,115 @@ class SequenceModelTestCase(unittest.TestCase):
             self.assertAlmostEqual(sm.probability(t, h), probs[t - 1])
             self.assertAlmostEqual(sm.probability(t, h2), probs2[t - 1])
 
+    def testSuccessorCache(self):
+        data = [((), t, -math.log(0.25)) for t in range(1, 5)]
+        data += [((2,), t, -math.log(0.25)) for t in range(1, 5)]
+        data += [((3, 2), 1, -math.log(0.5)), ((3, 2), None, 0.0)]
+        sm = SequenceModel.SequenceModel()
+        sm.setInitAndTerm(0, 0)
+        sm.set(data)
+        histories = [sm.initial(), sm.advanced(sm.initial(), 2)]
+        histories.append(sm.advanced(histories[1], 3))
+        expected = [[sm.advanced(h, t) for t in range(6)] for h in histories]
+        self.assertEqual(sm.successorCacheSize(), 0)
+
+        sm.setSuccessorCacheSize(1024)
+        self.assertTrue(0 < sm.successorCacheSize() <= 1024)
+        for i in range(2):
+            actual = [[sm.advanced(h, t) for t in range(6)] for h in histories]
+            self.assertEqual(actual, expected)
+        hits, misses = sm.successorCacheStats()
+        self.assertEqual(hits + misses, 2 * 3 * 6)
+        self.assertTrue(hits > misses)
+
+        sm.resetSuccessorCacheStats()
+        self.assertEqual(sm.successorCacheStats(), (0, 0))
+        sm.setSuccessorCacheSize(0)
+        self.assertEqual(sm.successorCacheSize(), 0)
+
+    def testLayout(self):
+        data = [((), t, -math.log(0.25)) for t in range(1, 5)]
+        data += [((2,), t, -math.log(0.25)) for t in range(1, 5)]
+        data += [((3, 2), 1, -math.log(0.5)), ((3, 2), None, 0.0)]
+        sm = SequenceModel.SequenceModel()
+        sm.setInitAndTerm(0, 0)
+        sm.set(data)
+
+        def lookups():
+            histories = [sm.initial(), sm.advanced(sm.initial(), 2)]
+            histories.append(sm.advanced(histories[1], 3))
+            histories += [sm.advanced(sm.initial(), t) for t in range(6)]
+            return [
+                (sm.advanced(h, t), sm.probability(t, h))
+                for h in histories
+                for t in range(6)
+            ]
+
+        self.assertEqual(sm.layout(), sm.compactLayout)
+        expected = lookups()
+        sm.setLayout(sm.denseRootLayout)
+        self.assertEqual(sm.layout(), sm.denseRootLayout)
+        self.assertEqual(lookups(), expected)
+        sm.setLayout(sm.compactLayout)
+        self.assertEqual(lookups(), expected)
+
+    def testQuantization(self):
+        data = [((), t, 0.01 * t) for t in range(1, 600)]
+        data += [((2,), t, 1.0 + 0.5 * t) for t in range(1, 5)]
+        data += [((2,), None, 0.5)]
+        sm = SequenceModel.SequenceModel()
+        sm.setInitAndTerm(0, 0)
+        sm.set(data)
+        exact = sorted(sm.get(), key=repr)
+
+        sm.setQuantization(16)
+        self.assertEqual(sm.quantization(), 16)
+        self.assertEqual(sorted(sm.get(), key=repr), exact)
+
+        sm.setQuantization(8)
+        quantized = sorted(sm.get(), key=repr)
+        codes = set(s for h, t, s in quantized if h == () and t is not None)
+        self.assertEqual(len(codes), 256)
+        for (h, t, s), (hq, tq, sq) in zip(exact, quantized):
+            self.assertEqual((h, t), (hq, tq))
+            self.assertAlmostEqual(s, sq, delta=0.02)
+        h = sm.advanced(sm.initial(), 2)
+        self.assertAlmostEqual(-math.log(sm.probability(3, h)), 2.5)
+
+        other = SequenceModel.SequenceModel()
+        other.setBinary(sm.getBinary())
+        self.assertEqual(other.quantization(), 8)
+        self.assertEqual(sorted(other.get(), key=repr), quantized)
+        other = pickle.loads(pickle.dumps(sm))
+        self.assertEqual(other.quantization(), 8)
+        self.assertEqual(sorted(other.get(), key=repr), quantized)
+
+        sm.setQuantization(0)
+        self.assertEqual(sorted(sm.get(), key=repr), quantized)
+        self.assertRaises(ValueError, sm.setQuantization, 4)
+
+    def testPrune(self):
+        probs = [0.1, 0.2, 0.3, 0.4]
+        data = [((), t + 1, -math.log(p)) for t, p in enumerate(probs)]
+        data += [((2,), 1, -math.log(0.1)), ((2,), 4, -math.log(0.7))]
+        data += [((2,), None, -math.log(0.4))]
+        sm = SequenceModel.SequenceModel()
+        sm.setInitAndTerm(0, 0)
+        sm.set(data)
+
+        # p(1 | 2) is close to its back-off estimate, p(4 | 2) is not
+        self.assertEqual(sm.prune(size=5), (6, 5))
+        h = sm.advanced(sm.initial(), 2)
+        expected = [0.05, 0.1, 0.15, 0.7]
+        for t, p in enumerate(expected):
+            self.assertAlmostEqual(sm.probability(t + 1, h), p)
+
+        self.assertEqual(sm.prune(threshold=1.0), (5, 4))
+        self.assertEqual(sorted(h for h, t, s in sm.get()), [()] * 5)
+        h = sm.advanced(sm.initial(), 2)
+        for t, p in enumerate(probs):
+            self.assertAlmostEqual(sm.probability(t + 1, h), p)
+
 
 class EstimatorTestCase(unittest.TestCase):
     def setUp(self):
@@ -135,6 +257,113 @@ class EstimatorTestCase(unittest.TestCase):
             else:
                 self.assertAlmostEqual(p, 0.4)
 
+    sizeTemplates = [(1, 1), (1, 0), (0, 1), (2, 1)]
+    words = "ab abc ba cab bb"
+
+    def historyModel(self):
+        model = SequenceModel.SequenceModel()
+        model.setInitAndTerm(self.sequitur.term, self.sequitur.term)
+        model.set([((), None, math.log(7)), ((self.sequitur.term,), None, 0.0)])
+        return model
+
+    def assertSameEvidence(self, actual, expected):
+        actual = dict(((h, t), p) for h, t, p in actual.asList())
+        expected = dict(((h, t), p) for h, t, p in expected.asList())
+        self.assertEqual(sorted(actual), sorted(expected))
+        self.assertTrue(any(h for h, t in expected))
+        for event in expected:
+            self.assertAlmostEqual(actual[event], expected[event])
+
+    def testParallelEvidence(self):
+        model = self.historyModel()
+        sample = [(tuple(w), tuple(w.upper())) for w in self.words.split()]
+        sample = self.sequitur.compileSample(sample)
+        serial = Sample(
+            self.sequitur,
+            self.sizeTemplates,
+            EstimationGraphBuilder.emergeNewMultigrams,
+            sample,
+            model,
+        )
+        parallel = ParallelSample(
+            self.sequitur,
+            self.sizeTemplates,
+            EstimationGraphBuilder.emergeNewMultigrams,
+            sample,
+            model,
+            3,
+        )
+        try:
+            expected, expectedLogLik = serial.evidence(model, False)
+            actual, actualLogLik = parallel.evidence(model, False)
+            self.assertAlmostEqual(actualLogLik, expectedLogLik)
+            self.assertSameEvidence(actual, expected)
+            self.assertAlmostEqual(
+                parallel.logLik(model, False), serial.logLik(model, False)
+            )
+        finally:
+            parallel.close()
+
+    def testThreadedEvidence(self):
+        model = self.historyModel()
+        sample = [(tuple(w), tuple(w.upper())) for w in self.words.split()]
+        sample = self.sequitur.compileSample(sample)
+        serial = Sample(
+            self.sequitur,
+            self.sizeTemplates,
+            EstimationGraphBuilder.emergeNewMultigrams,
+            sample,
+            model,
+        )
+        threaded = Sample(
+            self.sequitur,
+            self.sizeTemplates,
+            EstimationGraphBuilder.emergeNewMultigrams,
+            sample,
+            model,
+        )
+        threaded.nThreads = 3
+        for viterbi in [False, True]:
+            expected, expectedLogLik = serial.evidence(model, viterbi)
+            actual, actualLogLik = threaded.evidence(model, viterbi)
+            self.assertAlmostEqual(actualLogLik, expectedLogLik)
+            self.assertSameEvidence(actual, expected)
+            self.assertAlmostEqual(
+                threaded.logLik(model, viterbi), serial.logLik(model, viterbi)
+            )
+        self.assertSameEvidence(
+            threaded.overlappingOccurenceCounts(model),
+            serial.overlappingOccurenceCounts(model),
+        )
+
+    def testGraphCache(self):
+        model = self.historyModel()
+        sample = [(tuple(w), tuple(w.upper())) for w in self.words.split()]
+        sample = self.sequitur.compileSample(sample)
+        samples = []
+        for graphCacheSize in [Sample.graphCacheSize, 1000, 0]:
+            s = Sample(
+                self.sequitur,
+                self.sizeTemplates,
+                EstimationGraphBuilder.emergeNewMultigrams,
+                sample,
+                model,
+            )
+            s.graphCacheSize = graphCacheSize
+            samples.append(s)
+        expected, expectedLogLik = samples[0].evidence(model, False)
+        store, others = samples[0].graphs(model)
+        self.assertEqual(store.size(), len(sample))
+        for s in samples[1:]:
+            actual, actualLogLik = s.evidence(model, False)
+            self.assertAlmostEqual(actualLogLik, expectedLogLik)
+            self.assertSameEvidence(actual, expected)
+            self.assertAlmostEqual(
+                s.logLik(model, True), samples[0].logLik(model, True)
+            )
+        store, others = samples[1].graphs(model)
+        self.assertTrue(0 < store.size() < len(sample))
+
     def testAbcMonoGrams(self):
         return
 
@@ -177,5 +406,563 @@ class EstimatorTestCase(unittest.TestCase):
             estm.reestimate()
 
 
+class TranslatorTestCase(unittest.TestCase):
+    graphones = [
+        (("a",), ("A",), 0.3),
+        (("b",), ("B",), 0.2),
+        (("c",), ("C",), 0.1),
+        (("a", "b"), ("X",), 0.2),
+        (("c",), ("K", "S"), 0.05),
+    ]
+
+    def setUp(self):
+        sequitur = Sequitur()
+        data = [((), sequitur.term, -math.log(0.1))]
+        for left, right, p in self.graphones:
+            data.append(((), sequitur.index(left, right), -math.log(p)))
+        data.append(((), None, -math.log(1e-3)))
+        self.model = Model(sequitur)
+        self.model.sequenceModel = SequenceModel.SequenceModel()
+        self.model.sequenceModel.setInitAndTerm(sequitur.term, sequitur.term)
+        self.model.sequenceModel.set(data)
+        self.translator = Translator(self.model)
+
+    def testFirstBest(self):
+        logLik, right = self.translator.firstBest(tuple("abc"))
+        self.assertEqual(right, ("X", "C"))
+        self.assertAlmostEqual(logLik, math.log(0.2 * 0.1 * 0.1))
+        self.assertRaises(
+            Translator.TranslationFailure, self.translator, tuple("abd")
+        )
+
+    def testTranslateBatch(self):
+        words = [tuple("abc"), tuple("abd"), tuple("cab"), ()]
+        results = self.translator.translateBatch(words)
+        self.assertEqual(len(results), len(words))
+        for word, result in zip(words, results):
+            try:
+                expected = self.translator.firstBest(word)
+            except Translator.TranslationFailure:
+                self.assertTrue(isinstance(result, Translator.TranslationFailure))
+                continue
+            self.assertEqual(result[1], expected[1])
+            self.assertAlmostEqual(result[0], expected[0])
+
+    def testBeam(self):
+        words = [tuple(w) for w in ("abc", "cab", "ccab", "abab")]
+        expected = [self.translator.variants(w, 1.0, 10) for w in words]
+        self.translator.setBeam(50.0)
+        self.translator.setBeamSize(100)
+        for word, variants in zip(words, expected):
+            self.assertEqual(self.translator.variants(word, 1.0, 10), variants)
+
+        self.translator.setBeam(0.0)
+        self.translator.setBeamSize(None)
+        self.assertEqual(self.translator(tuple("abc")), ("X", "C"))
+        variants = self.translator.variants(tuple("abc"), 1.0, 10)
+        self.assertEqual(variants[0][1], ("X", "C"))
+        self.assertTrue(len(variants) < len(expected[0]))
+
+        self.translator.setBeam(None)
+        self.assertEqual(self.translator.variants(tuple("abc"), 1.0, 10), expected[0])
+
+    def testNBest(self):
+        word = tuple("abc")
+        variants = self.translator.nBest(word)
+        self.assertEqual(variants[0][1], ("X", "C"))
+        posteriors = [p for p, right in variants]
+        self.assertEqual(posteriors, sorted(posteriors, reverse=True))
+        self.assertAlmostEqual(sum(posteriors), 1.0)
+        self.assertEqual(self.translator.nBest(word, 2), variants[:2])
+        self.assertEqual(self.translator.nBest(word, mass=0.5), variants[:1])
+        self.assertEqual(self.translator.variants(word, 1.0, 3), variants[:3])
+        self.assertRaises(
+            Translator.TranslationFailure, self.translator.nBest, tuple("abd")
+        )
+
+    def testLazyNBest(self):
+        words = [tuple(w) for w in ("abc", "cab", "ccab", "abab")]
+        expected = [self.translator.nBest(w, 4) for w in words]
+        self.translator.setLazyNBest()
+        def rounded(variants):  # ties may come in any order
+            return sorted((round(p, 9), r) for p, r in variants)
+
+        for word, variants in zip(words, expected):
+            self.assertEqual(rounded(self.translator.nBest(word, 4)), rounded(variants))
+        self.assertEqual(self.translator.nBest(words[0], mass=0.5), expected[0][:1])
+
+        self.translator.setLazyNBest(exactPosteriors=False)
+        variants = self.translator.nBest(words[0], 2)
+        self.assertEqual(variants[0][1], expected[0][0][1])
+        self.assertAlmostEqual(sum(p for p, r in variants), 1.0)
+        self.assertRaises(
+            Translator.TranslationFailure, self.translator.nBest, words[0]
+        )
+        self.assertRaises(
+            Translator.TranslationFailure, self.translator.nBest, tuple("abd"), 2
+        )
+
+    def testStatistics(self):
+        self.translator.statistics(reset=True)
+        words = [tuple("abc"), tuple("abd"), tuple("cab")]
+        self.translator.translateBatch(words)
+        self.translator.nBest(tuple("abc"), 3)
+        statistics = self.translator.statistics()
+        self.assertEqual(statistics["searches"], 4)
+        self.assertEqual(statistics["failures"], 1)
+        for name in Translator.statisticsCounters:
+            histogram = statistics[name]["histogram"]
+            self.assertEqual(sum(count for lower, upper, count in histogram), 4)
+        self.assertTrue(statistics["expanded"]["max"] > 0)
+        self.assertTrue(statistics["graphNodes"]["max"] > 0)
+        slowest = statistics["slowest"]
+        self.assertEqual(
+            sorted(tuple(s["left"]) for s in slowest), sorted(words + words[:1])
+        )
+        self.assertEqual([s["failed"] for s in slowest].count(True), 1)
+
+        merged = Translator.mergeStatistics(statistics, statistics)
+        self.assertEqual(merged["searches"], 8)
+        expanded = statistics["expanded"]["total"]
+        self.assertEqual(merged["expanded"]["total"], 2 * expanded)
+        self.assertEqual(len(merged["slowest"]), 8)
+
+        time = statistics["microseconds"]
+        self.assertTrue(Translator.histogramQuantile(time, 0.99) <= time["max"])
+
+        self.translator.statistics(reset=True)
+        self.assertEqual(self.translator.statistics()["searches"], 0)
+
+        # nBestNext() adds to the totals of the search begun by nBestInit()
+        context = self.translator.nBestInit(tuple("abc"))
+        expanded = self.translator.statistics()["expanded"]["total"]
+        self.translator.nBestNext(context)
+        self.translator.nBestNext(context)
+        statistics = self.translator.statistics()
+        self.assertEqual(statistics["searches"], 1)
+        self.assertTrue(statistics["expanded"]["total"] > expanded)
+
+    def testBinaryModel(self):
+        fd, fname = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            ModelFile.save(self.model, fname)
+            self.assertTrue(ModelFile.isBinaryModelFile(fname))
+            model = ModelFile.load(fname)
+        finally:
+            os.remove(fname)
+        self.assertEqual(model.sequenceModel.get(), self.model.sequenceModel.get())
+        self.assertEqual(model.sequitur.symbols(), self.model.sequitur.symbols())
+        translator = Translator(model)
+        for word in ("abc", "cab", "ccab"):
+            self.assertEqual(
+                translator.firstBest(tuple(word)), self.translator.firstBest(tuple(word))
+            )
+
+    def testCorruptBinaryModel(self):
+        import struct
+
+        fd, fname = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            ModelFile.save(self.model, fname)
+            with open(fname, "rb") as f:
+                data = bytearray(f.read())
+            header = struct.unpack_from(ModelFile.headerFormat, data, 0)
+            imageOffset = header[4]
+            # image header: magic, byte order, node size, word probability
+            # size, number of nodes, ...
+            nodeSize, _, nNodes = struct.unpack_from("<III", data, imageOffset + 12)
+            nodesOffset = imageOffset + 40
+            corrupt = data[:]
+            corrupt[nodesOffset : nodesOffset + nodeSize * nNodes] = b"\xff" * (
+                nodeSize * nNodes
+            )
+            for image in (corrupt, data[:-8]):
+                with open(fname, "wb") as f:
+                    f.write(image)
+                self.assertRaises(ValueError, ModelFile.load, fname)
+        finally:
+            os.remove(fname)
+
+    def testCachedTranslator(self):
+        cached = CachedTranslator(self.translator, 2)
+        self.assertEqual(cached(tuple("abc")), self.translator(tuple("abc")))
+        self.assertEqual(cached(tuple("abc")), self.translator(tuple("abc")))
+        self.assertRaises(Translator.TranslationFailure, cached, tuple("abd"))
+        self.assertRaises(Translator.TranslationFailure, cached, tuple("abd"))
+        self.assertEqual((cached.hits, cached.misses), (2, 2))
+        cached(tuple("cab"))
+        self.assertEqual(len(cached.cache), 2)
+        self.assertFalse((tuple("abc"),) in cached.cache)
+        variants = cached.variants(tuple("abc"), 1.0, 2)
+        self.assertEqual(len(variants), 2)
+        self.assertEqual(variants[0][1], ("X", "C"))
+        self.assertTrue(variants[0][0] > variants[1][0])
+        self.assertEqual(cached.variants(tuple("abc"), 1.0, 2), variants)
+        self.assertEqual(variants, self.translator.variants(tuple("abc"), 1.0, 2))
+
+        cached = CachedTranslator(self.translator, 10)
+        words = [tuple(w) for w in ("abc", "abd", "cab")]
+        self.assertEqual(
+            cached.firstBest(words[0]), self.translator.firstBest(words[0])
+        )
+        results = cached.translateBatch(words + words[1:2])
+        self.assertEqual((cached.hits, cached.misses), (1, 3))
+        self.assertEqual(
+            results[0::2], [self.translator.firstBest(w) for w in words[::2]]
+        )
+        self.assertTrue(isinstance(results[1], Translator.TranslationFailure))
+        self.assertTrue(isinstance(results[3], Translator.TranslationFailure))
+        again = cached.translateBatch(words)
+        self.assertEqual(again[0::2], results[0:3:2])
+        self.assertTrue(isinstance(again[1], Translator.TranslationFailure))
+        self.assertEqual((cached.hits, cached.misses), (4, 3))
+
+    def testPersistentCache(self):
+        fd, fname = tempfile.mkstemp()
+        os.close(fd)
+        words = [tuple("abc"), tuple("abd"), tuple("cab")]
+        try:
+            cached = PersistentCachedTranslator(self.translator, fname, "one")
+            results = cached.translateBatch(words)
+            self.assertEqual(cached(tuple("cab")), results[2][1])
+            cached.close()
+
+            cached = PersistentCachedTranslator(self.translator, fname, "one")
+            self.assertEqual(cached.firstBest(tuple("abc")), results[0])
+            self.assertEqual(cached.translateBatch(words)[2], results[2])
+            self.assertEqual((cached.hits, cached.misses), (3, 1))
+            cached.close()
+
+            cached = PersistentCachedTranslator(self.translator, fname, "two")
+            self.assertEqual(cached(tuple("abc")), results[0][1])
+            self.assertEqual((cached.hits, cached.misses), (0, 1))
+            cached.close()
+
+            # results of a different search configuration are not reused
+            import g2p
+
+            options = dict(
+                stack_limit=None,
+                beam=None,
+                beam_size=None,
+                lazy_nbest=False,
+                approximate_posteriors=False,
+                cacheFile=fname,
+            )
+            for beam, expected in ((None, (0, 1)), (5.0, (0, 1)), (None, (1, 0))):
+                values = optparse.Values(dict(options, beam=beam))
+                cached = g2p.makeTranslator(self.model, values)
+                self.assertEqual(cached(tuple("abc")), results[0][1])
+                self.assertEqual((cached.hits, cached.misses), expected)
+                cached.close()
+        finally:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(fname + suffix):
+                    os.remove(fname + suffix)
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "needs Unix domain sockets")
+    def testServer(self):
+        from TranslationServer import TranslationServer, TranslationClient
+
+        path = os.path.join(tempfile.mkdtemp(), "g2p.sock")
+        server = TranslationServer(path, self.translator)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            with TranslationClient(path) as client:
+                self.assertEqual(client.translate("abc"), ("X", "C"))
+                self.assertEqual(
+                    client.translate("abc", variants=2),
+                    self.translator.nBest(tuple("abc"), 2),
+                )
+                self.assertRaises(client.TranslationFailure, client.translate, "abd")
+                requests = ["cab", {"id": 1, "left": ["a", "b", "c"]}, {"id": 2}]
+                replies = [reply for request, reply in client.translateMany(requests)]
+                self.assertEqual(
+                    tuple(replies[0]["right"]), self.translator(tuple("cab"))
+                )
+                self.assertEqual(replies[1], dict(replies[1], id=1, right=["X", "C"]))
+                self.assertEqual(replies[2]["id"], 2)
+                self.assertTrue("error" in replies[2])
+
+                # bad requests fail on their own, and do not add symbols
+                inventorySize = self.model.sequitur.leftInventory.size()
+                requests = ["abc", {"left": [["x"]]}, "xyz", {"word": 5}, "cab"]
+                replies = [reply for request, reply in client.translateMany(requests)]
+                self.assertEqual(replies[0]["right"], ["X", "C"])
+                self.assertEqual([("error" in r) for r in replies[1:4]], [True] * 3)
+                self.assertEqual(
+                    tuple(replies[4]["right"]), self.translator(tuple("cab"))
+                )
+                self.assertEqual(
+                    self.model.sequitur.leftInventory.size(), inventorySize
+                )
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+
+    def testAsyncTranslator(self):
+        words = [tuple(w) for w in ("abc", "cab", "abd", "ccab", "ab", "ba")] * 50
+
+        def translate(word):
+            try:
+                return self.translator.firstBest(word)
+            except Translator.TranslationFailure:
+                return None
+
+        async def translateAsync(translator, word):
+            try:
+                return await translator.firstBest(word)
+            except translator.TranslationFailure:
+                return None
+
+        async def run(translator):
+            results = await asyncio.gather(
+                *[translateAsync(translator, word) for word in words]
+            )
+            variants = [v async for v in translator.nbest(words[0], 3)]
+            return results, variants
+
+        translator = AsyncTranslator(self.translator, workers=2, maxPending=64)
+        results, variants = asyncio.run(run(translator))
+        translator.close()
+        self.assertEqual(results, list(map(translate, words)))
+        self.assertEqual(variants, self.translator.nBest(words[0], 3))
+        self.assertTrue(translator.batches < len(words) / 8)
+
+        # n-best requests queue up with the first-best ones on a single
+        # worker, and do not keep the later batches from being started
+        async def mixed(translator):
+            async def nBest(word):
+                return [v async for v in translator.nbest(word, 2)]
+
+            return await asyncio.gather(
+                *[
+                    nBest(word) if i % 12 == 0 else translateAsync(translator, word)
+                    for i, word in enumerate(words)
+                ]
+            )
+
+        translator = AsyncTranslator(self.translator, workers=1)
+        results = asyncio.run(mixed(translator))
+        translator.close()
+        self.assertEqual(
+            results,
+            [
+                self.translator.nBest(word, 2) if i % 12 == 0 else translate(word)
+                for i, word in enumerate(words)
+            ],
+        )
+
+        # a failed batch raises a separate exception in each of its callers
+        class Broken:
+            def translateBatch(self, lefts):
+                raise RuntimeError("broken")
+
+        async def broken(translator):
+            return await asyncio.gather(
+                *[translator.firstBest(word) for word in words[:3]],
+                return_exceptions=True,
+            )
+
+        translator = AsyncTranslator(Broken())
+        errors = asyncio.run(broken(translator))
+        translator.close()
+        self.assertTrue(all(isinstance(e, RuntimeError) for e in errors))
+        self.assertEqual(len(set(map(id, errors))), len(errors))
+
+    def testModelHandle(self):
+        log = open(os.devnull, "w")
+        handle = ModelHandle(lambda: self.model, warmUp=[tuple("abc")], log=log)
+        self.assertEqual(handle(tuple("abc")), ("X", "C"))
+        busy = handle.acquire()
+        handle.reload(wait=True)
+        self.assertTrue(handle.current is not busy)
+        self.assertTrue(busy.translator is not None)
+        self.assertEqual(busy.translator(tuple("cab")), handle(tuple("cab")))
+        handle.done(busy)
+        self.assertTrue(busy.translator is None)
+        self.assertEqual(len(handle.reloads), 1)
+        self.assertTrue(handle.reloads[0]["drainSeconds"] >= 0)
+        # warm-up and two words on the old, warm-up and one word on the new one
+        self.assertEqual(handle.statistics()["searches"], 5)
+
+        # close() writes out the persistent cache of the current model
+        fd, fname = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            handle = ModelHandle(
+                lambda: self.model,
+                lambda model: PersistentCachedTranslator(
+                    Translator(model), fname, "one"
+                ),
+                log=log,
+            )
+            handle(tuple("abc"))
+            handle.close()
+            cached = PersistentCachedTranslator(self.translator, fname, "one")
+            cached(tuple("abc"))
+            self.assertEqual((cached.hits, cached.misses), (1, 0))
+            cached.close()
+        finally:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(fname + suffix):
+                    os.remove(fname + suffix)
+        log.close()
+
+    def applyFile(self, module, lines, **options):
+        """
+        Run module.mainApply on the input lines, returning what it
+        writes to the output and to stderr.
+        """
+        fd, fname = tempfile.mkstemp()
+        with os.fdopen(fd, "w", encoding="UTF-8") as f:
+            f.writelines(line + "\n" for line in lines)
+        values = dict(
+            applySample=fname,
+            encoding="UTF-8",
+            phoneme_to_phoneme=False,
+            shouldTranspose=False,
+            variants_mass=None,
+            variants_number=None,
+            jobs=None,
+            stack_limit=None,
+            beam=None,
+            beam_size=None,
+            lazy_nbest=False,
+            approximate_posteriors=False,
+            cacheFile=None,
+        )
+        values.update(options)
+        output, errors = io.StringIO(), io.StringIO()
+        try:
+            with unittest.mock.patch.object(module, "stderr", errors, create=True):
+                module.mainApply(self.translator, optparse.Values(values), output)
+        finally:
+            os.remove(fname)
+        return output.getvalue(), errors.getvalue()
+
+    def testApplyJobs(self):
+        import g2p
+
+        words = ["abc", "cab", "abd", "ccab", "ab", "ba", "abc", "c"]
+        with unittest.mock.patch.object(g2p, "applyChunkSize", 3):
+            for variants in (None, 3):
+                serial = self.applyFile(g2p, words, variants_number=variants)
+                parallel = self.applyFile(
+                    g2p, words, variants_number=variants, jobs=2
+                )
+                self.assertEqual(parallel, serial)
+                self.assertTrue('failed to convert "abd"' in serial[1])
+                if variants is None:
+                    expected = [
+                        "%s\t%s" % (word, " ".join(self.translator(tuple(word))))
+                        for word in words
+                        if word != "abd"
+                    ]
+                    self.assertEqual(serial[0].splitlines(), expected)
+
+    def testApplySentences(self):
+        import g2p_sentences
+
+        lines = ["abc cab", "abd abc", "", "c"]
+        output, errors = self.applyFile(
+            g2p_sentences,
+            lines,
+            sentence_window=None,
+            cache_size=None,
+            sentence_separator=" # ",
+        )
+
+        def transcribe(word):
+            return " ".join(self.translator(tuple(word)))
+
+        # the failed word is left out of its sentence
+        self.assertEqual(
+            output.splitlines(),
+            [
+                "abc cab\t%s # %s" % (transcribe("abc"), transcribe("cab")),
+                "abd abc\t%s" % transcribe("abc"),
+                "c\t%s" % transcribe("c"),
+            ],
+        )
+        self.assertTrue("Input lines: 3\n" in errors)
+        self.assertTrue("Output lines: 3\n" in errors)
+        self.assertTrue("Failed conversions: 1\n" in errors)
+
+    def testSentenceWindow(self):
+        import g2p_sentences
+
+        items = [("a", ("a",), "1:a b"), ("b", ("b",), "1:a b"), ("c", ("c",), "2:c")]
+        items += [("x", ("x",)), ("y", ("y",))]
+        self.assertEqual(
+            list(g2p_sentences.groupSentences(iter(items))),
+            [("1:a b", items[:2]), ("2:c", items[2:3])]
+            + [(None, [item]) for item in items[3:]],
+        )
+
+        lefts = [tuple(w) for w in ("abc", "abd", "cab")]
+        for translator in (self.translator, CachedTranslator(self.translator, 2)):
+            converted = g2p_sentences.translateWords(translator, lefts)
+            self.assertEqual(sorted(converted), sorted(lefts))
+            self.assertTrue(
+                isinstance(converted[tuple("abd")], Translator.TranslationFailure)
+            )
+            self.assertEqual(converted[tuple("cab")], self.translator(tuple("cab")))
+
+        lines = ["abc cab", "abd abc", "", "cab cab ccab", "ab abd abc", "c"]
+        options = dict(cache_size=None, sentence_separator=" # ")
+        for variants in (None, 3):
+            single = self.applyFile(
+                g2p_sentences,
+                lines,
+                sentence_window=1,
+                variants_number=variants,
+                **options,
+            )
+            windowed = self.applyFile(
+                g2p_sentences,
+                lines,
+                sentence_window=3,
+                variants_number=variants,
+                **options,
+            )
+            # the messages of the reader come earlier with the smaller window
+            self.assertEqual(windowed[0], single[0])
+            self.assertEqual(
+                sorted(windowed[1].splitlines()), sorted(single[1].splitlines())
+            )
+            self.assertEqual(single[1].count('Failed to convert "abd"'), 2)
+
+    def testThreads(self):
+        words = [tuple(w) for w in ("abc", "cab", "abd", "ccab", "ab", "ba")] * 50
+
+        def translate(word):
+            try:
+                return self.translator.firstBest(word)
+            except Translator.TranslationFailure:
+                return None
+
+        expected = list(map(translate, words))
+        results = [None] * len(words)
+        self.model.sequenceModel.setSuccessorCacheSize(4096)
+
+        def worker(offset):
+            for i in range(offset, len(words), 4):
+                results[i] = translate(words[i])
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, expected)
+
+
 if __name__ == "__main__":
     unittest.main()